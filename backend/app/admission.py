@@ -0,0 +1,332 @@
+# app/admission.py
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from .llm import DEFAULT_ENDPOINT_LIMITS, ModelBusyError
+from .metrics import ADMISSION_QUEUED, ADMISSION_SHED, ADMISSION_WAIT_SECONDS
+
+# --- ADMISSION CONTROL ---
+# Every Gemini-backed route used to compete for the same concurrency slots in arrival
+# order, so a burst of /generate_game_item polling could keep a Dojo player's /score
+# waiting. The AdmissionController hands out those slots instead:
+#   - routes belong to a priority class; a free slot always goes to the most urgent
+#     waiting class, and lower classes may only hold a share of the slots, so some are
+#     always left for interactive calls;
+#   - each class has a bounded queue and a deadline. Calls that can't start in time are
+#     shed with a 503 + Retry-After: at once if the queue is full or the estimated wait
+#     is already past the deadline, otherwise when the deadline expires;
+#   - some routes also have their own cap on concurrent calls (image analysis, game
+#     items, scenarios); calls over it wait in the same queues, under the same deadline;
+#   - within a class, waiting clients are served round-robin. In the standard and
+#     background classes each client can also hold and queue only a few calls, so one
+#     client can't monopolize capacity. Interactive calls are exempt: a classroom behind
+#     one NAT address shows up as a single client.
+# Calls made outside a request (warm pools, the catalog job) are always "background".
+
+PRIORITIES = ("interactive", "standard", "background")
+INTERACTIVE, STANDARD, BACKGROUND = range(len(PRIORITIES))
+
+DEFAULT_ROUTE_PRIORITIES = {
+    "score": INTERACTIVE,
+    "generate_scenario": STANDARD,
+    "generate_lesson": STANDARD,
+    "generate_quiz": STANDARD,
+    "get_mini_lesson": STANDARD,
+    "analyze_image": STANDARD,
+    "score_batch": BACKGROUND,
+    "generate_game_item": BACKGROUND,
+}
+
+# Seconds a call may wait for a slot, per class
+DEFAULT_DEADLINES = (8.0, 15.0, 30.0)
+# Longest queue per class
+DEFAULT_MAX_QUEUE = (200, 100, 50)
+# Share of the slots each class may hold at once
+DEFAULT_SHARES = (1.0, 0.75, 0.5)
+
+# Who is asking: set per request by ClientKeyMiddleware, None outside requests
+client_key_var = ContextVar("client_key", default=None)
+
+
+class AdmissionRejected(ModelBusyError):
+    """ A call shed before reaching the model. A ModelBusyError, so routes answer 503 + Retry-After. """
+    def __init__(self, message: str, retry_after: int, reason: str):
+        super().__init__(message, retry_after)
+        self.reason = reason
+
+
+# Classes whose calls count against the per-client caps
+DEFAULT_CLIENT_CAPPED = (STANDARD, BACKGROUND)
+
+
+def route_of(endpoint: str) -> str:
+    """ Repair re-asks ("score:repair") share their route's class and cap. """
+    return endpoint.split(":")[0]
+
+
+class AdmissionController:
+    """
+    Priority scheduler for `capacity` model-call slots. `slot(endpoint)` is an async
+    context manager that waits for a slot or raises AdmissionRejected.
+    `route_limits` caps concurrent calls per route on top of the class shares.
+    """
+    def __init__(self, capacity: int = 16, deadlines=DEFAULT_DEADLINES, max_queue=DEFAULT_MAX_QUEUE,
+                 shares=DEFAULT_SHARES, max_per_client: int = 4, max_queued_per_client: int = 8,
+                 route_priorities: dict = None, route_limits: dict = None,
+                 client_capped=DEFAULT_CLIENT_CAPPED):
+        self.capacity = capacity
+        self.deadlines = tuple(deadlines)
+        self.max_queue = tuple(max_queue)
+        self.limits = tuple(max(1, int(capacity * share)) for share in shares)
+        self.max_per_client = max_per_client
+        self.max_queued_per_client = max_queued_per_client
+        self.client_capped = frozenset(client_capped)
+        self.route_priorities = dict(DEFAULT_ROUTE_PRIORITIES)
+        self.route_priorities.update(route_priorities or {})
+        self.route_limits = dict(DEFAULT_ENDPOINT_LIMITS)
+        self.route_limits.update(route_limits or {})
+        self._in_use = 0
+        self._class_in_use = [0] * len(PRIORITIES)
+        self._client_in_use = {}
+        self._route_in_use = {}
+        self._route_queued = {}
+        # Per class: client -> deque of waiting (future, route), in round-robin order
+        self._queues = [OrderedDict() for _ in PRIORITIES]
+        self._queued = [0] * len(PRIORITIES)
+        # Moving average of how long a slot is held, for estimating queue waits
+        self._service_seconds = 2.0
+        self.stats = {name: {"admitted": 0, "queued": 0, "shed": 0, "timed_out": 0} for name in PRIORITIES}
+
+    def priority_for(self, endpoint: str, client) -> int:
+        if client is None:
+            return BACKGROUND
+        return self.route_priorities.get(route_of(endpoint), STANDARD)
+
+    def _client_ok(self, cls: int, client) -> bool:
+        return client is None or cls not in self.client_capped or self._client_in_use.get(client, 0) < self.max_per_client
+
+    def _route_ok(self, route: str) -> bool:
+        limit = self.route_limits.get(route)
+        return limit is None or self._route_in_use.get(route, 0) < limit
+
+    def _can_grant(self, cls: int, client, route: str) -> bool:
+        return (self._in_use < self.capacity
+                and self._class_in_use[cls] < self.limits[cls]
+                and self._client_ok(cls, client)
+                and self._route_ok(route))
+
+    def _grant(self, cls: int, client, route: str):
+        self._in_use += 1
+        self._class_in_use[cls] += 1
+        self._route_in_use[route] = self._route_in_use.get(route, 0) + 1
+        if client is not None:
+            self._client_in_use[client] = self._client_in_use.get(client, 0) + 1
+        self.stats[PRIORITIES[cls]]["admitted"] += 1
+
+    def _release(self, cls: int, client, route: str):
+        self._in_use -= 1
+        self._class_in_use[cls] -= 1
+        self._route_in_use[route] -= 1
+        if client is not None:
+            remaining = self._client_in_use.get(client, 1) - 1
+            if remaining:
+                self._client_in_use[client] = remaining
+            else:
+                self._client_in_use.pop(client, None)
+        self._dispatch()
+
+    def _dequeued(self, cls: int, route: str):
+        self._queued[cls] -= 1
+        self._route_queued[route] -= 1
+        ADMISSION_QUEUED.dec(priority=PRIORITIES[cls])
+
+    def _dispatch(self):
+        """
+        Hands free slots to waiters: most urgent class first, round-robin over clients.
+        A client whose next call is over its own or its route's cap is passed over.
+        """
+        for cls, queue in enumerate(self._queues):
+            while queue and self._in_use < self.capacity and self._class_in_use[cls] < self.limits[cls]:
+                for client, waiters in queue.items():
+                    if self._client_ok(cls, client) and self._route_ok(waiters[0][1]):
+                        break
+                else:
+                    break   # every waiting client in this class is at a cap
+                waiters = queue.pop(client)
+                future, route = waiters.popleft()
+                if waiters:
+                    queue[client] = waiters   # back of the round-robin order
+                self._dequeued(cls, route)
+                self._grant(cls, client, route)
+                future.set_result(None)
+            if self._in_use >= self.capacity:
+                return
+
+    def _remove(self, cls: int, client, future, route: str):
+        waiters = self._queues[cls].get(client)
+        if waiters is not None and (future, route) in waiters:
+            waiters.remove((future, route))
+            if not waiters:
+                del self._queues[cls][client]
+            self._dequeued(cls, route)
+
+    def _shed(self, cls: int, reason: str, estimate: float):
+        name = PRIORITIES[cls]
+        self.stats[name]["shed" if reason != "timeout" else "timed_out"] += 1
+        ADMISSION_SHED.inc(priority=name, reason=reason)
+        retry_after = max(1, min(60, math.ceil(estimate)))
+        raise AdmissionRejected(f"The server is busy, please try again shortly. ({reason})", retry_after, reason)
+
+    def estimated_wait(self, cls: int, route: str = None) -> float:
+        """
+        Seconds until a new call of this class (and route) would start, from the waiters
+        ahead of it: the class's, or the route's if its own cap is the tighter one.
+        """
+        ahead = sum(self._queued[:cls + 1])
+        wait = (ahead + 1) / self.limits[cls] * self._service_seconds
+        limit = self.route_limits.get(route)
+        if limit is not None:
+            wait = max(wait, (self._route_queued.get(route, 0) + 1) / limit * self._service_seconds)
+        return wait
+
+    async def acquire(self, endpoint: str):
+        """ Waits for a slot. Returns (class, client, route) for `release`. """
+        client = client_key_var.get()
+        cls = self.priority_for(endpoint, client)
+        route = route_of(endpoint)
+        if not any(self._queued[:cls + 1]) and self._can_grant(cls, client, route):
+            self._grant(cls, client, route)
+            return cls, client, route
+
+        deadline = self.deadlines[cls]
+        estimate = self.estimated_wait(cls, route)
+        if self._queued[cls] >= self.max_queue[cls]:
+            self._shed(cls, "queue_full", estimate)
+        if (client is not None and cls in self.client_capped
+                and len(self._queues[cls].get(client, ())) >= self.max_queued_per_client):
+            self._shed(cls, "client_queue_full", estimate)
+        if estimate > deadline:
+            self._shed(cls, "deadline", estimate)
+
+        future = asyncio.get_running_loop().create_future()
+        self._queues[cls].setdefault(client, deque()).append((future, route))
+        self._queued[cls] += 1
+        self._route_queued[route] = self._route_queued.get(route, 0) + 1
+        self.stats[PRIORITIES[cls]]["queued"] += 1
+        ADMISSION_QUEUED.inc(priority=PRIORITIES[cls])
+        self._dispatch()
+
+        started = time.perf_counter()
+        try:
+            await asyncio.wait({future}, timeout=deadline)
+        except asyncio.CancelledError:
+            if future.done():
+                self._release(cls, client, route)
+            else:
+                self._remove(cls, client, future, route)
+            raise
+        # Checked on the future, not wait()'s result: it may have been granted right after the timeout
+        if not future.done():
+            self._remove(cls, client, future, route)
+            self._shed(cls, "timeout", self.estimated_wait(cls, route))
+        ADMISSION_WAIT_SECONDS.observe(time.perf_counter() - started, priority=PRIORITIES[cls])
+        return cls, client, route
+
+    def release(self, cls: int, client, route: str, held_seconds: float):
+        self._service_seconds += 0.2 * (held_seconds - self._service_seconds)
+        self._release(cls, client, route)
+
+    @asynccontextmanager
+    async def slot(self, endpoint: str):
+        cls, client, route = await self.acquire(endpoint)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(cls, client, route, time.perf_counter() - started)
+
+    def snapshot(self) -> dict:
+        return {
+            "capacity": self.capacity,
+            "in_use": self._in_use,
+            "clients_in_flight": len(self._client_in_use),
+            "service_seconds": round(self._service_seconds, 3),
+            "classes": {
+                name: {
+                    **self.stats[name],
+                    "in_use": self._class_in_use[cls],
+                    "limit": self.limits[cls],
+                    "waiting": self._queued[cls],
+                    "deadline_seconds": self.deadlines[cls],
+                }
+                for cls, name in enumerate(PRIORITIES)
+            },
+            "routes": {
+                route: {"limit": limit, "in_use": self._route_in_use.get(route, 0), "waiting": self._route_queued.get(route, 0)}
+                for route, limit in self.route_limits.items()
+            },
+        }
+
+
+def client_address(forwarded_for: str, peer: str, trusted_hops: int) -> str:
+    """
+    The caller's address. Each trusted proxy appends the address it received the request
+    from to X-Forwarded-For, so the client's own address is `trusted_hops` from the end;
+    anything before that was written by the client and can't be trusted.
+    """
+    hops = [hop.strip() for hop in forwarded_for.split(",") if hop.strip()]
+    if trusted_hops <= 0 or not hops:
+        return peer
+    return hops[-min(trusted_hops, len(hops))]
+
+
+class ClientKeyMiddleware:
+    """
+    Pure ASGI middleware that identifies the caller for per-client fairness by network
+    address: the X-Forwarded-For hop appended by the last of `trusted_hops` proxies
+    (Render adds one), else the peer address. There is no authentication, so ids the
+    client sends (e.g. an X-User-ID header) are not used: they could be rotated to
+    escape the per-client caps.
+    """
+    def __init__(self, app, trusted_hops: int = None):
+        self.app = app
+        self.trusted_hops = trusted_hops if trusted_hops is not None else int(os.getenv("TRUSTED_PROXY_HOPS", "1"))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope.get("headers") or [])
+        forwarded = headers.get(b"x-forwarded-for", b"").decode("latin-1")
+        peer = scope.get("client")
+        key = f"ip:{client_address(forwarded, peer[0] if peer else 'unknown', self.trusted_hops)}"
+        token = client_key_var.set(key)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            client_key_var.reset(token)
+
+
+def build_admission_controller():
+    """
+    ADMISSION=0 turns the scheduler off (plain first-come slots). Capacity follows
+    LLM_MAX_CONCURRENCY; ADMISSION_DEADLINE_<CLASS> and ADMISSION_QUEUE_<CLASS> override a
+    class's deadline (seconds) and queue length, ADMISSION_MAX_PER_CLIENT the slots one
+    client may hold in the standard and background classes. LLM_ENDPOINT_LIMIT_<ROUTE>
+    overrides a route's concurrency cap.
+    """
+    if os.getenv("ADMISSION", "1") != "1":
+        return None
+    capacity = int(os.getenv("LLM_MAX_CONCURRENCY", "16"))
+    return AdmissionController(
+        capacity=capacity,
+        deadlines=[float(os.getenv(f"ADMISSION_DEADLINE_{name.upper()}", default)) for name, default in zip(PRIORITIES, DEFAULT_DEADLINES)],
+        max_queue=[int(os.getenv(f"ADMISSION_QUEUE_{name.upper()}", default)) for name, default in zip(PRIORITIES, DEFAULT_MAX_QUEUE)],
+        max_per_client=int(os.getenv("ADMISSION_MAX_PER_CLIENT", str(max(2, capacity // 4)))),
+        max_queued_per_client=int(os.getenv("ADMISSION_MAX_QUEUED_PER_CLIENT", "8")),
+        route_limits={route: int(os.getenv(f"LLM_ENDPOINT_LIMIT_{route.upper()}", limit)) for route, limit in DEFAULT_ENDPOINT_LIMITS.items()},
+    )
@@ -1,14 +1,36 @@
 import os
 import json
+import hashlib
 import uuid
-from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
-from PIL import Image
-import io
-from .models import ScoreRequest, ScoreResponse, ScenarioRequest, ScenarioResponse, TelemetryData, LearnRequest, LearnResponse, QuizRequest, QuizResponse, GameItemResponse, UpdateScoreRequest, ImageAnalysisResponse, MiniLessonRequest,MiniLessonResponse
-import google.generativeai as genai
+import asyncio
+import logging
+from fastapi import APIRouter, HTTPException, Depends, UploadFile, File, Response, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from .models import ScoreRequest, ScoreResponse, ScenarioRequest, ScenarioResponse, TelemetryData, LearnRequest, LearnResponse, QuizRequest, QuizResponse, GameItemResponse, UpdateScoreRequest, BulkUpdateScoreRequest, ImageAnalysisResponse, MiniLessonRequest,MiniLessonResponse, ScoreBatchRequest, ScoreBatchResponse, ScoreBatchResult, ScoreBatchOutput, ScenarioDraft
 from dotenv import load_dotenv
-from .database import SessionLocal, Leaderboard
-from sqlalchemy.orm import Session
+from pydantic import ValidationError
+from .cache import build_response_cache, prompt_version, MemoryCache
+from .llm import build_gemini_client, ModelBusyError
+from .parsing import StructuredDecoder, ResponseParseError, json_mode
+from .streaming import stream_model_events, replay_events, format_event, wants_sse, NDJSON_MEDIA_TYPE, SSE_MEDIA_TYPE
+from .xp import build_xp_batcher, XPBacklogFull
+from .leaderboard import build_leaderboard_engine
+from .telemetry import build_telemetry_pipeline, summarize_rollup
+from .imaging import read_upload, prepare_image_async, StageTimer, summarize_stages
+from .pools import WarmPool, pool_settings, pool_topics
+from .similarity import build_score_cache, normalize_reply
+from .startup import Readiness
+from .shared_state import build_shared_store
+from .scenarios import build_scenario_registry
+from .catalog import build_content_catalog
+from .admission import build_admission_controller
+from .responses import FastJSONResponse
+from .prescreen import build_prescreener, merge_flags
+from .metrics import registry, DB_QUERY_SECONDS, CACHE_LOOKUPS, CACHE_ENTRIES, POOL_READY, POOL_POPS, TELEMETRY_QUEUED, TELEMETRY_EVENTS, XP_PENDING, PRESCREEN_OUTCOMES
+from typing import Optional
+
+logger = logging.getLogger(__name__)
 
 # --- SETUP ---
 
@@ -20,15 +42,37 @@ GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 if not GOOGLE_API_KEY:
     raise ValueError("No GOOGLE_API_KEY found. Please set it in your .env file.")
 
-genai.configure(api_key=GOOGLE_API_KEY)
+def create_model():
+    """
+    Initialize the Gemini model. Called on the first model request rather than at import:
+    loading the SDK is the slowest part of a cold start.
+    """
+    import google.generativeai as genai
+    genai.configure(api_key=GOOGLE_API_KEY)
+    # We use gemini-1.5-flash as it's fast and cost-effective.
+    return genai.GenerativeModel('gemini-2.0-flash-lite')
+
+# State that has to agree across worker processes: the Gemini rate limit, cached
+# responses and scores, telemetry rollups and the leaderboard version (see shared_state.py)
+shared_store = build_shared_store()
+
+# Hands out model-call slots by route priority, sheds what can't start in time and
+# keeps one client from taking them all (see admission.py)
+admission = build_admission_controller()
 
-# Initialize the Gemini model
-# We use gemini-1.5-flash as it's fast and cost-effective.
-model = genai.GenerativeModel('gemini-2.0-flash-lite')
+# All endpoints call the model through this wrapper: concurrency caps, pacing,
+# retry/backoff and coalescing of identical prompts (see llm.py)
+llm = build_gemini_client(model_factory=create_model, store=shared_store, scheduler=admission)
+
+# JSON-mode generation with local repair and a cheap re-ask fallback (see parsing.py)
+structured = StructuredDecoder(llm)
 
 # APIRouter allows us to organize endpoints
 router = APIRouter()
 
+# Shared cache for lessons, quizzes and mini-lessons (see cache.py)
+response_cache = build_response_cache(shared_store)
+
 # --- PROMPT ENGINEERING for Scoring  ---
 
 # This is the core instruction for our AI coach.
@@ -54,6 +98,50 @@ You MUST respond ONLY with a valid JSON object that follows this exact structure
 Analyze the following user reply and provide your assessment in the specified JSON format.
 """
 
+# Appended to the scoring prompt when we know which scenario the reply answers
+SCORING_SCENARIO_CONTEXT = """
+The user is replying to this scenario:
+Context: {context}
+Commenter: {character_persona}
+Hostile comment: "{hate_speech_comment}"
+"""
+
+def scoring_prompt_prefix(scenario: dict) -> str:
+    """ The scoring prompt up to the user's reply, grounded on one scenario. Built once per scenario. """
+    return SYSTEM_PROMPT_SCORING + SCORING_SCENARIO_CONTEXT.format(**scenario)
+
+# --- PROMPT ENGINEERING for Batch Scoring ---
+# Same rubric as above, sent once for a whole group of replies.
+SYSTEM_PROMPT_SCORING_BATCH = """
+You are an AI coach for Netra, a platform that trains youth to de-escalate online hate speech. 
+Your task is to score several users' replies to hostile online comments based on a clear rubric. 
+For EACH reply you must provide a score (0-3), a concise rationale for each criterion, and a constructive, improved rewrite of that reply.
+
+The rubric criteria are: "De-escalation", "Accuracy and reframing", "Care for targets/bystanders", "Platform fit", "Self-protection".
+
+You will receive the replies as a JSON list of {"id": "<id>", "reply": "<text>", "comment": "<text>"} objects.
+"comment" is the hostile comment the reply answers; it is left out when unknown.
+You MUST respond ONLY with a valid JSON object that follows this exact structure, with exactly one entry per reply, using the same "id":
+{
+  "results": [
+    {
+      "id": "<The id of the reply>",
+      "scores": [
+        {"criterion": "De-escalation", "score": <0-3>, "rationale": "<Your rationale>"},
+        {"criterion": "Accuracy and reframing", "score": <0-3>, "rationale": "<Your rationale>"},
+        {"criterion": "Care for targets/bystanders", "score": <0-3>, "rationale": "<Your rationale>"},
+        {"criterion": "Platform fit", "score": <0-3>, "rationale": "<Your rationale>"},
+        {"criterion": "Self-protection", "score": <0-3>, "rationale": "<Your rationale>"}
+      ],
+      "suggested_rewrite": "<Your improved version of this reply>",
+      "safety_flags": []
+    }
+  ]
+}
+
+Score each reply independently. Analyze the following replies and provide your assessment in the specified JSON format.
+"""
+
 # --- PROMPT ENGINEERING for Scenario Generation ---
 SYSTEM_PROMPT_SCENARIO = """
 You are a creative content designer for Netra, a training app against online hate speech.
@@ -170,213 +258,792 @@ You MUST respond ONLY with a valid JSON object that follows this exact structure
 }
 """
 
+def lesson_prompt(topic: str) -> str:
+    return f"{SYSTEM_PROMPT_LESSON}\n\nPlease generate a lesson on the topic of: '{topic}'."
+
+def quiz_prompt(topic: str) -> str:
+    return f"{SYSTEM_PROMPT_QUIZ}\n\nPlease generate a quiz on the topic of: '{topic}'."
+
+def mini_lesson_prompt(term: str) -> str:
+    return f"{SYSTEM_PROMPT_MINI_LESSON}\n\nPlease provide a mini-lesson for the term: '{term}'."
+
+# Pre-generated Learn Hub content, built by `python -m app.catalog` and loaded at startup
+# (see catalog.py). Endpoint name -> (system prompt, response model, prompt builder).
+CATALOG_KINDS = {
+    "generate_lesson": (SYSTEM_PROMPT_LESSON, LearnResponse, lesson_prompt),
+    "generate_quiz": (SYSTEM_PROMPT_QUIZ, QuizResponse, quiz_prompt),
+    "get_mini_lesson": (SYSTEM_PROMPT_MINI_LESSON, MiniLessonResponse, mini_lesson_prompt),
+}
+content_catalog = build_content_catalog(CATALOG_KINDS)
+
+def from_catalog(kind: str, subject: str):
+    return content_catalog.get(kind, subject) if content_catalog is not None else None
+
+def model_busy(e: ModelBusyError) -> HTTPException:
+    """ Turns an exhausted-retries model error into a 503 the client can back off from. """
+    return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
 # --- API ENDPOINT ---
 
-@router.post("/score", response_model=ScoreResponse)
-async def score_reply(request: ScoreRequest):
+# Every scenario we serve, so scoring can see the comment being answered (see scenarios.py)
+scenario_registry = build_scenario_registry(scoring_prompt_prefix, shared_store)
+
+async def scoring_prompt(user_reply: str, scenario_id: Optional[str] = None) -> str:
+    """ The scenario's cached prompt prefix (or the bare rubric for unknown ids) plus the reply. """
+    scenario = await scenario_registry.get(scenario_id) if scenario_id else None
+    prefix = scenario["prompt_prefix"] if scenario is not None else SYSTEM_PROMPT_SCORING
+    return f"{prefix}\n\nUser Reply to analyze: \"{user_reply}\""
+
+async def create_score(user_reply: str, scenario_id: Optional[str] = None) -> ScoreResponse:
     """
-    This endpoint receives a user's reply and returns an AI-generated score and feedback.
+    Scores a single reply with one model call. Used by /score and as the
+    last-resort fallback for /score_batch.
     """
-    try:
-        # Combine the system prompt with the user's specific reply
-        full_prompt = f"{SYSTEM_PROMPT_SCORING}\n\nUser Reply to analyze: \"{request.user_reply}\""
+    full_prompt = await scoring_prompt(user_reply, scenario_id)
+
+    # Call the Gemini API and validate the reply against our Pydantic model
+    return await structured.generate(full_prompt, ScoreResponse, endpoint="score")
+
+# Near-duplicate replies to the same scenario reuse an earlier score (see similarity.py)
+score_cache = build_score_cache()
+SCORE_PROMPT_VERSION = prompt_version(SYSTEM_PROMPT_SCORING + SCORING_SCENARIO_CONTEXT)
 
-        # Call the Gemini API
-        response = await model.generate_content_async(full_prompt)
+# Exact matches are also shared between workers; near-duplicate matching stays per process
+SHARED_SCORE_TTL_SECONDS = int(os.getenv("SHARED_SCORE_TTL_SECONDS", "86400"))
 
-        # The response text might have markdown backticks (```json ... ```) around the JSON.
-        # We need to clean this to parse it correctly.
-        cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
+def score_cache_key(scenario_id: str, user_reply: str, locale: str) -> tuple:
+    locale = locale or "en"
+    return (scenario_id, locale, SCORE_PROMPT_VERSION), normalize_reply(user_reply, locale)
 
-        # Convert the JSON string from the AI into a Python dictionary
-        ai_output = json.loads(cleaned_response_text)
+def shared_score_key(namespace: tuple, text: str) -> str:
+    return "score:" + hashlib.sha256(json.dumps([*namespace, text]).encode("utf-8")).hexdigest()
 
-        # Validate the received data with our Pydantic model and return it
-        return ScoreResponse(**ai_output)
+async def cached_score(scenario_id: str, user_reply: str, locale: str, key: tuple = None,
+                       signature: tuple = None) -> Optional[ScoreResponse]:
+    """ `key` and `signature` may be precomputed by prepare_replies. """
+    if score_cache is None:
+        return None
+    namespace, text = key or score_cache_key(scenario_id, user_reply, locale)
+    value, _ = score_cache.get(namespace, text, signature)
+    if value is None and shared_store.cross_process:
+        try:
+            value = await shared_store.get(shared_score_key(namespace, text))
+        except Exception as e:
+            logger.warning(f"Shared score cache read failed: {e}")
+        if value is not None:
+            score_cache.set(namespace, text, value)
+    return ScoreResponse.model_validate(value) if value is not None else None
 
-    except json.JSONDecodeError:
-        # This error happens if the AI's response isn't valid JSON
-        print("Error: Failed to decode JSON from AI response.")
-        print(f"AI Raw Response: {response.text}")
+async def remember_score(scenario_id: str, user_reply: str, locale: str, score, key: tuple = None,
+                         signature: tuple = None):
+    """ `score` is a ScoreResponse or its dict form (from a stream's final event). """
+    if score_cache is None:
+        return
+    value = score.model_dump() if isinstance(score, ScoreResponse) else score
+    namespace, text = key or score_cache_key(scenario_id, user_reply, locale)
+    score_cache.set(namespace, text, value, signature)
+    if shared_store.cross_process:
+        try:
+            await shared_store.set(shared_score_key(namespace, text), value, SHARED_SCORE_TTL_SECONDS)
+        except Exception as e:
+            logger.warning(f"Shared score cache write failed: {e}")
+
+# Local screen run before any scoring call: instant safety flags, and no model call for
+# replies with nothing to score (see prescreen.py)
+prescreener = build_prescreener()
+
+def screen_reply(user_reply: str, locale: str):
+    return prescreener.screen(user_reply, locale) if prescreener is not None else None
+
+def local_score(screening, locale: str) -> Optional[ScoreResponse]:
+    """ The locally built score for a reply the model doesn't need to see, else None. """
+    if screening is None or not screening.skip_model:
+        return None
+    return ScoreResponse.model_validate(prescreener.local_score(screening, locale))
+
+def prepare_replies(items: list) -> list:
+    """
+    The CPU-bound part of taking in a batch of replies, one (screening, cache key, MinHash
+    signature) per item; the key and signature are None when the model won't see the reply.
+    Runs in the threadpool: for 20 replies it is several milliseconds of normalizing,
+    screening and hashing that used to hold up every other request on the event loop.
+    """
+    prepared = []
+    for item in items:
+        screening = screen_reply(item.user_reply, item.locale)
+        if score_cache is None or (screening is not None and screening.skip_model):
+            prepared.append((screening, None, None))
+            continue
+        key = score_cache_key(item.scenario_id, item.user_reply, item.locale)
+        prepared.append((screening, key, score_cache.signature(key[1])))
+    return prepared
+
+def with_local_flags(score: ScoreResponse, screening) -> ScoreResponse:
+    """ Adds the pre-screen's flags to a score. Cached scores keep only the model's own flags. """
+    if screening is None or not screening.flags:
+        return score
+    return score.model_copy(update={"safety_flags": merge_flags(screening.flags, score.safety_flags)})
+
+@router.post("/score", response_model=ScoreResponse)
+async def score_reply(request: ScoreRequest):
+    """
+    This endpoint receives a user's reply and returns an AI-generated score and feedback.
+    Replies to a scenario we served are scored against its hostile comment.
+    """
+    screening = screen_reply(request.user_reply, request.locale)
+    local = local_score(screening, request.locale)
+    if local is not None:
+        return local
+    cached = await cached_score(request.scenario_id, request.user_reply, request.locale)
+    if cached is not None:
+        return with_local_flags(cached, screening)
+    try:
+        score = await create_score(request.user_reply, request.scenario_id)
+        await remember_score(request.scenario_id, request.user_reply, request.locale, score)
+        return with_local_flags(score, screening)
+
+    except ResponseParseError:
+        # This error happens if the AI's response isn't valid JSON, even after repair
         raise HTTPException(status_code=500, detail="AI response was not in valid JSON format.")
+    except ModelBusyError as e:
+        raise model_busy(e)
     except Exception as e:
         # Handle other potential errors (e.g., API key issue, network problem)
-        print(f"An unexpected error occurred: {e}")
+        logger.exception(f"An unexpected error occurred: {e}")
         raise HTTPException(status_code=500, detail=f"An internal error occurred: {str(e)}")
+
+# --- BATCH SCORING ---
+MAX_SCORE_BATCH_ITEMS = 100
+# Replies packed into one model call; larger batches are split into concurrent chunks
+SCORE_BATCH_CHUNK_SIZE = int(os.getenv("SCORE_BATCH_CHUNK_SIZE", "10"))
+
+async def score_batch_chunk(items: list) -> dict:
+    """
+    Scores a group of replies with one model call, returning {id: ScoreResponse or Exception}.
+    Items the model skipped or answered malformed are retried as smaller batches;
+    a single leftover item falls back to the one-reply /score prompt.
+    """
+    if len(items) == 1:
+        # No point in the batch prompt for a single reply
+        try:
+            return {items[0].id: await create_score(items[0].user_reply, items[0].scenario_id)}
+        except Exception as e:
+            return {items[0].id: e}
+
+    results = {}
+    wanted = {item.id for item in items}
+    try:
+        entries = []
+        for item in items:
+            entry = {"id": item.id, "reply": item.user_reply}
+            scenario = await scenario_registry.get(item.scenario_id)
+            if scenario is not None:
+                entry["comment"] = scenario["hate_speech_comment"]
+            entries.append(entry)
+        replies = json.dumps(entries, ensure_ascii=False)
+        # Decoded to plain JSON, not validated as a whole, so valid entries survive bad neighbours
+        output = await structured.generate(f"{SYSTEM_PROMPT_SCORING_BATCH}\n\nReplies to analyze:\n{replies}", ScoreBatchOutput, endpoint="score_batch", validate=False)
+        for entry in output.get("results", []):
+            item_id = str(entry.get("id"))
+            if item_id in wanted and item_id not in results:
+                try:
+                    results[item_id] = ScoreResponse(**entry)
+                except ValidationError:
+                    pass
+    except ModelBusyError as e:
+        # Splitting would only multiply calls against an exhausted quota
+        return {item.id: e for item in items}
+    except Exception as e:
+        logger.warning(f"Batch scoring of {len(items)} replies failed, retrying in smaller groups: {e}")
+
+    missing = [item for item in items if item.id not in results]
+    if not missing:
+        return results
+
+    # Retry only what's missing; if nothing came back at all, halve the batch
+    groups = [missing] if len(missing) < len(items) else [missing[:len(missing) // 2], missing[len(missing) // 2:]]
+    for partial in await asyncio.gather(*(score_batch_chunk(group) for group in groups)):
+        results.update(partial)
+    return results
+
+@router.post("/score_batch", response_model=ScoreBatchResponse)
+async def score_batch(request: ScoreBatchRequest):
+    """
+    Scores many replies (e.g. a whole classroom session) using one shared rubric
+    per model call. Results are matched back to the request by `id`, and each
+    item reports either its `score` or an `error`.
+    """
+    ids = [item.id for item in request.items]
+    if len(ids) != len(set(ids)):
+        raise HTTPException(status_code=422, detail="Item ids in a batch must be unique.")
+    if len(ids) > MAX_SCORE_BATCH_ITEMS:
+        raise HTTPException(status_code=422, detail=f"A batch can hold at most {MAX_SCORE_BATCH_ITEMS} replies.")
+
+    outcomes = {}
+    pending = []
+    screenings = {}
+    cache_keys = {}
+    for item, (screening, key, signature) in zip(request.items, await run_in_threadpool(prepare_replies, request.items)):
+        screenings[item.id] = screening
+        local = local_score(screening, item.locale)
+        if local is not None:
+            outcomes[item.id] = local
+            continue
+        cache_keys[item.id] = (key, signature)
+        cached = await cached_score(item.scenario_id, item.user_reply, item.locale, key, signature)
+        if cached is not None:
+            outcomes[item.id] = cached
+        else:
+            pending.append(item)
+
+    chunks = [pending[i:i + SCORE_BATCH_CHUNK_SIZE] for i in range(0, len(pending), SCORE_BATCH_CHUNK_SIZE)]
+    for partial in await asyncio.gather(*(score_batch_chunk(chunk) for chunk in chunks)):
+        outcomes.update(partial)
+    for item in pending:
+        if isinstance(outcomes.get(item.id), ScoreResponse):
+            await remember_score(item.scenario_id, item.user_reply, item.locale, outcomes[item.id], *cache_keys[item.id])
+
+    results = []
+    for item_id in ids:
+        outcome = outcomes.get(item_id)
+        if isinstance(outcome, ScoreResponse):
+            results.append(ScoreBatchResult(id=item_id, score=with_local_flags(outcome, screenings[item_id])))
+        elif isinstance(outcome, ModelBusyError):
+            results.append(ScoreBatchResult(id=item_id, error=str(outcome)))
+        else:
+            results.append(ScoreBatchResult(id=item_id, error="This reply could not be scored."))
+    return ScoreBatchResponse(results=results)
     
+def stream_events(source, sse: bool, label: str, on_done=None) -> StreamingResponse:
+    """
+    Wraps an event source from streaming.py in an NDJSON (or SSE) response.
+    Errors after the stream has started can't change the status code any more,
+    so they are sent as a final {"type": "error"} event instead.
+    """
+    async def body():
+        try:
+            async for event in source:
+                if event["type"] == "done" and on_done is not None:
+                    await on_done(event["value"])
+                yield format_event(event, sse)
+        except ModelBusyError as e:
+            yield format_event({"type": "error", "status": 503, "detail": str(e)}, sse)
+        except Exception as e:
+            logger.exception(f"An unexpected error occurred during streamed {label}: {e}")
+            yield format_event({"type": "error", "status": 500, "detail": f"Internal server error during {label}."}, sse)
+
+    return StreamingResponse(body(), media_type=SSE_MEDIA_TYPE if sse else NDJSON_MEDIA_TYPE)
+
+async def flag_events_first(source, flags: list, on_done):
+    """
+    Sends the pre-screen's flags as the first safety_flags items, before the model has
+    written anything; the model's own flags follow without repeats. `on_done` gets the
+    model's response as it was, so the score cache never holds another reply's flags.
+    """
+    for index, flag in enumerate(flags):
+        yield {"type": "item", "field": "safety_flags", "index": index, "value": flag}
+    sent = list(flags)
+    async for event in source:
+        if event["type"] == "item" and event["field"] == "safety_flags":
+            if event["value"] in sent:
+                continue
+            event = {**event, "index": len(sent)}
+            sent.append(event["value"])
+        elif event["type"] == "done":
+            await on_done(event["value"])
+            event = {**event, "value": {**event["value"], "safety_flags": merge_flags(flags, event["value"]["safety_flags"])}}
+        yield event
+
+@router.post("/score/stream")
+async def score_reply_stream(request: ScoreRequest, http_request: Request):
+    """
+    Streaming variant of /score: each rubric score is sent as soon as the model has
+    written it, followed by the rewrite, the safety flags and the full ScoreResponse.
+    Sends NDJSON, or Server-Sent Events when the client accepts text/event-stream.
+    """
+    sse = wants_sse(http_request.headers.get("accept"))
+    screening = screen_reply(request.user_reply, request.locale)
+    local = local_score(screening, request.locale)
+    if local is not None:
+        return stream_events(replay_events(local.model_dump()), sse, "scoring")
+    cached = await cached_score(request.scenario_id, request.user_reply, request.locale)
+    if cached is not None:
+        return stream_events(replay_events(with_local_flags(cached, screening).model_dump()), sse, "scoring")
+
+    async def remember(value: dict):
+        await remember_score(request.scenario_id, request.user_reply, request.locale, value)
+
+    full_prompt = await scoring_prompt(request.user_reply, request.scenario_id)
+    source = stream_model_events(llm.stream(full_prompt, endpoint="score", generation_config=json_mode(ScoreResponse)), ScoreResponse)
+    if screening is not None and screening.flags:
+        return stream_events(flag_events_first(source, screening.flags, remember), sse, "scoring")
+    return stream_events(source, sse, "scoring", on_done=remember)
+
 # --- SCENARIO GENERATION API ENDPOINT ---
+async def create_scenario(topic: Optional[str] = None, gentle_mode: bool = False) -> ScenarioResponse:
+    """
+    Runs one live scenario generation. Used by the endpoint and the warm pool.
+    """
+    # Build the prompt, adding the topic if one was provided by the user
+    prompt_addition = ""
+    if topic:
+        prompt_addition = f"\n\nPlease ensure the scenario is related to the topic of: '{topic}'."
+
+    # If gentle_mode is true, add specific instructions to the AI
+    if gentle_mode:
+        prompt_addition += "\nIMPORTANT: Please generate a 'gentle mode' scenario. This means the comment should be a microaggression, subtly biased, or based on misinformation rather than direct, aggressive hate speech. The tone should be less confrontational."
+    
+    full_prompt = f"{SYSTEM_PROMPT_SCENARIO}{prompt_addition}"
+
+    # Call the Gemini API. Not coalesced: every scenario should be different.
+    draft = await structured.generate(full_prompt, ScenarioDraft, endpoint="generate_scenario", coalesce=False)
+
+    # Create the final response object, adding a unique ID
+    return ScenarioResponse(
+        scenario_id=str(uuid.uuid4()), # Generate a new unique ID for this scenario
+        **draft.model_dump()
+    )
+
+# Pre-generated scenarios, bucketed by (topic, gentle_mode). Started in main.py.
+scenario_pool = WarmPool("scenario", create_scenario, **pool_settings())
+for warm_topic in [None, *pool_topics()]:
+    scenario_pool.add_bucket(warm_topic, False)
+    scenario_pool.add_bucket(warm_topic, True)
+
 @router.post("/generate_scenario", response_model=ScenarioResponse)
 async def generate_scenario(request: ScenarioRequest):
     """
     Generates a unique hate speech scenario using the AI.
     An optional topic can be provided to guide the generation.
+    Served from the warm pool when possible.
     """
     try:
-        # Build the prompt, adding the topic if one was provided by the user
-        prompt_addition = ""
-        if request.topic:
-            prompt_addition = f"\n\nPlease ensure the scenario is related to the topic of: '{request.topic}'."
-
-        # If gentle_mode is true, add specific instructions to the AI
-        if request.gentle_mode:
-            prompt_addition += "\nIMPORTANT: Please generate a 'gentle mode' scenario. This means the comment should be a microaggression, subtly biased, or based on misinformation rather than direct, aggressive hate speech. The tone should be less confrontational."
-        
-        full_prompt = f"{SYSTEM_PROMPT_SCENARIO}{prompt_addition}"
-
-        # Call the Gemini API
-        response = await model.generate_content_async(full_prompt)
-        
-        # Clean and parse the JSON response
-        cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        ai_output = json.loads(cleaned_response_text)
-
-        # Create the final response object, adding a unique ID
-        return ScenarioResponse(
-            scenario_id=str(uuid.uuid4()), # Generate a new unique ID for this scenario
-            **ai_output
-        )
+        scenario = scenario_pool.pop(request.topic, request.gentle_mode)
+        if scenario is None:
+            scenario = await create_scenario(request.topic, request.gentle_mode)
+        # Registered only once served, so /score can look it up by scenario_id
+        await scenario_registry.put(scenario.model_dump())
+        return scenario
 
-    except json.JSONDecodeError:
-        print(f"Error: Failed to decode JSON from AI scenario response. Raw: {response.text}")
+    except ResponseParseError:
         raise HTTPException(status_code=500, detail="AI response (scenario) was not in valid JSON format.")
+    except ModelBusyError as e:
+        raise model_busy(e)
     except Exception as e:
-        print(f"An unexpected error occurred during scenario generation: {e}")
+        logger.exception(f"An unexpected error occurred during scenario generation: {e}")
         raise HTTPException(status_code=500, detail=f"An internal error occurred during scenario generation: {str(e)}")
     
 # --- NEW: TELEMETRY ENDPOINT ---
+# Queued and batch-written in the background (see telemetry.py). Started in main.py.
+telemetry_pipeline = build_telemetry_pipeline(shared_store)
+
 @router.post("/telemetry", status_code=202)
 async def receive_telemetry(data: TelemetryData):
     """
     Receives anonymous, aggregated data about user sessions.
     This helps measure impact and improve the app.
-    In a real app, this would be stored in a database for analysis.
-    For the hackathon, we'll just print it to show the functionality.
+    Events are queued and bulk-written by a background worker; when the queue is
+    full we answer 429 so clients back off instead of the server growing memory.
     """
-    print("--- 📈 TELEMETRY DATA RECEIVED 📈 ---")
-    print(data.model_dump_json(indent=2))
-    print("------------------------------------")
+    if not telemetry_pipeline.offer(data.model_dump()):
+        raise HTTPException(status_code=429, detail="Telemetry queue is full. Please retry later.", headers={"Retry-After": "5"})
     
     # We return a 202 "Accepted" status because the client doesn't need to wait for
     # any processing to happen after sending the data.
     return {"status": "accepted"}
 
+@router.get("/telemetry/rollups")
+async def telemetry_rollups():
+    """ Returns this worker's ingestion counters and the overall rollup across all scenarios. """
+    return {**telemetry_pipeline.snapshot(), "overall": summarize_rollup(await telemetry_pipeline.rollup())}
+
+@router.get("/telemetry/rollups/{scenario_id}")
+async def telemetry_scenario_rollup(scenario_id: str):
+    """ Returns mean score gain, skip rate and distress-flag rate for one scenario. """
+    rollup = await telemetry_pipeline.rollup(scenario_id)
+    if rollup is None:
+        raise HTTPException(status_code=404, detail="No telemetry recorded for this scenario.")
+    return {"scenario_id": scenario_id, **summarize_rollup(rollup)}
+
 @router.post("/generate_lesson", response_model=LearnResponse)
 async def generate_lesson(request: LearnRequest):
     """
     Generates a personalized educational lesson on a given MIL topic.
     """
     try:
-        full_prompt = f"{SYSTEM_PROMPT_LESSON}\n\nPlease generate a lesson on the topic of: '{request.topic}'."
+        # Learn Hub topics are prebuilt; other popular topics come from the cache
+        prebuilt = from_catalog("generate_lesson", request.topic)
+        if prebuilt is not None:
+            return prebuilt
+        cache_key = response_cache.key("generate_lesson", SYSTEM_PROMPT_LESSON, request.topic)
+        cached = await response_cache.get("generate_lesson", cache_key)
+        if cached is not None:
+            return LearnResponse(**cached)
 
-        response = await model.generate_content_async(full_prompt)
-        cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        ai_output = json.loads(cleaned_response_text)
-        
-        return LearnResponse(**ai_output)
+        lesson = await structured.generate(lesson_prompt(request.topic), LearnResponse, endpoint="generate_lesson")
+        await response_cache.set("generate_lesson", cache_key, lesson.model_dump())
+        return lesson
+    except ModelBusyError as e:
+        raise model_busy(e)
     except Exception as e:
-        print(f"An unexpected error occurred during lesson generation: {e}")
+        logger.exception(f"An unexpected error occurred during lesson generation: {e}")
         raise HTTPException(status_code=500, detail="Internal server error during lesson generation.")  
     
+@router.get("/generate_lesson", response_model=LearnResponse)
+async def get_lesson(topic: str):
+    """ Cacheable GET form of /generate_lesson, so clients can revalidate with If-None-Match. """
+    return await generate_lesson(LearnRequest(topic=topic))
+
+@router.post("/generate_lesson/stream")
+async def generate_lesson_stream(request: LearnRequest, http_request: Request):
+    """
+    Streaming variant of /generate_lesson: the title, each paragraph and the example
+    are sent as soon as they are generated, followed by the full LearnResponse.
+    """
+    prebuilt = from_catalog("generate_lesson", request.topic)
+    if prebuilt is not None:
+        return stream_events(replay_events(prebuilt.model_dump()), wants_sse(http_request.headers.get("accept")), "lesson generation")
+    cache_key = response_cache.key("generate_lesson", SYSTEM_PROMPT_LESSON, request.topic)
+    cached = await response_cache.get("generate_lesson", cache_key)
+    if cached is not None:
+        return stream_events(replay_events(cached), wants_sse(http_request.headers.get("accept")), "lesson generation")
+
+    async def store(lesson: dict):
+        await response_cache.set("generate_lesson", cache_key, lesson)
+
+    source = stream_model_events(llm.stream(lesson_prompt(request.topic), endpoint="generate_lesson", generation_config=json_mode(LearnResponse)), LearnResponse)
+    return stream_events(source, wants_sse(http_request.headers.get("accept")), "lesson generation", on_done=store)
+    
 @router.post("/generate_quiz", response_model=QuizResponse)
 async def generate_quiz(request: QuizRequest):
     """
     Generates a 3-question quiz on a given MIL topic.
     """
     try:
-        full_prompt = f"{SYSTEM_PROMPT_QUIZ}\n\nPlease generate a quiz on the topic of: '{request.topic}'."
-        response = await model.generate_content_async(full_prompt)
-        cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        ai_output = json.loads(cleaned_response_text)
-        return QuizResponse(**ai_output)
+        prebuilt = from_catalog("generate_quiz", request.topic)
+        if prebuilt is not None:
+            return prebuilt
+        cache_key = response_cache.key("generate_quiz", SYSTEM_PROMPT_QUIZ, request.topic)
+        cached = await response_cache.get("generate_quiz", cache_key)
+        if cached is not None:
+            return QuizResponse(**cached)
+
+        quiz = await structured.generate(quiz_prompt(request.topic), QuizResponse, endpoint="generate_quiz")
+        await response_cache.set("generate_quiz", cache_key, quiz.model_dump())
+        return quiz
+    except ModelBusyError as e:
+        raise model_busy(e)
     except Exception as e:
-        print(f"An unexpected error occurred during quiz generation: {e}")
+        logger.exception(f"An unexpected error occurred during quiz generation: {e}")
         raise HTTPException(status_code=500, detail="Internal server error during quiz generation.")
     
+@router.get("/generate_quiz", response_model=QuizResponse)
+async def get_quiz(topic: str):
+    """ Cacheable GET form of /generate_quiz. """
+    return await generate_quiz(QuizRequest(topic=topic))
+
+async def create_game_item(topic: Optional[str] = None, gentle_mode: bool = False) -> GameItemResponse:
+    """
+    Runs one live "Real or Fake?" generation. The arguments only exist so the
+    warm pool can call every generator the same way; the prompt is fixed.
+    """
+    # We use the same prompt every time and let the AI handle the randomization,
+    # so identical concurrent calls must not be coalesced.
+    return await structured.generate(SYSTEM_PROMPT_GAME_ITEM, GameItemResponse, endpoint="generate_game_item", coalesce=False)
+
+# Pre-generated game items. The prompt has no inputs, so one bucket is enough.
+game_item_pool = WarmPool("game_item", create_game_item, **pool_settings())
+game_item_pool.add_bucket()
+
 @router.get("/generate_game_item", response_model=GameItemResponse)
 async def generate_game_item():
     """
     Generates a single "Real or Fake?" game item (text-based).
+    Served from the warm pool when possible.
     """
     try:
-        # We use the same prompt every time and let the AI handle the randomization.
-        response = await model.generate_content_async(SYSTEM_PROMPT_GAME_ITEM)
-        cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        ai_output = json.loads(cleaned_response_text)
-        return GameItemResponse(**ai_output)
+        item = game_item_pool.pop()
+        if item is not None:
+            return item
+        return await create_game_item()
+    except ModelBusyError as e:
+        raise model_busy(e)
     except Exception as e:
-        print(f"An unexpected error occurred during game item generation: {e}")
+        logger.exception(f"An unexpected error occurred during game item generation: {e}")
         raise HTTPException(status_code=500, detail="Internal server error during game item generation.")
     
 
 # Dependency to get a DB session
 def get_db():
+    from .database import SessionLocal
     db = SessionLocal()
     try:
         yield db
     finally:
         db.close()
 
+# Coalesces XP increments and writes them as batched upserts (see xp.py). Started in main.py.
+xp_batcher = build_xp_batcher()
+
 @router.post("/update_score")
-def update_score(request: UpdateScoreRequest, db: Session = Depends(get_db)):
+async def update_score(request: UpdateScoreRequest):
     """
     Updates a user's total XP. Creates the user if they don't exist.
+    The increment is queued and written with the next batch.
     """
-    user = db.query(Leaderboard).filter(Leaderboard.user_id == request.user_id).first()
-    if user:
-        user.total_xp += request.xp_gained
-    else:
-        new_user = Leaderboard(
-            user_id=request.user_id,
-            username=request.username,
-            total_xp=request.xp_gained
-        )
-        db.add(new_user)
-    db.commit()
+    try:
+        await xp_batcher.submit(request.user_id, request.username, request.xp_gained)
+    except XPBacklogFull:
+        raise HTTPException(status_code=429, detail="XP queue is full. Please retry later.", headers={"Retry-After": "5"})
+    except Exception as e:
+        logger.exception(f"An unexpected error occurred while updating score: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error while updating score.")
     return {"status": "success"}
 
+@router.post("/update_scores")
+async def update_scores(request: BulkUpdateScoreRequest):
+    """
+    Applies several XP updates at once, e.g. everything earned in one session.
+    """
+    try:
+        await xp_batcher.submit_many([(u.user_id, u.username, u.xp_gained) for u in request.updates])
+    except XPBacklogFull:
+        raise HTTPException(status_code=429, detail="XP queue is full. Please retry later.", headers={"Retry-After": "5"})
+    except Exception as e:
+        logger.exception(f"An unexpected error occurred while updating scores: {e}")
+        raise HTTPException(status_code=500, detail="Internal server error while updating scores.")
+    return {"status": "success", "accepted": len(request.updates)}
+
+# In-memory top-N and rank index, kept current by XP flushes (see leaderboard.py)
+leaderboard_engine = build_leaderboard_engine(shared_store)
+xp_batcher.listeners.append(leaderboard_engine.apply_increments)
+
+async def query_top_users(limit: int = 50) -> list:
+    """
+    Reads the top users straight from the database, on the async engine when available.
+    Only used until the in-memory leaderboard has loaded.
+    """
+    from sqlalchemy import select
+    from .database import SessionLocal, AsyncSessionLocal, Leaderboard, async_db_enabled
+    stmt = select(Leaderboard).order_by(Leaderboard.total_xp.desc()).limit(limit)
+
+    def query_sync():
+        with SessionLocal() as db:
+            return db.scalars(stmt).all()
+
+    with DB_QUERY_SECONDS.time(operation="leaderboard_top"):
+        if not async_db_enabled():
+            return await run_in_threadpool(query_sync)
+        async with AsyncSessionLocal() as db:
+            return (await db.scalars(stmt)).all()
+
 @router.get("/leaderboard")
-def get_leaderboard(db: Session = Depends(get_db)):
+async def get_leaderboard():
     """
     Returns the top 50 users sorted by total_xp.
+    Sends the engine's ETag, so polling clients get a 304 when nothing changed
+    (see ResponseOptimizationMiddleware in responses.py).
+    """
+    if not leaderboard_engine.loaded:
+        # Engine not loaded yet (or the database was unreachable at startup)
+        return await query_top_users(50)
+    return FastJSONResponse(leaderboard_engine.top(), headers={"ETag": leaderboard_engine.etag()})
+
+@router.get("/leaderboard/rank/{user_id}")
+async def get_rank(user_id: str):
+    """
+    Returns a user's rank and percentile among everyone on the leaderboard.
     """
-    leaderboard = db.query(Leaderboard).order_by(Leaderboard.total_xp.desc()).limit(50).all()
-    return leaderboard
+    if not leaderboard_engine.loaded:
+        raise HTTPException(status_code=503, detail="Leaderboard is still loading.")
+    rank = leaderboard_engine.rank(user_id)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="User not found on the leaderboard.")
+    return rank
+
+@router.get("/cache_stats")
+def cache_stats():
+    """ Returns hit/miss counters for the response cache. """
+    return response_cache.snapshot()
+
+@router.get("/score_cache_stats")
+def score_cache_stats():
+    """ Returns exact/near-duplicate hit rates and size of the /score reply cache. """
+    return score_cache.snapshot() if score_cache is not None else {"enabled": False}
+
+@router.get("/prescreen_stats")
+def prescreen_stats():
+    """ Returns how many replies the local pre-screen flagged or scored without the model, and its cost. """
+    return prescreener.snapshot() if prescreener is not None else {"enabled": False}
+
+@router.get("/catalog_stats")
+def catalog_stats():
+    """ Returns what the prebuilt content catalog holds and how often it answered. """
+    return content_catalog.snapshot() if content_catalog is not None else {"enabled": False}
+
+@router.get("/scenario_stats")
+def scenario_stats():
+    """ Returns size and hit counters of the scenario registry used to ground /score. """
+    return scenario_registry.snapshot()
+
+@router.get("/shared_state_stats")
+def shared_state_stats():
+    """ Returns the backend and read/write counters of the cross-worker state store. """
+    return shared_store.snapshot()
+
+@router.get("/pool_stats")
+def pool_stats():
+    """ Returns fill levels and hit/miss counters for the warm pools. """
+    return {"scenario": scenario_pool.snapshot(), "game_item": game_item_pool.snapshot()}
+
+@router.get("/xp_stats")
+def xp_stats():
+    """ Returns counters for the batched XP writer and the leaderboard index it feeds. """
+    return {**xp_batcher.snapshot(), "leaderboard": leaderboard_engine.snapshot()}
+
+@router.get("/llm_stats")
+def llm_stats():
+    """ Returns call, retry and coalescing counters for the Gemini client. """
+    return llm.snapshot()
+
+@router.get("/admission_stats")
+def admission_stats():
+    """ Returns slot usage, queue depth and shed counts per priority class. """
+    return admission.snapshot() if admission is not None else {"enabled": False}
+
+@router.get("/parse_stats")
+def parse_stats():
+    """ Returns how model replies were decoded per endpoint: clean, repaired, re-asked or failed. """
+    return structured.snapshot()
+
+def collect_stats():
+    """ Copies the counters the subsystems already keep into the /metrics registry. """
+    for endpoint, counters in response_cache.stats.items():
+        CACHE_LOOKUPS.set(counters["hits"], endpoint=endpoint, result="hit")
+        CACHE_LOOKUPS.set(counters["misses"], endpoint=endpoint, result="miss")
+    CACHE_ENTRIES.set(len(response_cache.memory))
+    if score_cache is not None:
+        CACHE_LOOKUPS.set(score_cache.stats["exact_hits"], endpoint="score", result="hit")
+        CACHE_LOOKUPS.set(score_cache.stats["near_hits"], endpoint="score", result="near_hit")
+        CACHE_LOOKUPS.set(score_cache.stats["misses"], endpoint="score", result="miss")
+    for pool in (scenario_pool, game_item_pool):
+        POOL_READY.set(sum(pool.snapshot()["buckets"].values()), pool=pool.name)
+        POOL_POPS.set(pool.stats["hits"], pool=pool.name, result="hit")
+        POOL_POPS.set(pool.stats["misses"], pool=pool.name, result="miss")
+    telemetry = telemetry_pipeline.snapshot()
+    TELEMETRY_QUEUED.set(telemetry["queued"])
+    for outcome in ("accepted", "rejected", "written", "dropped"):
+        TELEMETRY_EVENTS.set(telemetry[outcome], outcome=outcome)
+    XP_PENDING.set(xp_batcher.snapshot()["pending_users"])
+    if prescreener is not None:
+        PRESCREEN_OUTCOMES.set(prescreener.stats["screened"] - prescreener.stats["skipped_model"], outcome="model")
+        for reason, count in prescreener.reason_counts.items():
+            PRESCREEN_OUTCOMES.set(count, outcome=reason)
+
+registry.add_collector(collect_stats)
 
 @router.get("/ping")
 def ping():
     """ A simple endpoint to verify the API is running and to wake it up. """
     return {"status": "alive"}
 
+# Background startup steps (schema check, stored rollups, leaderboard), run from main.py
+readiness = Readiness(required=("schema",))
+
+@router.get("/ready")
+def ready():
+    """
+    Readiness probe: 200 once the database schema has been checked, 503 before that.
+    Unlike /ping, this tells a load balancer the instance can actually serve traffic.
+    """
+    return JSONResponse(readiness.snapshot(), status_code=200 if readiness.ready else 503)
+
+# Analyses keyed on the exact upload, so re-uploads of the same viral image return instantly
+# without even being decoded. The perceptual hash is only a secondary index: it counts
+# edited copies of images we have already seen, which are analyzed afresh (see imaging.py)
+image_result_cache = MemoryCache(max_entries=int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "512")))
+image_phash_index = MemoryCache(max_entries=int(os.getenv("IMAGE_CACHE_MAX_ENTRIES", "512")))
+IMAGE_CACHE_TTL = int(os.getenv("IMAGE_CACHE_TTL", str(24 * 60 * 60)))
+image_stage_totals = {}
+image_stats_counters = {"near_duplicates": 0}
+
 @router.post("/analyze_image", response_model=ImageAnalysisResponse)
-async def analyze_image(file: UploadFile = File(...)):
+async def analyze_image(response: Response, file: UploadFile = File(...)):
     """
     Analyzes a user-uploaded image for signs of manipulation.
+    Per-stage timings are returned in the Server-Timing header.
     """
+    timer = StageTimer(image_stage_totals)
     try:
-        # Read the image file content
-        contents = await file.read()
-        img = Image.open(io.BytesIO(contents))
+        # Stream the upload in, rejecting oversized files early
+        upload = await read_upload(file)
+        timer.mark("read")
+
+        cache_key = f"{prompt_version(SYSTEM_PROMPT_IMAGE_ANALYSIS)}:{upload.digest}"
+        cached = image_result_cache.get(cache_key)
+        timer.mark("cache")
+        if cached is not None:
+            response.headers["Server-Timing"] = timer.server_timing()
+            return ImageAnalysisResponse(**cached)
+
+        # Decode, downscale and re-encode in a worker thread
+        prepared = await prepare_image_async(upload.data)
+        timer.mark("prepare")
+        seen_digest = image_phash_index.get(prepared.phash)
+        if seen_digest is not None and seen_digest != upload.digest:
+            image_stats_counters["near_duplicates"] += 1
+        image_phash_index.set(prepared.phash, upload.digest, IMAGE_CACHE_TTL)
 
         # Send the prompt and the image to the Gemini model
-        response = model.generate_content([SYSTEM_PROMPT_IMAGE_ANALYSIS, img])
+        ai_response = await llm.generate(
+            [SYSTEM_PROMPT_IMAGE_ANALYSIS, prepared.as_blob()],
+            endpoint="analyze_image",
+            generation_config=json_mode(ImageAnalysisResponse)
+        )
+        timer.mark("model")
 
-        # Clean and parse the JSON response
-        cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        ai_output = json.loads(cleaned_response_text)
-        return ImageAnalysisResponse(**ai_output)
+        # Decode and validate the JSON response
+        analysis = await structured.decode(ai_response.text, ImageAnalysisResponse, endpoint="analyze_image")
+        image_result_cache.set(cache_key, analysis.model_dump(), IMAGE_CACHE_TTL)
+        timer.mark("parse")
 
+        response.headers["Server-Timing"] = timer.server_timing()
+        return analysis
+
+    except HTTPException:
+        raise
+    except ModelBusyError as e:
+        raise model_busy(e)
     except Exception as e:
-        print(f"An unexpected error occurred during image analysis: {e}")
+        logger.exception(f"An unexpected error occurred during image analysis: {e}")
         raise HTTPException(status_code=500, detail="Internal server error during image analysis.")
+
+@router.get("/image_stats")
+def image_stats():
+    """ Returns mean/max latency for each stage of the image analysis pipeline. """
+    return {"cached_results": len(image_result_cache), **image_stats_counters, "stages": summarize_stages(image_stage_totals)}
     
 # --- NEW: MINI-LESSON ENDPOINT ---
 @router.post("/get_mini_lesson", response_model=MiniLessonResponse)
 async def get_mini_lesson(request: MiniLessonRequest):
     try:
-        full_prompt = f"{SYSTEM_PROMPT_MINI_LESSON}\n\nPlease provide a mini-lesson for the term: '{request.term}'."
-        response = await model.generate_content_async(full_prompt)
-        cleaned_response_text = response.text.strip().replace("```json", "").replace("```", "").strip()
-        ai_output = json.loads(cleaned_response_text)
-        return MiniLessonResponse(**ai_output)
+        prebuilt = from_catalog("get_mini_lesson", request.term)
+        if prebuilt is not None:
+            return prebuilt
+        cache_key = response_cache.key("get_mini_lesson", SYSTEM_PROMPT_MINI_LESSON, request.term)
+        cached = await response_cache.get("get_mini_lesson", cache_key)
+        if cached is not None:
+            return MiniLessonResponse(**cached)
+
+        mini_lesson = await structured.generate(mini_lesson_prompt(request.term), MiniLessonResponse, endpoint="get_mini_lesson")
+        await response_cache.set("get_mini_lesson", cache_key, mini_lesson.model_dump())
+        return mini_lesson
+    except ModelBusyError as e:
+        raise model_busy(e)
     except Exception as e:
-        raise HTTPException(status_code=500, detail="Internal server error during mini-lesson generation.")
\ No newline at end of file
+        raise HTTPException(status_code=500, detail="Internal server error during mini-lesson generation.")
+
+@router.get("/get_mini_lesson", response_model=MiniLessonResponse)
+async def get_mini_lesson_cached(term: str):
+    """ Cacheable GET form of /get_mini_lesson. """
+    return await get_mini_lesson(MiniLessonRequest(term=term))
\ No newline at end of file
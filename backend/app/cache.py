@@ -0,0 +1,190 @@
+# app/cache.py
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from starlette.concurrency import run_in_threadpool
+
+logger = logging.getLogger(__name__)
+
+# --- RESPONSE CACHE ---
+# The generative endpoints get asked for the same handful of MIL topics and terms
+# over and over. Every answer is keyed on a hash of (system prompt version +
+# normalized topic/term + locale), so an edited prompt never serves stale content.
+
+# Default time-to-live (in seconds) for each cached endpoint.
+# Any of these can be overridden with e.g. RESPONSE_CACHE_TTL_GENERATE_LESSON=600
+DEFAULT_TTLS = {
+    "generate_lesson": 24 * 60 * 60,
+    "generate_quiz": 6 * 60 * 60,
+    "get_mini_lesson": 7 * 24 * 60 * 60,
+}
+
+
+def prompt_version(system_prompt: str) -> str:
+    """ Returns a short, stable fingerprint of a system prompt. """
+    return hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12]
+
+
+def normalize(text: str) -> str:
+    """ Lowercases and collapses whitespace so 'Fake News ' and 'fake  news' share a key. """
+    return " ".join(text.lower().split())
+
+
+class MemoryCache:
+    """
+    A small in-process LRU cache where every entry carries its own expiry time.
+    """
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.monotonic():
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key: str, value, ttl: int):
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_entries:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class SQLCache:
+    """
+    A second, shared cache tier stored in the `response_cache` table.
+    Survives restarts and is shared by every worker pointing at the same database.
+    """
+    def get(self, key: str):
+        from .database import SessionLocal, ResponseCacheEntry
+        db = SessionLocal()
+        try:
+            entry = db.get(ResponseCacheEntry, key)
+            if entry is None or entry.expires_at < datetime.utcnow():
+                return None
+            return json.loads(entry.value)
+        finally:
+            db.close()
+
+    def set(self, key: str, value, ttl: int):
+        from .database import SessionLocal, ResponseCacheEntry
+        db = SessionLocal()
+        try:
+            db.merge(ResponseCacheEntry(
+                key=key,
+                value=json.dumps(value),
+                expires_at=datetime.utcnow() + timedelta(seconds=ttl)
+            ))
+            db.commit()
+        finally:
+            db.close()
+
+
+class ResponseCache:
+    """
+    Tiered cache for generated responses (memory, then an optional cross-worker shared
+    store, then optional SQL), with per-endpoint TTLs and hit/miss counters.
+    """
+    def __init__(self, memory: MemoryCache, sql: SQLCache = None, ttls: dict = None, shared=None):
+        self.memory = memory
+        self.sql = sql
+        self.shared = shared
+        self.ttls = dict(DEFAULT_TTLS)
+        self.ttls.update(ttls or {})
+        self.stats = {}
+
+    def ttl_for(self, endpoint: str) -> int:
+        override = os.getenv(f"RESPONSE_CACHE_TTL_{endpoint.upper()}")
+        if override:
+            return int(override)
+        return self.ttls.get(endpoint, 60 * 60)
+
+    def key(self, endpoint: str, system_prompt: str, subject: str, locale: str = "en") -> str:
+        """ Builds the content-addressed key for one request. """
+        raw = "|".join([endpoint, prompt_version(system_prompt), normalize(subject), locale])
+        return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+    def _count(self, endpoint: str, outcome: str):
+        counters = self.stats.setdefault(endpoint, {"hits": 0, "misses": 0})
+        counters[outcome] += 1
+
+    async def get(self, endpoint: str, key: str):
+        """ Returns the cached value for `key`, or None on a miss. """
+        value = self.memory.get(key)
+        if value is None and self.shared is not None:
+            try:
+                value = await self.shared.get(f"response:{key}")
+            except Exception as e:
+                logger.warning(f"Response cache shared read failed: {e}")
+                value = None
+            if value is not None:
+                self.memory.set(key, value, self.ttl_for(endpoint))
+        if value is None and self.sql is not None:
+            try:
+                value = await run_in_threadpool(self.sql.get, key)
+            except Exception as e:
+                logger.warning(f"Response cache SQL read failed: {e}")
+                value = None
+            if value is not None:
+                # Promote to the memory tier so the next hit skips the database.
+                self.memory.set(key, value, self.ttl_for(endpoint))
+        self._count(endpoint, "hits" if value is not None else "misses")
+        return value
+
+    async def set(self, endpoint: str, key: str, value):
+        ttl = self.ttl_for(endpoint)
+        self.memory.set(key, value, ttl)
+        if self.shared is not None:
+            try:
+                await self.shared.set(f"response:{key}", value, ttl)
+            except Exception as e:
+                logger.warning(f"Response cache shared write failed: {e}")
+        if self.sql is not None:
+            try:
+                await run_in_threadpool(self.sql.set, key, value, ttl)
+            except Exception as e:
+                logger.warning(f"Response cache SQL write failed: {e}")
+
+    def snapshot(self) -> dict:
+        """ Returns hit/miss counters and hit rates for every endpoint. """
+        result = {}
+        for endpoint, counters in self.stats.items():
+            total = counters["hits"] + counters["misses"]
+            result[endpoint] = {
+                **counters,
+                "hit_rate": round(counters["hits"] / total, 4) if total else 0.0,
+            }
+        return {"entries": len(self.memory), "endpoints": result}
+
+
+def build_response_cache(store=None) -> ResponseCache:
+    """
+    Builds the cache from environment settings.
+    RESPONSE_CACHE_MAX_ENTRIES sizes the memory tier; RESPONSE_CACHE_SQL=1 enables the DB tier.
+    A cross-process `store` (see shared_state.py) adds a tier shared by all workers.
+    """
+    memory = MemoryCache(max_entries=int(os.getenv("RESPONSE_CACHE_MAX_ENTRIES", "1024")))
+    sql = SQLCache() if os.getenv("RESPONSE_CACHE_SQL", "0") == "1" else None
+    shared = store if store is not None and store.cross_process else None
+    return ResponseCache(memory, sql, shared=shared)
@@ -0,0 +1,201 @@
+# app/catalog.py
+"""
+Builds the precomputed content catalog for the Learn Hub.
+
+    cd backend
+    python -m app.catalog                                  # topics from catalog/topics.json
+    python -m app.catalog --concurrency 8 --force          # regenerate everything
+    python -m app.catalog --topics my_topics.json --out /data/content.json.gz
+"""
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+from datetime import datetime
+from .cache import normalize, prompt_version
+
+logger = logging.getLogger(__name__)
+
+# --- CONTENT CATALOG ---
+# The Learn Hub asks for lessons, quizzes and mini-lessons on a mostly fixed list of
+# topics, and each tap used to be a live generation (or at best a cache hit that had to
+# be earned by an earlier live generation). A batch job pre-generates every (kind,
+# subject) pair with bounded concurrency and writes them to one gzipped JSON file; the
+# server loads it at startup, validates each entry once, and the endpoints answer from a
+# dict. Unknown topics still go through the response cache and a live generation.
+#
+# Each kind is stored with the version of the system prompt it was generated with, so
+# editing a prompt retires its catalog entries instead of serving stale content.
+
+FORMAT_VERSION = 1
+DEFAULT_PATH = os.path.join("catalog", "content.json.gz")
+DEFAULT_TOPICS_PATH = os.path.join("catalog", "topics.json")
+
+
+def read_catalog_file(path: str):
+    """ Returns the decoded catalog file, or None if it doesn't exist. """
+    if not os.path.exists(path):
+        return None
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        data = json.load(f)
+    if data.get("format") != FORMAT_VERSION:
+        raise ValueError(f"Unsupported content catalog format: {data.get('format')}")
+    return data
+
+
+def write_catalog_file(path: str, data: dict):
+    """ Writes atomically, so a server starting mid-build never reads a partial file. """
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, separators=(",", ":"))
+    os.replace(tmp_path, path)
+
+
+class ContentCatalog:
+    """
+    Read side of the catalog. `kinds` maps an endpoint name to
+    (system prompt, response model, prompt builder); only kinds whose stored prompt
+    version matches the current system prompt are served.
+    """
+    def __init__(self, kinds: dict, path: str = DEFAULT_PATH):
+        self.kinds = kinds
+        self.path = path
+        self.built_at = None
+        self._entries = {}   # (kind, normalized subject) -> validated response model
+        self.stale_kinds = []
+        self.stats = {"hits": 0, "misses": 0}
+
+    def load(self) -> int:
+        """ Loads and validates the catalog file. Returns the number of entries served. """
+        data = read_catalog_file(self.path)
+        if data is None:
+            logger.info(f"No content catalog at {self.path}; serving live content only")
+            return 0
+        entries, stale = {}, []
+        for kind, stored in data.get("kinds", {}).items():
+            spec = self.kinds.get(kind)
+            if spec is None:
+                continue
+            system_prompt, response_model, _ = spec
+            if stored.get("prompt_version") != prompt_version(system_prompt):
+                stale.append(kind)
+                continue
+            for subject, value in stored.get("items", {}).items():
+                entries[(kind, subject)] = response_model.model_validate(value)
+        self._entries = entries
+        self.stale_kinds = stale
+        self.built_at = data.get("built_at")
+        if stale:
+            logger.warning(f"Content catalog entries for {', '.join(stale)} were built with an older prompt and are ignored")
+        return len(entries)
+
+    def get(self, kind: str, subject: str):
+        """ The prebuilt response for a subject, or None. """
+        value = self._entries.get((kind, normalize(subject)))
+        self.stats["hits" if value is not None else "misses"] += 1
+        return value
+
+    def __len__(self):
+        return len(self._entries)
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        per_kind = {}
+        for kind, _ in self._entries:
+            per_kind[kind] = per_kind.get(kind, 0) + 1
+        return {
+            **self.stats,
+            "path": self.path,
+            "built_at": self.built_at,
+            "entries": per_kind,
+            "stale_kinds": self.stale_kinds,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+def build_content_catalog(kinds: dict):
+    """ CONTENT_CATALOG_PATH points at the built file; CONTENT_CATALOG=0 disables the catalog. """
+    if os.getenv("CONTENT_CATALOG", "1") != "1":
+        return None
+    return ContentCatalog(kinds, os.getenv("CONTENT_CATALOG_PATH", DEFAULT_PATH))
+
+
+async def build_catalog(generate, kinds: dict, topics: dict, path: str,
+                        concurrency: int = 4, force: bool = False) -> dict:
+    """
+    Generates every (kind, subject) pair in `topics` ({kind: [subject, ...]}) with at
+    most `concurrency` calls in flight, then writes the catalog. `generate(prompt,
+    response_model, endpoint)` is the structured decoder. Entries already in the file
+    with the current prompt version are kept unless `force` is set.
+    """
+    existing = None if force else read_catalog_file(path)
+    stored = {}
+    for kind, (system_prompt, _, _) in kinds.items():
+        version = prompt_version(system_prompt)
+        previous = ((existing or {}).get("kinds") or {}).get(kind) or {}
+        items = previous.get("items", {}) if previous.get("prompt_version") == version else {}
+        stored[kind] = {"prompt_version": version, "items": dict(items)}
+
+    semaphore = asyncio.Semaphore(concurrency)
+    report = {"generated": 0, "kept": 0, "failed": []}
+
+    async def produce(kind: str, subject: str):
+        _, response_model, build_prompt = kinds[kind]
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                value = await generate(build_prompt(subject), response_model, endpoint=kind)
+            except Exception as e:
+                report["failed"].append({"kind": kind, "subject": subject, "error": str(e)})
+                print(f"  failed     {kind:<16} {subject}: {e}")
+                return
+        stored[kind]["items"][normalize(subject)] = value.model_dump()
+        report["generated"] += 1
+        print(f"  generated  {kind:<16} {subject} ({(time.perf_counter() - started) * 1000:.0f} ms)")
+
+    jobs = []
+    for kind, subjects in topics.items():
+        if kind not in kinds:
+            raise ValueError(f"Unknown catalog kind: {kind}")
+        for subject in subjects:
+            if normalize(subject) in stored[kind]["items"]:
+                report["kept"] += 1
+            else:
+                jobs.append(produce(kind, subject))
+    await asyncio.gather(*jobs)
+
+    write_catalog_file(path, {"format": FORMAT_VERSION, "built_at": datetime.utcnow().isoformat() + "Z", "kinds": stored})
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-generate lessons, quizzes and mini-lessons for the content catalog.")
+    parser.add_argument("--topics", default=DEFAULT_TOPICS_PATH, help="JSON file of {kind: [subject, ...]}")
+    parser.add_argument("--out", default=os.getenv("CONTENT_CATALOG_PATH", DEFAULT_PATH))
+    parser.add_argument("--concurrency", type=int, default=4, help="Generations in flight at once")
+    parser.add_argument("--force", action="store_true", help="Regenerate entries that are already up to date")
+    args = parser.parse_args()
+
+    # Imported here so `--help` works without a GOOGLE_API_KEY
+    from .api import CATALOG_KINDS, structured
+    with open(args.topics, encoding="utf-8") as f:
+        topics = json.load(f)
+
+    async def run():
+        return await build_catalog(structured.generate, CATALOG_KINDS, topics, args.out,
+                                   concurrency=args.concurrency, force=args.force)
+
+    started = time.perf_counter()
+    report = asyncio.run(run())
+    print(f"{report['generated']} generated, {report['kept']} kept, {len(report['failed'])} failed "
+          f"in {time.perf_counter() - started:.1f}s -> {args.out}")
+    if report["failed"]:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
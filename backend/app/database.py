@@ -1,13 +1,120 @@
 # backend/app/database.py
-from sqlalchemy import create_engine, Column, String, Integer
+from sqlalchemy import create_engine, Column, String, Integer, Text, DateTime, Boolean
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 import os
+from functools import lru_cache
 
 DATABASE_URL = os.getenv("DATABASE_URL") # We will set this in Render
 
-engine = create_engine(DATABASE_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+# The engine is created on first use rather than at import time, so a cold start
+# doesn't pay for loading the database driver before it can serve /ping.
+_engine = None
+_async_engine = None
+
+def database_url() -> str:
+    return os.getenv("DATABASE_URL") or DATABASE_URL
+
+def pool_settings(url: str) -> dict:
+    """
+    Connection pool settings shared by the sync and async engines. Serverless Postgres
+    (Neon) drops idle connections, so connections are pre-pinged and recycled.
+    DB_POOL_SIZE / DB_MAX_OVERFLOW / DB_POOL_TIMEOUT / DB_POOL_RECYCLE / DB_POOL_PRE_PING.
+    """
+    settings = {
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "1") == "1",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "300")),
+    }
+    if not url.startswith("sqlite"):
+        settings.update(
+            pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+            max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+            pool_timeout=float(os.getenv("DB_POOL_TIMEOUT", "30")),
+        )
+    return settings
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        url = database_url()
+        _engine = create_engine(url, **pool_settings(url))
+        SessionLocal.configure(bind=_engine)
+    return _engine
+
+# --- ASYNC ENGINE ---
+# Request handlers use an asyncio engine (asyncpg, or aiosqlite locally) so database
+# work doesn't occupy FastAPI's threadpool. The sync engine above stays for the
+# schema check and the remaining threadpool callers.
+
+def async_database_url(url: str):
+    """
+    Maps a sync DATABASE_URL to its asyncio driver, or None if there is no async
+    driver for it. libpq-only query options asyncpg doesn't understand are translated.
+    """
+    from sqlalchemy.engine import make_url
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend in ("postgresql", "postgres"):
+        query = dict(parsed.query)
+        sslmode = query.pop("sslmode", None)
+        query.pop("channel_binding", None)
+        if sslmode and sslmode != "disable":
+            query["ssl"] = sslmode
+        # Prepared statements cached per connection by SQLAlchemy (0 behind PgBouncer)
+        query.setdefault("prepared_statement_cache_size", os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+        return parsed.set(drivername="postgresql+asyncpg", query=query)
+    if backend == "sqlite":
+        return parsed.set(drivername="sqlite+aiosqlite")
+    return None
+
+@lru_cache(maxsize=None)
+def async_db_enabled() -> bool:
+    """ DB_ASYNC=0 keeps every query on the sync engine; otherwise async is used when a driver is installed. """
+    if os.getenv("DB_ASYNC", "1") != "1" or async_database_url(database_url()) is None:
+        return False
+    driver = "asyncpg" if database_url().startswith("postgres") else "aiosqlite"
+    try:
+        __import__(driver)
+    except ImportError:
+        return False
+    return True
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        from sqlalchemy.ext.asyncio import create_async_engine
+        url = async_database_url(database_url())
+        connect_args = {}
+        if url.get_backend_name() == "postgresql":
+            # asyncpg's own statement cache; must also be 0 behind PgBouncer
+            connect_args["statement_cache_size"] = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+        _async_engine = create_async_engine(url, connect_args=connect_args, **pool_settings(database_url()))
+    return _async_engine
+
+def AsyncSessionLocal():
+    """ Opens an AsyncSession on the (lazily created) async engine. """
+    from sqlalchemy.ext.asyncio import AsyncSession
+    return AsyncSession(get_async_engine(), expire_on_commit=False)
+
+async def dispose_async_engine():
+    global _async_engine
+    if _async_engine is not None:
+        await _async_engine.dispose()
+        _async_engine = None
+
+def __getattr__(name):
+    # Keeps `from .database import engine` working with the lazy engine
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+class _LazySessionmaker(sessionmaker):
+    """ A sessionmaker that creates the engine the first time a session is opened. """
+    def __call__(self, **local_kw):
+        get_engine()
+        return super().__call__(**local_kw)
+
+SessionLocal = _LazySessionmaker(autocommit=False, autoflush=False)
 Base = declarative_base()
 
 # Define our Leaderboard table structure
@@ -15,8 +122,65 @@ class Leaderboard(Base):
     __tablename__ = "leaderboard"
     user_id = Column(String, primary_key=True, index=True)
     username = Column(String, unique=True, index=True)
-    total_xp = Column(Integer, default=0)
+    total_xp = Column(Integer, default=0, index=True)
+
+# Second-tier storage for the response cache (see cache.py)
+class ResponseCacheEntry(Base):
+    __tablename__ = "response_cache"
+    key = Column(String(64), primary_key=True)
+    value = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False)
+
+# Append-only store for anonymous session telemetry (see telemetry.py)
+class TelemetryEvent(Base):
+    __tablename__ = "telemetry_events"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    received_at = Column(DateTime, nullable=False)
+    scenario_id = Column(String, nullable=False)
+    rubric_score_gain = Column(Integer, nullable=False)
+    session_duration_seconds = Column(Integer, nullable=False)
+    was_skipped = Column(Boolean, nullable=False)
+    was_flagged_distressing = Column(Boolean, nullable=False)
+    gentle_mode_active = Column(Boolean, nullable=False)
+
+# Pre-aggregated telemetry per scenario, so dashboards never scan raw events
+class TelemetryRollup(Base):
+    __tablename__ = "telemetry_rollups"
+    scenario_id = Column(String, primary_key=True)
+    events = Column(Integer, default=0, nullable=False)
+    total_score_gain = Column(Integer, default=0, nullable=False)
+    total_duration_seconds = Column(Integer, default=0, nullable=False)
+    skipped = Column(Integer, default=0, nullable=False)
+    flagged_distressing = Column(Integer, default=0, nullable=False)
+
+# Scenarios served to players, so /score can ground on them (see scenarios.py)
+class ScenarioRecord(Base):
+    __tablename__ = "scenarios"
+    scenario_id = Column(String, primary_key=True)
+    context = Column(Text, nullable=False)
+    hate_speech_comment = Column(Text, nullable=False)
+    character_persona = Column(Text, nullable=False)
+    expires_at = Column(DateTime, nullable=False, index=True)
+
+def dialect_insert(dialect: str = None):
+    """
+    Returns the engine dialect's INSERT construct if it supports
+    ON CONFLICT DO UPDATE (PostgreSQL, SQLite), else None.
+    """
+    dialect = dialect or get_engine().dialect.name
+    if dialect == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect == "sqlite":
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
 
 # Create the table in the database if it doesn't exist
 def create_db_and_tables():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    engine = get_engine()
+    Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, so make sure indexes added later
+    # (e.g. leaderboard.total_xp) are created on existing databases too
+    for index in Leaderboard.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
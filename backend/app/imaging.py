@@ -0,0 +1,147 @@
+# app/imaging.py
+import asyncio
+import hashlib
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from fastapi import HTTPException, UploadFile
+
+# --- IMAGE ANALYSIS PIPELINE ---
+# read (streamed, size-capped, hashed as it arrives) -> content-hash cache lookup ->
+# prepare (decode + downscale + re-encode, off the event loop) -> async model call -> parse.
+# Verdicts are cached on a SHA-256 of the uploaded bytes only, checked before any decoding,
+# so a repeat upload costs a hash. A face-swapped or locally edited copy usually keeps the
+# same perceptual hash and must not inherit the original's verdict, so perceptual-hash
+# matches are never served; the hash only counts such near-duplicate uploads.
+# Every stage is timed so we can see where an analysis spends its time.
+# Pillow is imported inside the worker functions, so it only loads on the first upload.
+
+MAX_UPLOAD_BYTES = int(os.getenv("IMAGE_MAX_UPLOAD_BYTES", str(10 * 1024 * 1024)))
+MAX_IMAGE_SIDE = int(os.getenv("IMAGE_MAX_SIDE", "1024"))
+JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "85"))
+READ_CHUNK_BYTES = 64 * 1024
+
+# Decoding and resizing are CPU-bound; keep them on a small dedicated pool
+# so they never block the event loop or starve FastAPI's default threadpool.
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("IMAGE_WORKERS", "2")), thread_name_prefix="image")
+
+
+class Upload:
+    """ The uploaded bytes and their SHA-256. """
+    def __init__(self, data: bytes, digest: str):
+        self.data = data
+        self.digest = digest
+
+
+class PreparedImage:
+    """ A downscaled JPEG ready to send to the model, plus its perceptual hash. """
+    def __init__(self, data: bytes, phash: str, width: int, height: int):
+        self.data = data
+        self.phash = phash
+        self.width = width
+        self.height = height
+
+    def as_blob(self) -> dict:
+        return {"mime_type": "image/jpeg", "data": self.data}
+
+
+async def read_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES) -> Upload:
+    """
+    Reads an upload in chunks, rejecting it with a 413 as soon as it passes `max_bytes`
+    instead of buffering an arbitrarily large file first. Hashes it on the way in.
+    """
+    buffer = bytearray()
+    digest = hashlib.sha256()
+    while True:
+        chunk = await file.read(READ_CHUNK_BYTES)
+        if not chunk:
+            break
+        buffer.extend(chunk)
+        digest.update(chunk)
+        if len(buffer) > max_bytes:
+            raise HTTPException(status_code=413, detail=f"Image is larger than {max_bytes // (1024 * 1024)} MB.")
+    if not buffer:
+        raise HTTPException(status_code=400, detail="Uploaded image is empty.")
+    return Upload(bytes(buffer), digest.hexdigest())
+
+
+def dhash(img, hash_size: int = 8) -> str:
+    """
+    Difference hash: shrink to (hash_size+1) x hash_size grayscale and record whether each
+    pixel is brighter than its right-hand neighbour. Re-encoded or resized copies of the
+    same picture produce the same 64-bit hash.
+    """
+    from PIL import Image
+    small = img.convert("L").resize((hash_size + 1, hash_size), Image.Resampling.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return f"{bits:0{hash_size * hash_size // 4}x}"
+
+
+def prepare_image(data: bytes, max_side: int = MAX_IMAGE_SIDE) -> PreparedImage:
+    """
+    Decodes, downscales (keeping aspect ratio) and re-encodes an image as JPEG.
+    Runs in a worker thread.
+    """
+    from PIL import Image, UnidentifiedImageError
+    try:
+        img = Image.open(io.BytesIO(data))
+        img.draft("RGB", (max_side, max_side))  # Lets JPEG decode at a reduced scale
+        img = img.convert("RGB")
+    except Image.DecompressionBombError as e:
+        raise HTTPException(status_code=400, detail="Image dimensions are too large.") from e
+    except (UnidentifiedImageError, OSError) as e:
+        raise HTTPException(status_code=400, detail="Uploaded file is not a readable image.") from e
+
+    img.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+    phash = dhash(img)
+
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return PreparedImage(out.getvalue(), phash, img.width, img.height)
+
+
+async def prepare_image_async(data: bytes) -> PreparedImage:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, prepare_image, data)
+
+
+class StageTimer:
+    """
+    Records how long each pipeline stage took for one request and
+    folds the timings into running totals.
+    """
+    def __init__(self, totals: dict):
+        self.totals = totals
+        self.timings = {}
+        self._last = time.perf_counter()
+
+    def mark(self, stage: str):
+        now = time.perf_counter()
+        elapsed_ms = (now - self._last) * 1000
+        self._last = now
+        self.timings[stage] = elapsed_ms
+        totals = self.totals.setdefault(stage, {"count": 0, "total_ms": 0.0, "max_ms": 0.0})
+        totals["count"] += 1
+        totals["total_ms"] += elapsed_ms
+        totals["max_ms"] = max(totals["max_ms"], elapsed_ms)
+
+    def server_timing(self) -> str:
+        """ Formats the timings as a Server-Timing header value. """
+        return ", ".join(f"{stage};dur={ms:.1f}" for stage, ms in self.timings.items())
+
+
+def summarize_stages(totals: dict) -> dict:
+    return {
+        stage: {
+            "count": t["count"],
+            "mean_ms": round(t["total_ms"] / t["count"], 2) if t["count"] else 0.0,
+            "max_ms": round(t["max_ms"], 2),
+        }
+        for stage, t in totals.items()
+    }
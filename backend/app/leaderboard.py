@@ -0,0 +1,265 @@
+# app/leaderboard.py
+import asyncio
+import hashlib
+import json
+import logging
+import os
+from bisect import bisect_left, insort
+from starlette.concurrency import run_in_threadpool
+from .metrics import DB_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# --- LEADERBOARD ENGINE ---
+# Keeps every user's XP in a sorted in-memory index, so the top-N is a slice and a
+# user's rank is a binary search. The index is loaded from the database once at startup
+# and then updated incrementally as XP batches are written. With a cross-process store
+# (see shared_state.py) each worker also appends the users' new totals (as returned by
+# the upsert) to a bounded shared log, and the others apply them within `sync_seconds`.
+# Totals only grow, so an entry is applied as max(known, logged): applying one twice,
+# late or out of order is harmless, which is what makes reloads safe while peers write.
+# Only a worker that falls so far behind that the log no longer reaches back to the
+# last entry it applied reloads the whole table. A periodic full reload can still be
+# turned on (`reload_seconds`) as a safety net; it is off by default.
+
+TOP_N = 50
+LOG_KEY = "leaderboard:log"
+LOG_ENTRIES = 256
+
+def load_leaderboard_rows() -> list:
+    """ Reads (user_id, username, total_xp) for every user. Runs in a worker thread. """
+    from .database import engine, Leaderboard
+    table = Leaderboard.__table__
+    with DB_QUERY_SECONDS.time(operation="load_leaderboard"), engine.connect() as conn:
+        result = conn.execute(table.select().with_only_columns(table.c.user_id, table.c.username, table.c.total_xp))
+        return [tuple(row) for row in result]
+
+
+async def load_leaderboard_rows_async() -> list:
+    """ Same as `load_leaderboard_rows`, on the async engine. """
+    from .database import get_async_engine, Leaderboard
+    table = Leaderboard.__table__
+    with DB_QUERY_SECONDS.time(operation="load_leaderboard"):
+        async with get_async_engine().connect() as conn:
+            result = await conn.execute(table.select().with_only_columns(table.c.user_id, table.c.username, table.c.total_xp))
+            return [tuple(row) for row in result]
+
+
+class LeaderboardEngine:
+    """
+    Sorted index of (-total_xp, user_id) keys plus a user_id -> (username, total_xp) map.
+    Rank lookups are O(log n); updates are a binary search plus a list insert.
+    """
+    def __init__(self, top_n: int = TOP_N, reload_seconds: float = 0.0, store=None, sync_seconds: float = 2.0,
+                 log_entries: int = LOG_ENTRIES):
+        self.top_n = top_n
+        self.reload_seconds = reload_seconds
+        self.store = store if store is not None and store.cross_process else None
+        self.sync_seconds = sync_seconds
+        self.log_entries = log_entries
+        self._seen_seq = 0
+        self._outbox = []
+        # Rows flushed while a reload is reading the table, applied once it is in place
+        self._reloading = False
+        self._held = []
+        self.stats = {"reloads": 0, "published": 0, "applied": 0, "gaps": 0}
+        self.loaded = False
+        self._keys = []
+        self._users = {}
+        self._etag = None
+        self._top_cache = None
+        self._task = None
+
+    def _invalidate(self):
+        self._etag = None
+        self._top_cache = None
+
+    def replace_all(self, rows: list):
+        """ Rebuilds the index from (user_id, username, total_xp) rows. """
+        self._users = {user_id: (username, total_xp or 0) for user_id, username, total_xp in rows}
+        self._keys = sorted((-xp, user_id) for user_id, (_, xp) in self._users.items())
+        self.loaded = True
+        self._invalidate()
+
+    def apply_increments(self, rows: list):
+        """
+        Applies flushed XP batches: rows of {"user_id", "username", "total_xp", "new_total"}
+        where `total_xp` is the increment that was just written and `new_total` the user's
+        total after it. Registered on the XPBatcher; with a shared store the totals are
+        also queued for the other workers.
+        """
+        if self.store is not None:
+            self._outbox.extend(
+                {"user_id": row["user_id"], "username": row["username"], "new_total": row["new_total"]}
+                for row in rows if "new_total" in row
+            )
+        if self._reloading:
+            self._held.extend(row for row in rows if "new_total" in row)
+        self._apply(rows)
+
+    def _apply(self, rows: list):
+        """ Sets each user to max(known, `new_total`), or adds the increment if no total came back. """
+        if not self.loaded:
+            return
+        top_boundary = self._keys[self.top_n - 1] if len(self._keys) >= self.top_n else None
+        touches_top = False
+        for row in rows:
+            user_id = row["user_id"]
+            current = self._users.get(user_id)
+            username, old_xp = current if current is not None else (row["username"], 0)
+            new_xp = max(old_xp, row["new_total"]) if "new_total" in row else old_xp + row["total_xp"]
+            if current is not None:
+                if new_xp == old_xp:
+                    continue
+                old_key = (-old_xp, user_id)
+                index = bisect_left(self._keys, old_key)
+                if index < len(self._keys) and self._keys[index] == old_key:
+                    del self._keys[index]
+                if top_boundary is None or old_key <= top_boundary:
+                    touches_top = True
+            self._users[user_id] = (username, new_xp)
+            new_key = (-new_xp, user_id)
+            insort(self._keys, new_key)
+            if top_boundary is None or new_key <= top_boundary:
+                touches_top = True
+        if touches_top:
+            self._invalidate()
+
+    def top(self) -> list:
+        """ The top-N users, in the same shape the /leaderboard endpoint has always returned. """
+        if self._top_cache is None:
+            self._top_cache = [
+                {"user_id": user_id, "username": self._users[user_id][0], "total_xp": -neg_xp}
+                for neg_xp, user_id in self._keys[:self.top_n]
+            ]
+        return self._top_cache
+
+    def etag(self) -> str:
+        """ A strong ETag derived from the top-N content, so every worker agrees on it. """
+        if self._etag is None:
+            body = json.dumps(self.top(), separators=(",", ":")).encode("utf-8")
+            self._etag = '"' + hashlib.sha256(body).hexdigest()[:32] + '"'
+        return self._etag
+
+    def rank(self, user_id: str):
+        """
+        Returns the user's 1-based rank (ties share a rank) and percentile,
+        or None if the user has no XP recorded.
+        """
+        current = self._users.get(user_id)
+        if current is None:
+            return None
+        username, xp = current
+        total = len(self._keys)
+        higher = bisect_left(self._keys, (-xp, ""))
+        at_least = bisect_left(self._keys, (-xp + 1, ""))
+        lower = total - at_least
+        return {
+            "user_id": user_id,
+            "username": username,
+            "total_xp": xp,
+            "rank": higher + 1,
+            "percentile": round(100 * lower / total, 2) if total else 0.0,
+            "total_users": total,
+        }
+
+    async def load_rows(self) -> list:
+        from .database import async_db_enabled
+        if async_db_enabled():
+            return await load_leaderboard_rows_async()
+        return await run_in_threadpool(load_leaderboard_rows)
+
+    async def reload(self):
+        """
+        Rebuilds the index from the whole users table. The log position is read first:
+        every entry after it is applied on top, and any whose write the table already
+        contained is a no-op. Rows flushed here while the table is being read are
+        applied again once it is in place.
+        """
+        self._reloading, self._held = True, []
+        try:
+            seq = 0
+            if self.store is not None:
+                seq = (await self.store.get(LOG_KEY + ":seq")) or 0
+            rows = await self.load_rows()
+            self.replace_all(rows)
+            self._apply(self._held)
+            self._seen_seq = seq
+        finally:
+            self._reloading, self._held = False, []
+        self.stats["reloads"] += 1
+
+    async def _sync(self) -> bool:
+        """
+        Publishes our own flushed totals to the shared log and applies everything logged
+        since the last call (our own entries included: they are no-ops). Returns False if
+        entries we never applied have already been trimmed from the log, i.e. a full
+        reload is needed.
+        """
+        if self._outbox:
+            rows, self._outbox = self._outbox, []
+            try:
+                await self.store.push(LOG_KEY, {"rows": rows}, self.log_entries)
+            except Exception:
+                self._outbox[:0] = rows
+                raise
+            self.stats["published"] += len(rows)
+        seq = (await self.store.get(LOG_KEY + ":seq")) or 0
+        if seq == self._seen_seq:
+            return True
+        log = (await self.store.get(LOG_KEY)) or {"seq": 0, "items": []}
+        oldest = log["items"][0][0] if log["items"] else log["seq"] + 1
+        if log["seq"] < self._seen_seq or oldest > self._seen_seq + 1:
+            self.stats["gaps"] += 1
+            return False
+        for entry_seq, entry in log["items"]:
+            if entry_seq > self._seen_seq:
+                self._apply(entry["rows"])
+                self.stats["applied"] += len(entry["rows"])
+        self._seen_seq = log["seq"]
+        return True
+
+    async def run(self):
+        """
+        Loads the index, then keeps it in step with the other workers through the shared
+        log (and, if `reload_seconds` is set, reloads it from the database that often).
+        """
+        loop = asyncio.get_running_loop()
+        periodic = self.reload_seconds > 0
+        next_reload = loop.time()
+        while True:
+            try:
+                in_sync = await self._sync() if self.store is not None and self.loaded else True
+                if not self.loaded or not in_sync or (periodic and loop.time() >= next_reload):
+                    await self.reload()
+                    next_reload = loop.time() + self.reload_seconds
+            except Exception as e:
+                logger.warning(f"Leaderboard sync failed: {e}")
+            if self.store is None and not periodic and self.loaded:
+                return
+            await asyncio.sleep(self.sync_seconds if self.store is not None else self.reload_seconds or self.sync_seconds)
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "users": len(self._users), "seen_seq": self._seen_seq, "shared": self.store is not None}
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def build_leaderboard_engine(store=None) -> LeaderboardEngine:
+    """ LEADERBOARD_RELOAD_SECONDS > 0 adds a periodic full reload on top of the shared log. """
+    return LeaderboardEngine(
+        reload_seconds=float(os.getenv("LEADERBOARD_RELOAD_SECONDS", "0")),
+        store=store,
+        sync_seconds=float(os.getenv("LEADERBOARD_SYNC_SECONDS", "2")),
+    )
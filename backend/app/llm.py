@@ -0,0 +1,308 @@
+# app/llm.py
+import asyncio
+import hashlib
+import logging
+import os
+import random
+import time
+from functools import lru_cache
+from .metrics import LLM_CALL_SECONDS, LLM_IN_FLIGHT, record_token_usage
+
+logger = logging.getLogger(__name__)
+
+# --- GEMINI CLIENT WRAPPER ---
+# Every endpoint goes through one GeminiClient instead of calling the model directly.
+# It caps in-flight calls (globally and per endpoint), paces requests with a token bucket
+# matched to our quota, retries 429/503-style failures with jittered exponential backoff,
+# and lets identical concurrent prompts share a single upstream call. With a scheduler
+# (admission.py) both caps are enforced there, so every wait has a deadline; calls are
+# paced before they take a slot, so a pacing sleep never holds one.
+
+@lru_cache(maxsize=None)
+def retryable_errors() -> tuple:
+    """
+    Errors worth retrying: quota exhaustion and transient server-side failures.
+    Resolved lazily so importing this module doesn't load the Google SDK.
+    """
+    from google.api_core import exceptions as google_exceptions
+    return (
+        google_exceptions.ResourceExhausted,
+        google_exceptions.ServiceUnavailable,
+        google_exceptions.InternalServerError,
+        google_exceptions.DeadlineExceeded,
+        google_exceptions.TooManyRequests,
+    )
+
+# Default per-endpoint caps on concurrent calls, on top of the global cap
+DEFAULT_ENDPOINT_LIMITS = {
+    "analyze_image": 4,
+    "generate_game_item": 4,
+    "generate_scenario": 6,
+}
+
+
+class ModelBusyError(Exception):
+    """ Raised when the model stays rate-limited or unavailable after all retries. """
+    def __init__(self, message: str, retry_after: int = 5):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    """
+    Classic token bucket: `rate` tokens per second, holding at most `capacity`.
+    `acquire` waits until a token is available.
+    """
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._lock:
+            self._refill()
+            while self._tokens < 1:
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+                self._refill()
+            self._tokens -= 1
+
+
+class SharedTokenBucket:
+    """
+    The same pacing as TokenBucket, with the bucket held in a cross-process SharedStore,
+    so several workers share one quota instead of each pacing at the full rate.
+    Fails open (no wait) if the store is unavailable; Gemini's own 429s still back off.
+    """
+    def __init__(self, store, key: str, rate: float, capacity: float):
+        self.store = store
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity
+
+    async def acquire(self):
+        try:
+            wait = await self.store.take_token(self.key, self.rate, self.capacity)
+        except Exception as e:
+            logger.warning(f"Shared rate limiter unavailable, not pacing this call: {e}")
+            return
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+
+def prompt_key(prompt, kwargs: dict):
+    """
+    Fingerprints a prompt for single-flight coalescing.
+    Handles plain strings and lists of strings / {"mime_type", "data"} blobs.
+    """
+    digest = hashlib.sha256()
+    parts = prompt if isinstance(prompt, list) else [prompt]
+    for part in parts:
+        if isinstance(part, str):
+            digest.update(part.encode("utf-8"))
+        elif isinstance(part, dict) and isinstance(part.get("data"), bytes):
+            digest.update(part.get("mime_type", "").encode("utf-8"))
+            digest.update(part["data"])
+        else:
+            return None
+        digest.update(b"\x00")
+    digest.update(repr(sorted(kwargs.items())).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class GeminiClient:
+    """
+    Wraps a `genai.GenerativeModel` with concurrency limits, rate limiting,
+    retry/backoff and single-flight request coalescing.
+    Pass `model_factory` instead of `model` to build the model on the first call, and a
+    `scheduler` (see admission.py) to hand out the global slots by priority.
+    """
+    def __init__(self, model=None, max_concurrency: int = 16, endpoint_limits: dict = None,
+                 rate_per_minute: float = 0, max_retries: int = 3,
+                 base_delay: float = 0.5, max_delay: float = 8.0, model_factory=None, store=None,
+                 scheduler=None):
+        self.model = model
+        self.model_factory = model_factory
+        self._model_lock = asyncio.Lock()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._global = asyncio.Semaphore(max_concurrency)
+        self.scheduler = scheduler
+        self._endpoint_limits = dict(DEFAULT_ENDPOINT_LIMITS)
+        self._endpoint_limits.update(endpoint_limits or {})
+        self._endpoint_semaphores = {}
+        # A rate of 0 means "no pacing" (e.g. local development)
+        self._bucket = None
+        if rate_per_minute > 0:
+            rate, capacity = rate_per_minute / 60, max(1.0, rate_per_minute / 60)
+            if store is not None and store.cross_process:
+                self._bucket = SharedTokenBucket(store, "llm:rate", rate, capacity)
+            else:
+                self._bucket = TokenBucket(rate, capacity)
+        self._in_flight = {}
+        self.stats = {}
+
+    def _count(self, endpoint: str, counter: str):
+        counters = self.stats.setdefault(endpoint, {"calls": 0, "upstream_calls": 0, "coalesced": 0, "retries": 0, "failures": 0})
+        counters[counter] += 1
+
+    async def get_model(self):
+        """ Returns the model, building it in a worker thread on first use (the SDK import is slow). """
+        if self.model is None:
+            async with self._model_lock:
+                if self.model is None:
+                    self.model = await asyncio.to_thread(self.model_factory)
+        return self.model
+
+    def _slot(self, endpoint: str):
+        """ One of the global in-flight slots: prioritized when there is a scheduler, first come otherwise. """
+        return self.scheduler.slot(endpoint) if self.scheduler is not None else self._global
+
+    def _semaphore_for(self, endpoint: str):
+        if self.scheduler is not None:
+            # The scheduler applies the per-endpoint caps itself (its route limits)
+            return None
+        limit = self._endpoint_limits.get(endpoint)
+        if limit is None:
+            return None
+        if endpoint not in self._endpoint_semaphores:
+            self._endpoint_semaphores[endpoint] = asyncio.Semaphore(limit)
+        return self._endpoint_semaphores[endpoint]
+
+    def _backoff(self, attempt: int) -> float:
+        # "Full jitter": a random delay up to the exponential cap
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def _call_once(self, endpoint: str, prompt, kwargs: dict):
+        model = await self.get_model()
+        if self._bucket is not None:
+            await self._bucket.acquire()
+        endpoint_semaphore = self._semaphore_for(endpoint)
+        if endpoint_semaphore is not None:
+            await endpoint_semaphore.acquire()
+        try:
+            async with self._slot(endpoint):
+                self._count(endpoint, "upstream_calls")
+                LLM_IN_FLIGHT.inc(endpoint=endpoint)
+                start = time.perf_counter()
+                outcome = "error"
+                try:
+                    response = await model.generate_content_async(prompt, **kwargs)
+                    outcome = "ok"
+                finally:
+                    LLM_IN_FLIGHT.dec(endpoint=endpoint)
+                    LLM_CALL_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, outcome=outcome)
+                record_token_usage(endpoint, response)
+                return response
+        finally:
+            if endpoint_semaphore is not None:
+                endpoint_semaphore.release()
+
+    async def _call_with_retries(self, endpoint: str, prompt, kwargs: dict):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return await self._call_once(endpoint, prompt, kwargs)
+            except retryable_errors() as e:
+                if attempt == self.max_retries:
+                    self._count(endpoint, "failures")
+                    raise ModelBusyError(f"The AI model is busy, please try again shortly. ({e.__class__.__name__})") from e
+                self._count(endpoint, "retries")
+                await asyncio.sleep(self._backoff(attempt))
+            except Exception:
+                self._count(endpoint, "failures")
+                raise
+
+    async def generate(self, prompt, endpoint: str = "default", coalesce: bool = True, **kwargs):
+        """
+        Calls `generate_content_async` on the wrapped model.
+        With `coalesce`, concurrent calls with an identical prompt share one upstream call;
+        turn it off for prompts that are meant to produce a different answer every time.
+        """
+        self._count(endpoint, "calls")
+        key = prompt_key(prompt, kwargs) if coalesce else None
+        if key is None:
+            return await self._call_with_retries(endpoint, prompt, kwargs)
+
+        in_flight = self._in_flight.get(key)
+        if in_flight is not None:
+            self._count(endpoint, "coalesced")
+            # shield() so one cancelled waiter doesn't cancel the call for everybody else
+            return await asyncio.shield(in_flight)
+
+        task = asyncio.ensure_future(self._call_with_retries(endpoint, prompt, kwargs))
+        self._in_flight[key] = task
+        task.add_done_callback(lambda _: self._in_flight.pop(key, None))
+        return await asyncio.shield(task)
+
+    async def stream(self, prompt, endpoint: str = "default", **kwargs):
+        """
+        Streams the model's output as text chunks (an async generator).
+        The concurrency slots are held until the stream finishes. Retries only happen
+        before the first chunk; after that a failure is raised to the caller.
+        """
+        self._count(endpoint, "calls")
+        model = await self.get_model()
+        for attempt in range(self.max_retries + 1):
+            started = False
+            if self._bucket is not None:
+                await self._bucket.acquire()
+            endpoint_semaphore = self._semaphore_for(endpoint)
+            if endpoint_semaphore is not None:
+                await endpoint_semaphore.acquire()
+            try:
+                async with self._slot(endpoint):
+                    self._count(endpoint, "upstream_calls")
+                    LLM_IN_FLIGHT.inc(endpoint=endpoint)
+                    start = time.perf_counter()
+                    outcome = "error"
+                    try:
+                        response = await model.generate_content_async(prompt, stream=True, **kwargs)
+                        async for chunk in response:
+                            started = True
+                            yield chunk.text
+                        outcome = "ok"
+                    finally:
+                        LLM_IN_FLIGHT.dec(endpoint=endpoint)
+                        LLM_CALL_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint, outcome=outcome)
+                    # Streamed responses report usage on the aggregated response
+                    record_token_usage(endpoint, response)
+                return
+            except retryable_errors() as e:
+                if started or attempt == self.max_retries:
+                    self._count(endpoint, "failures")
+                    raise ModelBusyError(f"The AI model is busy, please try again shortly. ({e.__class__.__name__})") from e
+                self._count(endpoint, "retries")
+            except Exception:
+                self._count(endpoint, "failures")
+                raise
+            finally:
+                if endpoint_semaphore is not None:
+                    endpoint_semaphore.release()
+            await asyncio.sleep(self._backoff(attempt))
+
+    def snapshot(self) -> dict:
+        return {"model_loaded": self.model is not None, "in_flight_prompts": len(self._in_flight), "endpoints": self.stats}
+
+
+def build_gemini_client(model=None, model_factory=None, store=None, scheduler=None) -> GeminiClient:
+    """
+    LLM_MAX_CONCURRENCY caps in-flight calls (per worker), LLM_RATE_PER_MINUTE paces them
+    to the quota (0 = unpaced; shared by all workers when `store` is cross-process) and
+    LLM_MAX_RETRIES bounds retries on 429/503 errors.
+    """
+    return GeminiClient(
+        model,
+        model_factory=model_factory,
+        max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "16")),
+        rate_per_minute=float(os.getenv("LLM_RATE_PER_MINUTE", "0")),
+        max_retries=int(os.getenv("LLM_MAX_RETRIES", "3")),
+        store=store,
+        scheduler=scheduler,
+    )
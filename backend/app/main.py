@@ -1,20 +1,125 @@
 # app/main.py
-from fastapi import FastAPI
-from .api import router as api_router
-from .database import create_db_and_tables
+import asyncio
+import os
+from fastapi import FastAPI, Response
+from starlette.concurrency import run_in_threadpool
+from .api import router as api_router, scenario_pool, game_item_pool, xp_batcher, leaderboard_engine, telemetry_pipeline, readiness, content_catalog, prescreener
+from .pools import pools_enabled
+from .startup import fast_boot_enabled
+from .metrics import MetricsMiddleware, configure_logging, registry, CONTENT_TYPE
+from .admission import ClientKeyMiddleware
+from .responses import FastJSONResponse, ResponseOptimizationMiddleware
 
+# JSON log lines tagged with the request ID (LOG_LEVEL=DEBUG for more detail)
+configure_logging(os.getenv("LOG_LEVEL", "INFO"))
 
 # Initialize the FastAPI application
 app = FastAPI(
     title="Sathi Ally API",
     description="Backend for the Sathi Ally mobile app to de-escalate online hate speech.",
-    version="1.0.0"
+    version="1.0.0",
+    # orjson-backed JSON rendering for every route (see responses.py)
+    default_response_class=FastJSONResponse,
 )
 
-@app.on_event("startup")
-def on_startup():
+# Cache-Control per route template. Content that changes when XP is written is
+# revalidated every time (the ETag turns that into a cheap 304); generated learning
+# content may be reused by the client for a while.
+CACHE_POLICIES = {
+    "/api/v1/leaderboard": "no-cache",
+    "/api/v1/leaderboard/rank/{user_id}": "no-cache",
+    "/api/v1/generate_lesson": "public, max-age=3600",
+    "/api/v1/generate_quiz": "public, max-age=600",
+    "/api/v1/get_mini_lesson": "public, max-age=86400",
+}
+
+# ETags, conditional 304s and gzip/brotli for complete responses
+app.add_middleware(
+    ResponseOptimizationMiddleware,
+    policies=CACHE_POLICIES,
+    minimum_size=int(os.getenv("COMPRESS_MIN_BYTES", "512")),
+)
+
+# Per-route latency histograms, in-flight gauge and X-Request-ID propagation
+app.add_middleware(MetricsMiddleware)
+# Tags each request with its caller, for per-client fairness in the model scheduler
+app.add_middleware(ClientKeyMiddleware)
+
+def check_schema():
+    # Imported here so SQLAlchemy and the driver load in the worker thread, not at boot
+    from .database import create_db_and_tables
     create_db_and_tables()
 
+async def warm_up():
+    """
+    Startup work: the prebuilt content catalog and pre-screen model, then what needs the
+    database: schema check (retried until the database answers), stored telemetry
+    rollups and the in-memory leaderboard.
+    """
+    if content_catalog is not None:
+        await readiness.run("content_catalog", lambda: run_in_threadpool(content_catalog.load))
+    if prescreener is not None:
+        await readiness.run("prescreen_model", lambda: run_in_threadpool(prescreener.load))
+    await readiness.run("schema", lambda: run_in_threadpool(check_schema), retry=True)
+    await readiness.run("telemetry_rollups", telemetry_pipeline.load)
+    telemetry_pipeline.start()
+    # Loads the in-memory leaderboard and keeps it in sync with the database
+    leaderboard_engine.start()
+
+warm_up_task = None
+
+@app.on_event("startup")
+async def on_startup():
+    global warm_up_task
+    if fast_boot_enabled():
+        # Serve /ping right away; /ready turns 200 once the schema check is done
+        warm_up_task = asyncio.create_task(warm_up())
+    else:
+        await warm_up()
+
+@app.on_event("shutdown")
+async def stop_warm_up():
+    if warm_up_task is not None and not warm_up_task.done():
+        warm_up_task.cancel()
+        try:
+            await warm_up_task
+        except asyncio.CancelledError:
+            pass
+
+@app.on_event("startup")
+async def start_warm_pools():
+    # Background workers that keep pre-generated scenarios and game items ready.
+    # Their first refill is what builds the (lazily created) Gemini model.
+    if pools_enabled():
+        scenario_pool.start()
+        game_item_pool.start()
+
+@app.on_event("shutdown")
+async def stop_warm_pools():
+    await scenario_pool.stop()
+    await game_item_pool.stop()
+
+@app.on_event("startup")
+async def start_xp_batcher():
+    xp_batcher.start()
+
+@app.on_event("shutdown")
+async def stop_xp_batcher():
+    # Flushes any XP still waiting in the current window
+    await xp_batcher.stop()
+    await leaderboard_engine.stop()
+
+@app.on_event("shutdown")
+async def stop_telemetry_pipeline():
+    # Writes out any events still in the queue
+    await telemetry_pipeline.stop()
+
+@app.on_event("shutdown")
+async def close_database():
+    # Closes pooled async connections once the background writers are done
+    from .database import dispose_async_engine
+    await dispose_async_engine()
+
 # Include the API router
 # This adds all the routes defined in api.py (e.g., /score) to our main app.
 app.include_router(api_router, prefix="/api/v1")
@@ -24,4 +129,11 @@ async def read_root():
     """
     A simple root endpoint to confirm the API is running.
     """
-    return {"message": "Welcome to the Sathi Ally API!"}
\ No newline at end of file
+    return {"message": "Welcome to the Sathi Ally API!"}
+
+@app.get("/metrics", tags=["Root"], include_in_schema=False)
+def metrics():
+    """
+    Prometheus scrape endpoint (text exposition format).
+    """
+    return Response(registry.render(), media_type=CONTENT_TYPE)
\ No newline at end of file
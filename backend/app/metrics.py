@@ -0,0 +1,265 @@
+# app/metrics.py
+import contextvars
+import json
+import logging
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+# --- METRICS AND REQUEST TRACING ---
+# A small, dependency-free Prometheus-style registry (counters, gauges, histograms with
+# labels, rendered in the text exposition format on /metrics), plus an ASGI middleware
+# that times every request per route and tags it with a request ID that also shows up
+# in every structured log line written while handling it.
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# The ID of the request currently being handled (None outside a request)
+request_id_var = contextvars.ContextVar("request_id", default=None)
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def header(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value: float, **labels):
+        """ For collectors mirroring a count another module already keeps. """
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self) -> list:
+        with self._lock:
+            items = list(self._values.items())
+        return self.header() + [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in items]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+            state["sum"] += value
+            state["count"] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def render(self) -> list:
+        with self._lock:
+            items = [(key, {"counts": list(s["counts"]), "sum": s["sum"], "count": s["count"]}) for key, s in self._values.items()]
+        lines = self.header()
+        for key, state in items:
+            bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+            for bound, count in zip(bounds, state["counts"] + [state["count"]]):
+                le = 'le="' + bound + '"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {state['sum']}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {state['count']}")
+        return lines
+
+
+class Registry:
+    """
+    Holds every metric plus "collectors": callables run at scrape time that refresh
+    gauges from state other modules already keep (cache counters, queue depths, ...).
+    """
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self) -> str:
+        for collector in self._collectors:
+            try:
+                collector()
+            except Exception as e:
+                logging.getLogger(__name__).warning("Metrics collector failed: %s", e)
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+HTTP_REQUEST_SECONDS = registry.histogram("http_request_duration_seconds", "HTTP request latency by route.", ("method", "route", "status"))
+HTTP_IN_FLIGHT = registry.gauge("http_requests_in_flight", "HTTP requests currently being handled.")
+HTTP_NOT_MODIFIED = registry.counter("http_not_modified_total", "Conditional requests answered with a 304, by route.", ("route",))
+HTTP_COMPRESSION_BYTES = registry.counter("http_compression_bytes_total", "Response bytes before (in) and after (out) compression.", ("encoding", "stage"))
+LLM_CALL_SECONDS = registry.histogram("llm_call_duration_seconds", "Gemini call latency by prompt type.", ("endpoint", "outcome"))
+LLM_IN_FLIGHT = registry.gauge("llm_calls_in_flight", "Gemini calls currently in progress.", ("endpoint",))
+LLM_TOKENS = registry.counter("llm_tokens_total", "Gemini tokens used by prompt type.", ("endpoint", "kind"))
+PARSE_OUTCOMES = registry.counter("llm_parse_outcomes_total", "How model replies were decoded (clean/repaired/reasked/failed).", ("endpoint", "outcome"))
+DB_QUERY_SECONDS = registry.histogram("db_query_duration_seconds", "Database time by operation.", ("operation",))
+# Mirrored at scrape time from the subsystems' own stats (see collect_stats in api.py)
+CACHE_LOOKUPS = registry.counter("response_cache_lookups_total", "Response cache lookups by endpoint and result.", ("endpoint", "result"))
+CACHE_ENTRIES = registry.gauge("response_cache_entries", "Entries held in the in-memory response cache.")
+POOL_READY = registry.gauge("warm_pool_ready_items", "Pre-generated items waiting in each warm pool.", ("pool",))
+POOL_POPS = registry.counter("warm_pool_pops_total", "Warm pool pops by result.", ("pool", "result"))
+TELEMETRY_QUEUED = registry.gauge("telemetry_queue_depth", "Telemetry events waiting to be written.")
+TELEMETRY_EVENTS = registry.counter("telemetry_events_total", "Telemetry events by outcome.", ("outcome",))
+ADMISSION_QUEUED = registry.gauge("admission_waiting_calls", "Model calls waiting for a slot, by priority class.", ("priority",))
+ADMISSION_SHED = registry.counter("admission_shed_total", "Model calls shed with a 503 instead of queued, by priority class and reason.", ("priority", "reason"))
+ADMISSION_WAIT_SECONDS = registry.histogram("admission_wait_seconds", "Time queued model calls waited for a slot.", ("priority",))
+PRESCREEN_OUTCOMES = registry.counter("prescreen_replies_total", "Replies by pre-screen outcome: sent to the model, or scored locally and why.", ("outcome",))
+XP_PENDING = registry.gauge("xp_pending_users", "Users with XP waiting in the current batch window.")
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def record_token_usage(endpoint: str, response):
+    """ Adds a Gemini response's usage_metadata (if any) to the token counters. """
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return
+    LLM_TOKENS.inc(getattr(usage, "prompt_token_count", 0) or 0, endpoint=endpoint, kind="prompt")
+    LLM_TOKENS.inc(getattr(usage, "candidates_token_count", 0) or 0, endpoint=endpoint, kind="completion")
+
+
+# --- STRUCTURED LOGGING ---
+
+class JSONLogFormatter(logging.Formatter):
+    """ One JSON object per line, tagged with the current request ID. """
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "message": record.getMessage(),
+            "request_id": request_id_var.get(),
+        }
+        entry.update(getattr(record, "fields", {}))
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+def configure_logging(level: str = "INFO"):
+    handler = logging.StreamHandler()
+    handler.setFormatter(JSONLogFormatter())
+    root = logging.getLogger("app")
+    root.handlers[:] = [handler]
+    root.setLevel(level)
+    root.propagate = False
+
+
+# --- MIDDLEWARE ---
+
+_REQUEST_ID = re.compile(r"^[A-Za-z0-9._-]{1,64}$")
+
+
+class MetricsMiddleware:
+    """
+    Pure ASGI middleware: times each HTTP request, labels it with the route template
+    (e.g. /api/v1/leaderboard/rank/{user_id}, so user IDs don't explode cardinality),
+    tracks in-flight requests, and propagates X-Request-ID.
+    """
+    def __init__(self, app):
+        self.app = app
+        self.logger = logging.getLogger("app.access")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        incoming = dict(scope.get("headers") or []).get(b"x-request-id", b"").decode("latin-1")
+        request_id = incoming if _REQUEST_ID.match(incoming) else uuid.uuid4().hex
+        token = request_id_var.set(request_id)
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message.setdefault("headers", [])
+                message["headers"] = list(message["headers"]) + [(b"x-request-id", request_id.encode("latin-1"))]
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            HTTP_IN_FLIGHT.dec()
+            route = scope.get("route")
+            route_path = getattr(route, "path", None) or "unmatched"
+            HTTP_REQUEST_SECONDS.observe(elapsed, method=scope["method"], route=route_path, status=status["code"])
+            self.logger.info("request", extra={"fields": {
+                "method": scope["method"], "route": route_path, "status": status["code"],
+                "duration_ms": round(elapsed * 1000, 2),
+            }})
+            request_id_var.reset(token)
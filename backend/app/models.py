@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 from typing import List, Optional
 
 # --- SCORE ---
@@ -26,6 +26,39 @@ class ScoreResponse(BaseModel):
     suggested_rewrite: str
     safety_flags: List[str]
 
+# --- BATCH SCORING ---
+class ScoreBatchItem(BaseModel):
+    """
+    One reply in a /score_batch request. `id` is chosen by the client
+    and used to match results back to replies.
+    """
+    id: str
+    scenario_id: str
+    user_reply: str
+    locale: str
+
+class ScoreBatchRequest(BaseModel):
+    items: List[ScoreBatchItem]
+
+class ScoreBatchEntry(ScoreResponse):
+    """ One scored reply as the model returns it inside a batch. """
+    id: str
+
+class ScoreBatchOutput(BaseModel):
+    """ The model's raw answer to a batch scoring prompt. """
+    results: List[ScoreBatchEntry]
+
+class ScoreBatchResult(BaseModel):
+    """
+    The outcome for one item: `score` on success, `error` otherwise.
+    """
+    id: str
+    score: Optional[ScoreResponse] = None
+    error: Optional[str] = None
+
+class ScoreBatchResponse(BaseModel):
+    results: List[ScoreBatchResult]
+
 # --- SCENARIO GENERATION ---
 class ScenarioRequest(BaseModel):
     """
@@ -35,6 +68,14 @@ class ScenarioRequest(BaseModel):
     topic: Optional[str] = None
     gentle_mode: bool = False
 
+class ScenarioDraft(BaseModel):
+    """
+    The part of a scenario the AI writes; the server adds the scenario_id.
+    """
+    context: str
+    hate_speech_comment: str
+    character_persona: str
+
 class ScenarioResponse(BaseModel):
     """
     Defines the structure of a dynamically generated scenario.
@@ -96,7 +137,11 @@ class GameItemResponse(BaseModel):
 class UpdateScoreRequest(BaseModel):
     user_id: str
     username: str
-    xp_gained: int
+    xp_gained: int = Field(ge=0)  # XP only grows; the leaderboard relies on it
+
+class BulkUpdateScoreRequest(BaseModel):
+    """ A whole session's worth of XP events, submitted in one call. """
+    updates: List[UpdateScoreRequest]
 
 class ImageAnalysisResponse(BaseModel):
     is_likely_fake: bool
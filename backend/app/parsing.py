@@ -0,0 +1,210 @@
+# app/parsing.py
+import json
+import logging
+import re
+from pydantic import ValidationError
+from .metrics import PARSE_OUTCOMES
+
+logger = logging.getLogger(__name__)
+
+# --- STRUCTURED OUTPUT DECODING ---
+# Every endpoint used to strip ```json fences by hand and json.loads the result, so any
+# malformed reply became a 500 and the user had to trigger a full regeneration.
+# StructuredDecoder asks Gemini for JSON directly (with a schema taken from the
+# Pydantic model), repairs common defects locally, and only if that fails sends a
+# short "fix this JSON" request instead of regenerating from scratch.
+
+SYSTEM_PROMPT_JSON_REPAIR = """
+The following text was supposed to be a single JSON object matching a schema, but it could not be used.
+Error: {error}
+
+Return ONLY the corrected JSON object. Keep all of the original content; only fix the structure.
+
+Text:
+{text}
+"""
+
+_FENCE = re.compile(r"^\s*```(?:json)?\s*|\s*```\s*$", re.IGNORECASE)
+_CURLY_QUOTES = "“”"
+_PYTHON_LITERALS = {"True": "true", "False": "false", "None": "null"}
+
+
+class ResponseParseError(ValueError):
+    """ Raised when a model reply can't be turned into the expected structure, even after repair. """
+    def __init__(self, message: str, raw_text: str):
+        super().__init__(message)
+        self.raw_text = raw_text
+
+
+def json_mode(response_model) -> dict:
+    """ The generation_config asking Gemini for JSON that follows `response_model`'s schema. """
+    return {"response_mime_type": "application/json", "response_schema": response_model}
+
+
+def strip_fences(text: str) -> str:
+    return _FENCE.sub("", text.strip())
+
+
+def _balance(text: str) -> str:
+    """
+    Cuts `text` right after its first complete top-level value (dropping trailing prose),
+    or, if the reply was truncated, appends whatever quotes/brackets were left open.
+    """
+    stack = []
+    in_string = False
+    escape = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+        elif ch == '"':
+            in_string = True
+        elif ch in "{[":
+            stack.append("}" if ch == "{" else "]")
+        elif ch in "}]" and stack:
+            stack.pop()
+            if not stack:
+                return text[:i + 1]
+    if in_string:
+        text += '"'
+    text = text.rstrip().rstrip(",")
+    return text + "".join(reversed(stack))
+
+
+def _repair_tokens(text: str) -> str:
+    """
+    Fixes what lies outside string literals: curly quotes used as string delimiters,
+    Python literals (True/False/None) and trailing commas. String contents are copied
+    as they are ("None of these..." stays), except that a bare " inside a curly-quoted
+    string is escaped.
+    """
+    out = []
+    i, n = 0, len(text)
+    closers = None   # the characters that end the current string; None outside strings
+    while i < n:
+        ch = text[i]
+        if closers is not None:
+            if ch == "\\":
+                out.append(text[i:i + 2])
+                i += 2
+                continue
+            if ch in closers:
+                out.append('"')
+                closers = None
+            elif ch == '"':
+                out.append('\\"')
+            else:
+                out.append(ch)
+            i += 1
+        elif ch == '"' or ch in _CURLY_QUOTES:
+            out.append('"')
+            closers = '"' if ch == '"' else _CURLY_QUOTES
+            i += 1
+        elif ch == ",":
+            j = i + 1
+            while j < n and text[j].isspace():
+                j += 1
+            if j == n or text[j] not in "}]":
+                out.append(ch)
+            i += 1
+        elif ch.isalpha():
+            j = i + 1
+            while j < n and (text[j].isalnum() or text[j] == "_"):
+                j += 1
+            word = text[i:j]
+            out.append(_PYTHON_LITERALS.get(word, word))
+            i = j
+        else:
+            out.append(ch)
+            i += 1
+    return "".join(out)
+
+
+def repair_json(text: str) -> str:
+    """
+    Best-effort fixes for the usual LLM JSON defects: surrounding prose or fences,
+    curly-quote delimiters, trailing commas, Python literals and truncated output.
+    Only the JSON structure is touched, never the text inside strings.
+    """
+    text = strip_fences(text)
+    start = min((i for i in (text.find("{"), text.find("[")) if i != -1), default=-1)
+    if start == -1:
+        return text
+    return _balance(_repair_tokens(text[start:]))
+
+
+def loads_tolerant(text: str):
+    """ Returns (value, repaired). Raises ValueError if even the repaired text isn't JSON. """
+    try:
+        return json.loads(strip_fences(text)), False
+    except json.JSONDecodeError:
+        return json.loads(repair_json(text)), True
+
+
+class StructuredDecoder:
+    """
+    Generates through the GeminiClient in JSON mode and decodes the reply into a
+    Pydantic model, with local repair and a cheap re-ask as fallbacks.
+    Keeps per-endpoint counts of how each reply was decoded.
+    """
+    def __init__(self, client, reask: bool = True):
+        self.client = client
+        self.reask = reask
+        self.stats = {}
+
+    def _count(self, endpoint: str, outcome: str):
+        counters = self.stats.setdefault(endpoint, {"clean": 0, "repaired": 0, "reasked": 0, "failed": 0})
+        counters[outcome] += 1
+        PARSE_OUTCOMES.inc(endpoint=endpoint, outcome=outcome)
+
+    @staticmethod
+    def _convert(value, response_model, validate: bool):
+        return response_model.model_validate(value) if validate else value
+
+    async def decode(self, text: str, response_model, endpoint: str, validate: bool = True):
+        """
+        Decodes `text` into `response_model` (or just into JSON when `validate` is False).
+        Raises ResponseParseError when repair and the re-ask both fail.
+        """
+        try:
+            value, repaired = loads_tolerant(text)
+            result = self._convert(value, response_model, validate)
+            self._count(endpoint, "repaired" if repaired else "clean")
+            return result
+        except (ValueError, ValidationError) as e:
+            error = e
+
+        if self.reask:
+            prompt = SYSTEM_PROMPT_JSON_REPAIR.format(error=str(error)[:500], text=text)
+            try:
+                fixed = await self.client.generate(prompt, endpoint=f"{endpoint}:repair", generation_config=json_mode(response_model))
+                value, _ = loads_tolerant(fixed.text)
+                result = self._convert(value, response_model, validate)
+                self._count(endpoint, "reasked")
+                return result
+            except (ValueError, ValidationError) as e:
+                error = e
+
+        self._count(endpoint, "failed")
+        logger.error("Failed to decode AI response for %s: %s", endpoint, error, extra={"fields": {"raw_response": text}})
+        raise ResponseParseError(f"AI response ({endpoint}) was not in valid JSON format.", text)
+
+    async def generate(self, prompt, response_model, endpoint: str, coalesce: bool = True, validate: bool = True):
+        """ One model call in JSON mode, decoded into `response_model`. """
+        response = await self.client.generate(prompt, endpoint=endpoint, coalesce=coalesce, generation_config=json_mode(response_model))
+        return await self.decode(response.text, response_model, endpoint, validate=validate)
+
+    def snapshot(self) -> dict:
+        result = {}
+        for endpoint, counters in self.stats.items():
+            total = sum(counters.values())
+            result[endpoint] = {
+                **counters,
+                "failure_rate": round(counters["failed"] / total, 4) if total else 0.0,
+                "needed_fixing_rate": round((total - counters["clean"]) / total, 4) if total else 0.0,
+            }
+        return result
@@ -0,0 +1,181 @@
+# app/pools.py
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from .cache import normalize
+
+logger = logging.getLogger(__name__)
+
+# --- WARM POOLS ---
+# Scenarios and "Real or Fake?" items don't depend on anything the user typed
+# (beyond an optional topic), so we can generate them ahead of time.
+# Each (topic, gentle_mode) bucket holds a bounded queue of ready items; a background
+# task tops a bucket back up to capacity whenever it drops below its low-water mark.
+# Only buckets registered at startup (the default topic plus WARM_POOL_TOPICS) are kept
+# warm: a topic typed by a client is served live and never starts a refill loop. A bucket
+# nobody has popped from for `idle_seconds` is dropped until its next request, and a
+# bucket whose generation keeps failing is retried with exponential backoff.
+
+
+class WarmPool:
+    """
+    A set of bounded, pre-generated item queues with a background refill worker.
+    `generate` is an async callable taking the bucket's (topic, gentle_mode) and
+    returning one ready response object.
+    """
+    def __init__(self, name: str, generate, capacity: int = 5, low_water: int = 2,
+                 max_buckets: int = 32, retry_delay: float = 5.0, max_retry_delay: float = 300.0,
+                 idle_seconds: float = 1800.0):
+        self.name = name
+        self.generate = generate
+        self.capacity = capacity
+        self.low_water = low_water
+        self.max_buckets = max_buckets
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.idle_seconds = idle_seconds
+        self._configured = set()
+        self._buckets = {}
+        self._last_used = {}
+        self._failures = {}
+        self._retry_at = {}
+        self._wake = asyncio.Event()
+        self._task = None
+        self.stats = {"hits": 0, "misses": 0, "generated": 0, "errors": 0, "evicted": 0}
+
+    @staticmethod
+    def bucket_for(topic, gentle_mode: bool = False):
+        return (normalize(topic) if topic else None, bool(gentle_mode))
+
+    def add_bucket(self, topic=None, gentle_mode: bool = False):
+        """ Registers a bucket to keep warm. Ignored once `max_buckets` is reached. """
+        bucket = self.bucket_for(topic, gentle_mode)
+        if bucket not in self._configured and len(self._configured) < self.max_buckets:
+            self._configured.add(bucket)
+            self._activate(bucket)
+        return bucket
+
+    def _activate(self, bucket):
+        self._buckets[bucket] = deque(maxlen=self.capacity)
+        self._last_used[bucket] = time.monotonic()
+        self._wake.set()
+
+    def pop(self, topic=None, gentle_mode: bool = False):
+        """
+        Takes one ready item from the matching bucket in O(1).
+        Returns None when the bucket is empty (or not configured) so the caller can fall
+        back to live generation. A configured bucket evicted for idleness is re-activated.
+        """
+        bucket = self.bucket_for(topic, gentle_mode)
+        queue = self._buckets.get(bucket)
+        if queue is None:
+            if bucket in self._configured:
+                self._activate(bucket)
+            self.stats["misses"] += 1
+            return None
+
+        self._last_used[bucket] = time.monotonic()
+        item = queue.popleft() if queue else None
+        if len(queue) < self.low_water:
+            self._wake.set()
+        self.stats["hits" if item is not None else "misses"] += 1
+        return item
+
+    def _evict_idle(self, now: float):
+        if not self.idle_seconds:
+            return
+        for bucket, last_used in list(self._last_used.items()):
+            if now - last_used >= self.idle_seconds:
+                del self._buckets[bucket], self._last_used[bucket]
+                self._failures.pop(bucket, None)
+                self._retry_at.pop(bucket, None)
+                self.stats["evicted"] += 1
+
+    def _due(self, bucket, now: float) -> bool:
+        return len(self._buckets[bucket]) < self.low_water and self._retry_at.get(bucket, 0) <= now
+
+    def _next_wakeup(self, now: float):
+        """ Seconds until a backed-off bucket may retry or an idle one expires; None = only on pop. """
+        times = [at for bucket, at in self._retry_at.items() if len(self._buckets[bucket]) < self.low_water]
+        if self.idle_seconds:
+            times += [last_used + self.idle_seconds for last_used in self._last_used.values()]
+        return max(0.0, min(times) - now) if times else None
+
+    async def _refill(self, bucket):
+        queue = self._buckets[bucket]
+        while len(queue) < self.capacity:
+            try:
+                item = await self.generate(*bucket)
+            except Exception as e:
+                failures = self._failures.get(bucket, 0) + 1
+                delay = min(self.retry_delay * 2 ** (failures - 1), self.max_retry_delay)
+                self._failures[bucket] = failures
+                self._retry_at[bucket] = time.monotonic() + delay
+                self.stats["errors"] += 1
+                logger.warning(f"Warm pool '{self.name}' failed to refill {bucket} ({failures} in a row, retrying in {delay:.0f}s): {e}")
+                return
+            self._failures.pop(bucket, None)
+            self._retry_at.pop(bucket, None)
+            queue.append(item)
+            self.stats["generated"] += 1
+
+    async def run(self):
+        """ The background refill loop. Sleeps until a bucket runs low, a backoff ends or a bucket goes idle. """
+        while True:
+            self._wake.clear()
+            self._evict_idle(time.monotonic())
+            for bucket in list(self._buckets):
+                if self._due(bucket, time.monotonic()):
+                    await self._refill(bucket)
+            now = time.monotonic()
+            # Another pop may have happened while we were generating
+            if any(self._due(bucket, now) for bucket in self._buckets):
+                continue
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self._next_wakeup(now))
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "buckets": {
+                f"{topic or '*'}|{'gentle' if gentle else 'normal'}": len(queue)
+                for (topic, gentle), queue in self._buckets.items()
+            },
+            "backing_off": len(self._retry_at),
+        }
+
+
+def pools_enabled() -> bool:
+    """ WARM_POOLS=0 turns the background generation off (e.g. for local development). """
+    return os.getenv("WARM_POOLS", "1") == "1"
+
+
+def pool_settings() -> dict:
+    return {
+        "capacity": int(os.getenv("WARM_POOL_CAPACITY", "5")),
+        "low_water": int(os.getenv("WARM_POOL_LOW_WATER", "2")),
+        "idle_seconds": float(os.getenv("WARM_POOL_IDLE_SECONDS", "1800")),
+        "max_retry_delay": float(os.getenv("WARM_POOL_MAX_RETRY_SECONDS", "300")),
+    }
+
+
+def pool_topics() -> list:
+    """ WARM_POOL_TOPICS: comma-separated scenario topics to keep warm besides the default one. """
+    return [topic.strip() for topic in os.getenv("WARM_POOL_TOPICS", "").split(",") if topic.strip()]
@@ -0,0 +1,419 @@
+# app/prescreen.py
+"""
+Local pre-screening of Dojo replies, and the trainer for its classifier.
+
+    cd backend
+    python -m app.prescreen train                      # prescreen/seed.jsonl -> prescreen/model.json
+    python -m app.prescreen check "you are an idiot"   # print what the screen decides
+"""
+import argparse
+import json
+import logging
+import math
+import os
+import random
+import re
+import threading
+import time
+import unicodedata
+import zlib
+from collections import Counter
+from datetime import datetime
+from itertools import repeat
+from .similarity import normalize_reply
+
+logger = logging.getLogger(__name__)
+
+# --- PRE-SCREENING ---
+# Every reply used to go to Gemini, including empty submissions, keyboard mashing and
+# one-line insults, and the safety flags only arrived with the model's answer. A local
+# screen now runs first, in about a tenth of a millisecond (bench/prescreen_bench.py):
+#   - one combined regex (en, romanized and Devanagari ne) finds threats, self-harm,
+#     hate speech, profanity, insults and shared personal details in a single pass;
+#   - a logistic model over hashed word and character n-grams estimates how abusive the
+#     reply is as a whole, so "calling people stupid doesn't help" isn't flagged as an
+#     insult while "shut up you stupid loser" is;
+#   - replies with nothing to score (empty, spam) or that are nothing but abuse get a
+#     local zero score without a model call. Everything else goes to the model as before,
+#     and the local flags are merged into its safety_flags.
+# The classifier's weights are trained from prescreen/seed.jsonl by `train` above.
+
+FORMAT_VERSION = 1
+DEFAULT_SEED_PATH = os.path.join("prescreen", "seed.jsonl")
+DEFAULT_MODEL_PATH = os.path.join("prescreen", "model.json")
+HASH_BUCKETS = 1 << 18
+CHAR_NGRAM = 3
+
+# Flagged on a keyword match alone: rare in harmless replies, and costly to miss
+_KEYWORD_FLAGS = {
+    "threat": [
+        r"(?:ill|i will|im going to|im gonna|gonna) (?:kill|hurt|find|beat|destroy|get) (?:you|u)",
+        r"kill (?:you|u)", r"watch your back", r"i know where you live", r"you(?:ll| will) (?:regret|pay for) (?:this|it)",
+        r"go die", r"(?:hope you|you should) die",
+        r"मार्छु", r"मारिदिन्छु", r"मार्दिन्छु", r"सिध्याउंछु", r"काटिदिन्छु",
+        r"marc?hh?u", r"maridinc?hh?u", r"sidhyauc?hh?u", r"katidinc?hh?u",
+    ],
+    "self_harm": [
+        r"(?:kill|hurt|cut) myself", r"(?:want|wanna) to die", r"wanna die", r"end my life", r"end it all",
+        r"suicid\w*", r"self harm", r"no reason to live",
+        r"आत्महत्या", r"मर्न मन", r"मर्न चाहन्छु",
+        r"aa?tmahatya", r"marna man",
+    ],
+    "personal_info": [
+        r"my (?:home )?address is", r"my (?:phone )?number is", r"i live (?:at|on) \d+",
+        r"मेरो (?:फोन )?नम्बर", r"mero (?:phone )?number",
+    ],
+    "profanity": [
+        r"f+u+c?k+\w*", r"motherf\w*", r"shit\w*", r"bullshit", r"bitch\w*", r"bastards?", r"assholes?", r"dumbass\w*",
+        r"wtf", r"stfu", r"dickheads?",
+        r"मुजी\S*", r"माचिक्ने", r"मादरचोद", r"रण्डी\S*", r"रन्डी\S*",
+        r"muji", r"machikne", r"madarchod", r"randi\w*",
+    ],
+}
+# Flagged only when the classifier agrees: these words also appear in replies that
+# push back on the comment ("nobody should be called stupid", "go back to your country
+# is a horrible thing to say"), or have a harmless sense ("sala" is also brother-in-law)
+_CONTEXTUAL_FLAGS = {
+    "hate_speech": [
+        r"go back to (?:your country|where you came from)", r"get out of (?:our|my) country",
+        r"(?:they|you people|those people|them) (?:are|r) (?:animals|vermin|cockroaches|rats|parasites|subhuman|a disease)",
+        r"subhumans?", r"vermin",
+        r"आफ्नो देश फर्क\S*", r"देश छोड\S*",
+        r"aa?fno desh farka\w*", r"desh c?hhod\w*",
+    ],
+    "insult": [
+        r"idiots?", r"idiotic", r"stupid\w*", r"morons?", r"moronic", r"dumb", r"losers?", r"retard\w*", r"pathetic",
+        r"clowns?", r"freaks?", r"trash", r"garbage", r"brainless", r"worthless", r"shut up", r"waste of space", r"ugly",
+        r"मूर्ख\S*", r"मुर्ख\S*", r"गधा", r"लाटो", r"लाटा", r"बेवकूफ", r"बेवकुफ", r"पागल", r"कुकुर", r"कलंक", r"साला",
+        r"murkha?", r"gadha", r"lato", r"bewaa?kou?o?f", r"pagal", r"kukur", r"kalank", r"sala",
+    ],
+}
+
+# One alternation with a named group per flag, run once over the normalized reply
+_FLAG_PATTERN = re.compile(
+    r"(?<!\S)(?:" + "|".join(
+        f"(?P<{flag}>{'|'.join(terms)})" for flag, terms in {**_KEYWORD_FLAGS, **_CONTEXTUAL_FLAGS}.items()
+    ) + r")(?!\S)"
+)
+# Checked on the raw reply: normalization strips the "@" and "."
+_EMAIL = re.compile(r"[\w.+-]+@[\w-]+\.[\w.-]+")
+_PHONE = re.compile(r"\+?\d[\d\s-]{7,}\d")
+_LINK = re.compile(r"https?://\S+|www\.\S+", re.IGNORECASE)
+
+# Local scores for replies that never reach the model
+REASONS = ("empty_reply", "spam", "abusive")
+CRITERIA = ("De-escalation", "Accuracy and reframing", "Care for targets/bystanders", "Platform fit", "Self-protection")
+_RATIONALES = {
+    "en": {
+        "empty_reply": "There's no reply to score yet. Write a few words to the commenter and try again.",
+        "spam": "This looks like repeated characters or links rather than a reply to the comment.",
+        "abusive": "The reply attacks the commenter instead of calming things down, which usually makes it worse.",
+    },
+    "ne": {
+        "empty_reply": "अंक दिनका लागि अझै कुनै जवाफ छैन। टिप्पणी गर्नेलाई केही शब्द लेखेर फेरि प्रयास गर्नुहोस्।",
+        "spam": "यो टिप्पणीको जवाफभन्दा दोहोरिएका अक्षर वा लिङ्कजस्तो देखिन्छ।",
+        "abusive": "यो जवाफले स्थिति शान्त पार्नुको सट्टा टिप्पणी गर्नेलाई आक्रमण गर्छ, जसले प्रायः अझ बिगार्छ।",
+    },
+}
+_REWRITES = {
+    "en": "I don't agree with what you said, and I'd like to keep this respectful. Everyone here deserves to feel safe.",
+    "ne": "तपाईंले भनेको कुरामा म सहमत छैन, र म यो कुराकानी सम्मानजनक राख्न चाहन्छु। यहाँ सबैले सुरक्षित महसुस गर्न पाउनुपर्छ।",
+}
+
+
+def _has_two_letters(text: str) -> bool:
+    """ Counts combining marks as letters: Devanagari vowel signs are marks, so "हो" is a reply. """
+    letters = 0
+    for ch in text:
+        if unicodedata.category(ch)[0] in "LM":
+            letters += 1
+            if letters == 2:
+                return True
+    return False
+
+
+def _language(locale: str) -> str:
+    return "ne" if (locale or "en").lower().startswith("ne") else "en"
+
+
+# n-gram -> bucket id. Replies reuse a small vocabulary, so a dict lookup usually
+# replaces the encode + CRC32; cleared when it grows past _BUCKET_CACHE_MAX
+_bucket_cache = {}
+_BUCKET_CACHE_MAX = 200_000
+
+
+def _bucket(gram: str) -> int:
+    bucket = zlib.crc32(gram.encode("utf-8")) % HASH_BUCKETS
+    if len(_bucket_cache) >= _BUCKET_CACHE_MAX:
+        _bucket_cache.clear()
+    _bucket_cache[gram] = bucket
+    return bucket
+
+
+def features(text: str) -> set:
+    """
+    Hashed bucket ids of a normalized reply's words ("w:"), word pairs ("b:") and
+    character trigrams (no prefix: normalized text has no ":" to collide with).
+    """
+    words = text.split()
+    grams = {"w:" + w for w in words}
+    grams.update(f"b:{a} {b}" for a, b in zip(words, words[1:]))
+    padded = f" {text} "
+    grams.update(padded[i:i + CHAR_NGRAM] for i in range(len(padded) - CHAR_NGRAM + 1))
+    buckets = set(map(_bucket_cache.get, grams))
+    if None in buckets:
+        buckets.discard(None)
+        buckets.update(_bucket(g) for g in grams if g not in _bucket_cache)
+    return buckets
+
+
+def _sigmoid(z: float) -> float:
+    if z < -30:
+        return 0.0
+    return 1.0 / (1.0 + math.exp(-z))
+
+
+class AbuseModel:
+    """ Logistic regression over hashed n-gram features; `weights` maps bucket -> weight. """
+    def __init__(self, bias: float = 0.0, weights: dict = None, trained_on: int = 0, built_at: str = None):
+        self.bias = bias
+        self.weights = weights or {}
+        self.trained_on = trained_on
+        self.built_at = built_at
+
+    def probability(self, text: str) -> float:
+        return _sigmoid(self.bias + sum(map(self.weights.get, features(text), repeat(0.0))))
+
+    @classmethod
+    def load(cls, path: str):
+        """ Returns the model stored at `path`, or None if there is none. """
+        if not os.path.exists(path):
+            return None
+        with open(path, encoding="utf-8") as f:
+            data = json.load(f)
+        if data.get("format") != FORMAT_VERSION or data.get("buckets") != HASH_BUCKETS:
+            raise ValueError(f"Unsupported pre-screen model format in {path}")
+        return cls(data["bias"], {int(b): w for b, w in data["weights"]}, data.get("trained_on", 0), data.get("built_at"))
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        data = {
+            "format": FORMAT_VERSION,
+            "buckets": HASH_BUCKETS,
+            "built_at": self.built_at,
+            "trained_on": self.trained_on,
+            "bias": round(self.bias, 5),
+            "weights": sorted([b, round(w, 5)] for b, w in self.weights.items() if abs(w) >= 1e-4),
+        }
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(data, f, separators=(",", ":"))
+        os.replace(tmp_path, path)
+
+
+def train_model(examples: list, epochs: int = 20, learning_rate: float = 0.1, l2: float = 1e-3, seed: int = 0) -> AbuseModel:
+    """ Fits an AbuseModel with SGD on [(text, locale, label)]. Deterministic for a given seed. """
+    rows = [(features(normalize_reply(text, locale)), label) for text, locale, label in examples]
+    rng = random.Random(seed)
+    bias, weights = 0.0, {}
+    for _ in range(epochs):
+        rng.shuffle(rows)
+        for buckets, label in rows:
+            error = _sigmoid(bias + sum(weights.get(b, 0.0) for b in buckets)) - label
+            bias -= learning_rate * error
+            for b in buckets:
+                w = weights.get(b, 0.0)
+                weights[b] = w - learning_rate * (error + l2 * w)
+    return AbuseModel(bias, weights, trained_on=len(examples), built_at=datetime.utcnow().isoformat() + "Z")
+
+
+class Screening:
+    """ What the pre-screen decided for one reply. `reason` is set when the model call can be skipped. """
+    __slots__ = ("flags", "reason", "abuse")
+
+    def __init__(self, flags: list, reason: str = None, abuse: float = None):
+        self.flags = flags
+        self.reason = reason
+        self.abuse = abuse
+
+    @property
+    def skip_model(self) -> bool:
+        return self.reason is not None
+
+
+class Prescreener:
+    """
+    Runs the local screen. Replies of at most `short_circuit_words` words whose abuse
+    probability reaches `abuse_threshold` and that hit an abusive keyword are scored
+    locally; `flag_threshold` is the probability above which contextual keywords count.
+    """
+    def __init__(self, model_path: str = DEFAULT_MODEL_PATH, flag_threshold: float = 0.5,
+                 abuse_threshold: float = 0.9, short_circuit_words: int = 12):
+        self.model_path = model_path
+        self.flag_threshold = flag_threshold
+        self.abuse_threshold = abuse_threshold
+        self.short_circuit_words = short_circuit_words
+        self.model = None
+        self._loaded = False
+        self.stats = {"screened": 0, "flagged": 0, "skipped_model": 0, "total_us": 0.0}
+        self.flag_counts = Counter()
+        self.reason_counts = Counter()
+        # /score_batch screens in the threadpool while other requests screen on the loop
+        self._stats_lock = threading.Lock()
+
+    def load(self) -> bool:
+        """ Loads the classifier weights. Without them, contextual keywords are flagged on their own. """
+        self._loaded = True
+        self.model = AbuseModel.load(self.model_path)
+        if self.model is None:
+            logger.info(f"No pre-screen model at {self.model_path}; screening with keywords only")
+        return self.model is not None
+
+    def screen(self, reply: str, locale: str = "en") -> Screening:
+        started = time.perf_counter()
+        if not self._loaded:
+            self.load()
+        result = self._screen(reply or "", locale)
+        elapsed_us = (time.perf_counter() - started) * 1e6
+        with self._stats_lock:
+            self.stats["screened"] += 1
+            self.stats["total_us"] += elapsed_us
+            if result.flags:
+                self.stats["flagged"] += 1
+                self.flag_counts.update(result.flags)
+            if result.reason is not None:
+                self.stats["skipped_model"] += 1
+                self.reason_counts[result.reason] += 1
+        return result
+
+    def _screen(self, reply: str, locale: str) -> Screening:
+        text = normalize_reply(reply, _language(locale))
+        if not _has_two_letters(text):
+            return Screening(["empty_reply"], "empty_reply")
+        links = _LINK.findall(reply)
+        visible = "".join(reply.split())
+        words = text.split()
+        if (len(links) >= 2 or not _LINK.sub("", reply).strip()
+                or (len(visible) >= 12 and len(set(visible.casefold())) <= 3)
+                # One word over and over; "please please please stop" is still a reply
+                or (len(words) >= 4 and len(set(words)) == 1)):
+            return Screening(["spam"], "spam")
+
+        keyword_flags, contextual = [], []
+        for match in _FLAG_PATTERN.finditer(text):
+            flag = match.lastgroup
+            target = contextual if flag in _CONTEXTUAL_FLAGS else keyword_flags
+            if flag not in target:
+                target.append(flag)
+        if "personal_info" not in keyword_flags and (_EMAIL.search(reply) or any(
+                sum(ch.isdigit() for ch in m) >= 9 for m in _PHONE.findall(reply))):
+            keyword_flags.append("personal_info")
+
+        abuse = self.model.probability(text) if self.model is not None else None
+        # The score never flags a reply on its own, only confirms a contextual keyword
+        flags = list(keyword_flags)
+        if contextual and (abuse is None or abuse >= self.flag_threshold):
+            flags += contextual
+
+        hostile = {"threat", "hate_speech", "profanity", "insult"}.intersection(flags)
+        if (hostile and abuse is not None and abuse >= self.abuse_threshold
+                and len(words) <= self.short_circuit_words and "self_harm" not in flags):
+            return Screening(flags, "abusive", abuse)
+        return Screening(flags, None, abuse)
+
+    def local_score(self, screening: Screening, locale: str = "en") -> dict:
+        """ A ScoreResponse-shaped zero score for a reply the model doesn't need to see. """
+        language = _language(locale)
+        rationale = _RATIONALES[language][screening.reason]
+        return {
+            "scores": [{"criterion": criterion, "score": 0, "rationale": rationale} for criterion in CRITERIA],
+            "suggested_rewrite": _REWRITES[language],
+            "safety_flags": list(screening.flags),
+        }
+
+    def snapshot(self) -> dict:
+        screened = self.stats["screened"]
+        return {
+            "screened": screened,
+            "flagged": self.stats["flagged"],
+            "skipped_model": self.stats["skipped_model"],
+            "mean_us": round(self.stats["total_us"] / screened, 1) if screened else 0.0,
+            "flags": dict(self.flag_counts),
+            "reasons": dict(self.reason_counts),
+            "model": {
+                "path": self.model_path,
+                "loaded": self.model is not None,
+                "trained_on": self.model.trained_on if self.model is not None else 0,
+                "built_at": self.model.built_at if self.model is not None else None,
+            },
+        }
+
+
+def merge_flags(*flag_lists) -> list:
+    """ Union of several safety_flags lists, in first-seen order. """
+    merged = []
+    for flags in flag_lists:
+        for flag in flags or ():
+            if flag not in merged:
+                merged.append(flag)
+    return merged
+
+
+def build_prescreener():
+    """
+    PRESCREEN=0 disables the local screen; PRESCREEN_MODEL_PATH points at the trained
+    classifier. PRESCREEN_ABUSE_THRESHOLD is the abuse probability at which short abusive
+    replies are scored locally.
+    """
+    if os.getenv("PRESCREEN", "1") != "1":
+        return None
+    return Prescreener(
+        os.getenv("PRESCREEN_MODEL_PATH", DEFAULT_MODEL_PATH),
+        abuse_threshold=float(os.getenv("PRESCREEN_ABUSE_THRESHOLD", "0.9")),
+    )
+
+
+def read_seed(path: str) -> list:
+    with open(path, encoding="utf-8") as f:
+        rows = [json.loads(line) for line in f if line.strip()]
+    return [(row["text"], row.get("locale", "en"), int(row["label"])) for row in rows]
+
+
+def cross_validate(examples: list, folds: int = 5) -> float:
+    """ Accuracy of k-fold cross-validation at the 0.5 cut-off. """
+    shuffled = list(examples)
+    random.Random(1).shuffle(shuffled)
+    correct = 0
+    for k in range(folds):
+        held_out = shuffled[k::folds]
+        model = train_model([row for i, row in enumerate(shuffled) if i % folds != k])
+        correct += sum((model.probability(normalize_reply(text, locale)) >= 0.5) == bool(label) for text, locale, label in held_out)
+    return correct / len(shuffled)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train or try the local reply pre-screen.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    train = commands.add_parser("train", help="Fit the abuse classifier on the labelled seed replies")
+    train.add_argument("--seed", default=DEFAULT_SEED_PATH, help="JSONL of {text, locale, label}")
+    train.add_argument("--out", default=os.getenv("PRESCREEN_MODEL_PATH", DEFAULT_MODEL_PATH))
+    check = commands.add_parser("check", help="Screen one reply")
+    check.add_argument("reply")
+    check.add_argument("--locale", default="en")
+    args = parser.parse_args()
+
+    if args.command == "train":
+        examples = read_seed(args.seed)
+        model = train_model(examples)
+        model.save(args.out)
+        print(f"{len(examples)} examples, cross-validated accuracy {cross_validate(examples):.2f}, "
+              f"{sum(1 for w in model.weights.values() if abs(w) >= 1e-4)} weights -> {args.out}")
+    else:
+        screener = Prescreener(os.getenv("PRESCREEN_MODEL_PATH", DEFAULT_MODEL_PATH))
+        result = screener.screen(args.reply, args.locale)
+        abuse = f"{result.abuse:.3f}" if result.abuse is not None else "n/a"
+        print(f"flags={result.flags} skip_model={result.reason or 'no'} abuse={abuse}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+# app/responses.py
+import gzip
+import hashlib
+import json
+from collections import OrderedDict
+from fastapi.responses import JSONResponse
+from .metrics import HTTP_COMPRESSION_BYTES, HTTP_NOT_MODIFIED
+
+try:
+    import orjson
+except ImportError:  # optional: falls back to the stdlib encoder
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional: without it only gzip is offered
+    brotli = None
+
+# --- RESPONSE OPTIMIZATION ---
+# The Flutter client kept re-downloading the same leaderboard and lesson JSON over
+# mobile links, uncompressed and without validators. Complete (non-streamed) responses
+# now get:
+#   - GET/HEAD on routes with a Cache-Control policy (or any response with its own
+#     ETag): a strong ETag (the route's, or a hash of the body) and the policy;
+#   - a 304 with no body when a GET/HEAD's If-None-Match already names that ETag;
+#   - on every route, gzip or brotli above a size threshold; bodies with an ETag are
+#     compressed once and reused (the leaderboard, catalog lessons).
+# Streamed responses (NDJSON/SSE) pass through untouched so events still arrive live.
+
+COMPRESSIBLE_TYPES = ("application/json", "application/x-ndjson", "text/")
+
+
+class FastJSONResponse(JSONResponse):
+    """ JSONResponse rendered with orjson when it is installed (several times faster for large lists). """
+    def render(self, content) -> bytes:
+        if orjson is not None:
+            return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+        return json.dumps(content, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def body_etag(body: bytes) -> str:
+    return '"' + hashlib.blake2b(body, digest_size=16).hexdigest() + '"'
+
+
+def etag_matches(if_none_match: str, etag: str) -> bool:
+    """
+    If-None-Match comparison (weak, as RFC 9110 requires for it). A tag carrying a
+    content-coding suffix ("abc-gzip") matches the identity tag ("abc") it came from.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    wanted = etag.removeprefix("W/").strip('"')
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip().removeprefix("W/").strip('"')
+        if candidate == wanted or candidate.rsplit("-", 1)[0] == wanted:
+            return True
+    return False
+
+
+def pick_encoding(accept_encoding: str):
+    """ The best content-coding the client accepts: br (if available), then gzip, else None. """
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        quality = 1.0
+        if params.strip().startswith("q="):
+            try:
+                quality = float(params.strip()[2:])
+            except ValueError:
+                pass
+        accepted[name.strip()] = quality
+    if brotli is not None and accepted.get("br", 0) > 0:
+        return "br"
+    if accepted.get("gzip", accepted.get("*", 0)) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=4)
+    # Level 5 is most of level 9's savings on JSON for a fraction of the CPU
+    return gzip.compress(body, compresslevel=5, mtime=0)
+
+
+class ResponseOptimizationMiddleware:
+    """
+    Pure ASGI middleware adding ETags, Cache-Control, conditional 304s and compression.
+    `policies` maps a route template (e.g. "/api/v1/leaderboard") to the Cache-Control
+    value for GET and HEAD requests on it.
+    """
+    def __init__(self, app, policies: dict = None, minimum_size: int = 512, cache_entries: int = 256):
+        self.app = app
+        self.policies = policies or {}
+        self.minimum_size = minimum_size
+        self.cache_entries = cache_entries
+        self._compressed = OrderedDict()   # (etag, encoding) -> compressed body
+
+    def _compressed_body(self, etag: str, encoding: str, body: bytes) -> bytes:
+        key = (etag, encoding)
+        cached = self._compressed.get(key)
+        if cached is not None:
+            self._compressed.move_to_end(key)
+            return cached
+        compressed = compress(body, encoding)
+        self._compressed[key] = compressed
+        while len(self._compressed) > self.cache_entries:
+            self._compressed.popitem(last=False)
+        return compressed
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        request_headers = dict(scope.get("headers") or [])
+        if_none_match = request_headers.get(b"if-none-match", b"").decode("latin-1")
+        accept_encoding = request_headers.get(b"accept-encoding", b"").decode("latin-1")
+        state = {"start": None, "passthrough": False}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                # Held back until we know whether the body comes in one piece
+                state["start"] = message
+                return
+            if message["type"] != "http.response.body" or state["passthrough"]:
+                await send(message)
+                return
+            if message.get("more_body", False):
+                # Streamed: send everything as it comes
+                state["passthrough"] = True
+                await send(state["start"])
+                await send(message)
+                return
+            start, body = self.optimize(scope, state["start"], message.get("body", b""), if_none_match, accept_encoding)
+            await send(start)
+            await send({"type": "http.response.body", "body": body})
+
+        await self.app(scope, receive, send_wrapper)
+
+    def optimize(self, scope, start: dict, body: bytes, if_none_match: str, accept_encoding: str):
+        """ Returns the (possibly rewritten) start message and body of a complete response. """
+        headers = [(name.lower(), value) for name, value in start.get("headers", [])]
+        header_map = dict(headers)
+        route = getattr(scope.get("route"), "path", None)
+        # POST forms share their GET form's template but must not be cached
+        policy = self.policies.get(route) if scope["method"] in ("GET", "HEAD") else None
+
+        content_type = header_map.get(b"content-type", b"").decode("latin-1")
+        encoding = pick_encoding(accept_encoding)
+        if (len(body) < self.minimum_size or b"content-encoding" in header_map
+                or not content_type.startswith(COMPRESSIBLE_TYPES)):
+            encoding = None
+        validated = start["status"] == 200 and (policy is not None or b"etag" in header_map)
+        if encoding is None and not validated:
+            return start, body
+
+        headers = [(n, v) for n, v in headers if n not in (b"etag", b"content-length")]
+        identity_etag = None
+        if validated:
+            identity_etag = header_map.get(b"etag", b"").decode("latin-1") or body_etag(body)
+            # A compressed representation needs its own strong ETag; etag_matches maps it back
+            etag = identity_etag[:-1] + f'-{encoding}"' if encoding is not None else identity_etag
+            headers.append((b"etag", etag.encode("latin-1")))
+            if policy is not None and b"cache-control" not in header_map:
+                headers.append((b"cache-control", policy.encode("latin-1")))
+            if scope["method"] in ("GET", "HEAD") and etag_matches(if_none_match, identity_etag):
+                HTTP_NOT_MODIFIED.inc(route=route or "unmatched")
+                headers.append((b"vary", b"Accept-Encoding"))
+                return {**start, "status": 304, "headers": [(n, v) for n, v in headers if n != b"content-type"]}, b""
+
+        if encoding is not None:
+            if identity_etag is not None:
+                compressed = self._compressed_body(identity_etag, encoding, body)
+            else:
+                compressed = compress(body, encoding)
+            HTTP_COMPRESSION_BYTES.inc(len(body), encoding=encoding, stage="in")
+            HTTP_COMPRESSION_BYTES.inc(len(compressed), encoding=encoding, stage="out")
+            body = compressed
+            headers.append((b"content-encoding", encoding.encode("latin-1")))
+        headers.append((b"vary", b"Accept-Encoding"))
+        headers.append((b"content-length", str(len(body)).encode("latin-1")))
+        return {**start, "headers": headers}, body
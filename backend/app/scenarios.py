@@ -0,0 +1,131 @@
+# app/scenarios.py
+import logging
+import os
+from datetime import datetime, timedelta
+from starlette.concurrency import run_in_threadpool
+from .cache import MemoryCache
+
+logger = logging.getLogger(__name__)
+
+# --- SCENARIO REGISTRY ---
+# /generate_scenario mints a scenario_id, and /score used to get only that id and the
+# reply, so the model scored replies without seeing the comment they answer. Every
+# scenario served is registered here with a TTL: in memory (O(1) lookups, LRU-bounded),
+# in the shared state store when workers share one (see shared_state.py), and
+# optionally in the `scenarios` table so ids survive restarts. The memory tier also
+# holds each scenario's scoring prompt prefix, built once when the scenario is stored.
+
+SCENARIO_FIELDS = ("scenario_id", "context", "hate_speech_comment", "character_persona")
+
+
+class SQLScenarioStore:
+    """ Durable tier in the `scenarios` table. Expired rows are purged every `purge_every` writes. """
+    def __init__(self, purge_every: int = 500):
+        self.purge_every = purge_every
+        self._writes = 0
+
+    def get(self, scenario_id: str):
+        from .database import SessionLocal, ScenarioRecord
+        with SessionLocal() as db:
+            record = db.get(ScenarioRecord, scenario_id)
+            if record is None or record.expires_at < datetime.utcnow():
+                return None
+            return {field: getattr(record, field) for field in SCENARIO_FIELDS}
+
+    def set(self, scenario: dict, ttl: int):
+        from .database import SessionLocal, ScenarioRecord
+        with SessionLocal() as db:
+            db.merge(ScenarioRecord(**scenario, expires_at=datetime.utcnow() + timedelta(seconds=ttl)))
+            self._writes += 1
+            if self._writes % self.purge_every == 0:
+                db.query(ScenarioRecord).filter(ScenarioRecord.expires_at < datetime.utcnow()).delete()
+            db.commit()
+
+
+class ScenarioRegistry:
+    """
+    scenario_id -> scenario dict (SCENARIO_FIELDS plus "prompt_prefix"), looked up in
+    memory, then the shared store, then SQL. `prefix_builder(scenario)` builds the
+    prompt prefix whenever a scenario enters the memory tier.
+    """
+    def __init__(self, prefix_builder, ttl_seconds: int = 6 * 60 * 60, max_entries: int = 10000,
+                 sql: SQLScenarioStore = None, shared=None):
+        self.prefix_builder = prefix_builder
+        self.ttl_seconds = ttl_seconds
+        self.memory = MemoryCache(max_entries=max_entries)
+        self.sql = sql
+        self.shared = shared if shared is not None and shared.cross_process else None
+        self.stats = {"registered": 0, "memory_hits": 0, "shared_hits": 0, "sql_hits": 0, "misses": 0}
+
+    def _remember(self, scenario: dict) -> dict:
+        entry = {field: scenario[field] for field in SCENARIO_FIELDS}
+        entry["prompt_prefix"] = self.prefix_builder(entry)
+        self.memory.set(entry["scenario_id"], entry, self.ttl_seconds)
+        return entry
+
+    async def put(self, scenario: dict):
+        """ Registers a scenario that was just served. Storage errors are logged, not raised. """
+        entry = self._remember(scenario)
+        self.stats["registered"] += 1
+        stored = {field: entry[field] for field in SCENARIO_FIELDS}
+        if self.shared is not None:
+            try:
+                await self.shared.set(f"scenario:{entry['scenario_id']}", stored, self.ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Scenario registry shared write failed: {e}")
+        if self.sql is not None:
+            try:
+                await run_in_threadpool(self.sql.set, stored, self.ttl_seconds)
+            except Exception as e:
+                logger.warning(f"Scenario registry SQL write failed: {e}")
+
+    async def get(self, scenario_id: str):
+        """ Returns the registered scenario (with its prompt prefix), or None if unknown or expired. """
+        entry = self.memory.get(scenario_id)
+        if entry is not None:
+            self.stats["memory_hits"] += 1
+            return entry
+        if self.shared is not None:
+            try:
+                stored = await self.shared.get(f"scenario:{scenario_id}")
+            except Exception as e:
+                logger.warning(f"Scenario registry shared read failed: {e}")
+                stored = None
+            if stored is not None:
+                self.stats["shared_hits"] += 1
+                return self._remember(stored)
+        if self.sql is not None:
+            try:
+                stored = await run_in_threadpool(self.sql.get, scenario_id)
+            except Exception as e:
+                logger.warning(f"Scenario registry SQL read failed: {e}")
+                stored = None
+            if stored is not None:
+                self.stats["sql_hits"] += 1
+                return self._remember(stored)
+        self.stats["misses"] += 1
+        return None
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["memory_hits"] + self.stats["shared_hits"] + self.stats["sql_hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "entries": len(self.memory),
+            "ttl_seconds": self.ttl_seconds,
+            "hit_rate": round((lookups - self.stats["misses"]) / lookups, 4) if lookups else 0.0,
+        }
+
+
+def build_scenario_registry(prefix_builder, store=None) -> ScenarioRegistry:
+    """
+    SCENARIO_TTL_SECONDS is how long a served scenario can still be scored against,
+    SCENARIO_MAX_ENTRIES bounds the memory tier and SCENARIO_STORE_SQL=1 persists
+    scenarios in the database.
+    """
+    return ScenarioRegistry(
+        prefix_builder,
+        ttl_seconds=int(os.getenv("SCENARIO_TTL_SECONDS", str(6 * 60 * 60))),
+        max_entries=int(os.getenv("SCENARIO_MAX_ENTRIES", "10000")),
+        sql=SQLScenarioStore() if os.getenv("SCENARIO_STORE_SQL", "0") == "1" else None,
+        shared=store,
+    )
@@ -0,0 +1,245 @@
+# app/shared_state.py
+import asyncio
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+# --- SHARED STATE ---
+# Caches, rate limits and rollups kept in a Python dict are per process: under
+# `gunicorn -w 4` each worker would have its own cache, pace Gemini at the full quota
+# and report its own rollups. Components that need to agree across workers go
+# through a SharedStore instead: LocalStore for a single process, or SQLiteStore
+# (one WAL-mode SQLite file) for several workers on the same host.
+#
+# Values must be JSON-serializable. All operations are async; read-modify-write
+# operations (add, incr_fields, take_token, push) are atomic in both implementations.
+
+
+def _pushed(log, item, max_items: int) -> dict:
+    """ Appends `item` to a bounded log state, numbering it after the last entry. """
+    if log is None:
+        log = {"seq": 0, "items": []}
+    seq = log["seq"] + 1
+    return {"seq": seq, "items": (log["items"] + [[seq, item]])[-max_items:]}
+
+
+def _token_state(state, rate: float, capacity: float, now: float) -> dict:
+    """ Refills a token bucket state and takes one token, possibly going into debt. """
+    if state is None:
+        state = {"tokens": capacity, "updated": now}
+    tokens = min(capacity, state["tokens"] + (now - state["updated"]) * rate)
+    return {"tokens": tokens - 1, "updated": now}
+
+
+class LocalStore:
+    """ Process-local store: a dict with TTLs and an LRU bound. """
+    cross_process = False
+
+    def __init__(self, max_entries: int = 50000):
+        self.max_entries = max_entries
+        self._data = OrderedDict()   # key -> (value, expires_at or None)
+        self.stats = {"reads": 0, "writes": 0}
+
+    def _get(self, key):
+        item = self._data.get(key)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def _put(self, key, value, ttl):
+        self._data[key] = (value, time.time() + ttl if ttl else None)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    async def get(self, key: str):
+        self.stats["reads"] += 1
+        return self._get(key)
+
+    async def set(self, key: str, value, ttl: float = None):
+        self.stats["writes"] += 1
+        self._put(key, value, ttl)
+
+    async def add(self, key: str, value, ttl: float = None) -> bool:
+        """ Sets `key` only if it is absent. Returns True if it was set. """
+        self.stats["writes"] += 1
+        if self._get(key) is not None:
+            return False
+        self._put(key, value, ttl)
+        return True
+
+    async def delete(self, key: str):
+        self._data.pop(key, None)
+
+    async def incr_fields(self, key: str, deltas: dict) -> dict:
+        """ Adds each delta to the numeric field of the dict stored at `key`. Returns the new dict. """
+        self.stats["writes"] += 1
+        current = dict(self._get(key) or {})
+        for field, delta in deltas.items():
+            current[field] = current.get(field, 0) + delta
+        self._put(key, current, None)
+        return current
+
+    async def take_token(self, key: str, rate: float, capacity: float) -> float:
+        """
+        Takes a token from the bucket at `key` (refilled at `rate` per second, holding at
+        most `capacity`). Returns how long the caller must wait before using it.
+        """
+        self.stats["writes"] += 1
+        state = _token_state(self._get(key), rate, capacity, time.time())
+        self._put(key, state, None)
+        return max(0.0, -state["tokens"] / rate)
+
+    async def push(self, key: str, item, max_items: int) -> int:
+        """
+        Appends `item` to the log at `key`, keeping the newest `max_items` entries, and
+        returns its sequence number. The log is {"seq": last, "items": [[seq, item], ...]};
+        `key + ":seq"` holds just the last number so readers can poll it cheaply.
+        """
+        self.stats["writes"] += 1
+        log = _pushed(self._get(key), item, max_items)
+        self._put(key, log, None)
+        self._put(key + ":seq", log["seq"], None)
+        return log["seq"]
+
+    def snapshot(self) -> dict:
+        return {"backend": "local", "entries": len(self._data), **self.stats}
+
+
+class SQLiteStore:
+    """
+    Cross-process store in one SQLite file (WAL mode). Each worker thread keeps its
+    own connection; read-modify-write operations run inside BEGIN IMMEDIATE, which
+    serializes them across processes.
+    """
+    cross_process = True
+
+    def __init__(self, path: str, purge_every: int = 1000, busy_timeout: float = 5.0):
+        self.path = path
+        self.purge_every = purge_every
+        self.busy_timeout = busy_timeout
+        self._local = threading.local()
+        # A small dedicated pool keeps SQLite I/O off the event loop and out of FastAPI's threadpool
+        self._executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="shared-state")
+        self._writes = 0
+        self.stats = {"reads": 0, "writes": 0, "purged": 0}
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS shared_state (key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL)")
+            self._local.conn = conn
+        return conn
+
+    async def _run(self, fn, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, fn, *args)
+
+    @staticmethod
+    def _select(conn, key: str):
+        row = conn.execute("SELECT value, expires_at FROM shared_state WHERE key = ?", (key,)).fetchone()
+        if row is None or (row[1] is not None and row[1] <= time.time()):
+            return None
+        return json.loads(row[0])
+
+    @staticmethod
+    def _upsert(conn, key: str, value, ttl):
+        conn.execute(
+            "INSERT INTO shared_state (key, value, expires_at) VALUES (?, ?, ?) "
+            "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+            (key, json.dumps(value, separators=(",", ":")), time.time() + ttl if ttl else None),
+        )
+
+    def _transaction(self, fn):
+        """ Runs fn(conn) inside BEGIN IMMEDIATE ... COMMIT. """
+        conn = self._conn()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            result = fn(conn)
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        self._writes += 1
+        if self._writes % self.purge_every == 0:
+            purged = conn.execute("DELETE FROM shared_state WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),)).rowcount
+            self.stats["purged"] += purged
+        return result
+
+    async def get(self, key: str):
+        self.stats["reads"] += 1
+        return await self._run(lambda: self._select(self._conn(), key))
+
+    async def set(self, key: str, value, ttl: float = None):
+        self.stats["writes"] += 1
+        await self._run(self._transaction, lambda conn: self._upsert(conn, key, value, ttl))
+
+    async def add(self, key: str, value, ttl: float = None) -> bool:
+        self.stats["writes"] += 1
+
+        def add(conn):
+            if self._select(conn, key) is not None:
+                return False
+            self._upsert(conn, key, value, ttl)
+            return True
+        return await self._run(self._transaction, add)
+
+    async def delete(self, key: str):
+        await self._run(self._transaction, lambda conn: conn.execute("DELETE FROM shared_state WHERE key = ?", (key,)))
+
+    async def incr_fields(self, key: str, deltas: dict) -> dict:
+        self.stats["writes"] += 1
+
+        def incr(conn):
+            current = self._select(conn, key) or {}
+            for field, delta in deltas.items():
+                current[field] = current.get(field, 0) + delta
+            self._upsert(conn, key, current, None)
+            return current
+        return await self._run(self._transaction, incr)
+
+    async def take_token(self, key: str, rate: float, capacity: float) -> float:
+        self.stats["writes"] += 1
+
+        def take(conn):
+            state = _token_state(self._select(conn, key), rate, capacity, time.time())
+            self._upsert(conn, key, state, None)
+            return max(0.0, -state["tokens"] / rate)
+        return await self._run(self._transaction, take)
+
+    async def push(self, key: str, item, max_items: int) -> int:
+        self.stats["writes"] += 1
+
+        def push(conn):
+            log = _pushed(self._select(conn, key), item, max_items)
+            self._upsert(conn, key, log, None)
+            self._upsert(conn, key + ":seq", log["seq"], None)
+            return log["seq"]
+        return await self._run(self._transaction, push)
+
+    def snapshot(self) -> dict:
+        return {"backend": "sqlite", "path": self.path, **self.stats}
+
+
+def build_shared_store():
+    """
+    SHARED_STATE=local (default) keeps state in the process; SHARED_STATE=sqlite shares it
+    between all workers on the host through the file at SHARED_STATE_PATH.
+    """
+    if os.getenv("SHARED_STATE", "local") == "sqlite":
+        path = os.getenv("SHARED_STATE_PATH") or os.path.join(tempfile.gettempdir(), "sathi-ally-shared-state.db")
+        return SQLiteStore(path)
+    return LocalStore()
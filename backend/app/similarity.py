@@ -0,0 +1,228 @@
+# app/similarity.py
+import hashlib
+import os
+import re
+import struct
+import unicodedata
+from collections import OrderedDict
+
+# --- NEAR-DUPLICATE SCORE CACHE ---
+# Lots of players answer the same scenario with practically the same reply ("please be
+# respectful", "Please, be respectful!!"), and each one used to cost a full rubric call.
+# Replies are normalized, cut into character shingles and MinHashed; locality-sensitive
+# banding finds earlier replies to the same scenario that are probably similar, and the
+# exact shingle Jaccard decides whether the cached score can be reused.
+# Shingles barely notice negation ("should be respectful" vs "should not be respectful"
+# is 0.91, "feel safe" vs "feel unsafe" 0.92), so a near match whose words differ by a
+# negation word or a negated form of a shared word is never reused.
+
+# 16 bands of 2 rows: pairs above ~0.5 Jaccard almost always share a band. Candidates
+# are then checked exactly, so the signature only has to be good at recall.
+NUM_PERM = 32
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 3
+# One 64-byte BLAKE2b digest per shingle holds all NUM_PERM 16-bit hash values, so the
+# per-permutation minimums are taken in C (zip/min) instead of NUM_PERM Python loops
+# over the shingles: about 5x faster, which is what kept /score_batch's event loop busy
+_HASH_VALUES = struct.Struct(f"<{NUM_PERM}H")
+
+# Normalized, so the apostrophe is already gone ("don't" -> "dont")
+_NEGATIONS = frozenset("""
+    not no never nor neither none nobody nothing nowhere without cannot cant dont doesnt didnt isnt arent wasnt
+    werent wont wouldnt shouldnt couldnt hasnt havent hadnt mustnt neednt aint
+    होइन हैन छैन छैनन् थिएन हुँदैन हुदैन नहुने कहिल्यै hoina haina chaina chhaina thiena hudaina nahune kahilyai
+""".split())
+# "unsafe" negates "safe"; Nepali verbs take न ("नगर्नुहोस्" vs "गर्नुहोस्")
+_NEGATING_PREFIXES = ("un", "non", "dis", "in", "im", "ir", "il", "न", "na")
+
+_REPEATED_CHARS = re.compile(r"(.)\1{2,}")
+# Nepali typing variants that don't change meaning: nukta, and chandrabindu vs. anusvara
+_NEPALI_VARIANTS = str.maketrans({"\u093c": None, "\u0901": "\u0902"})
+
+
+def normalize_reply(text: str, locale: str = "en") -> str:
+    """
+    Canonical form of a reply for matching: casefolded, punctuation/symbols/emoji and
+    zero-width characters dropped, digits in any script mapped to ASCII, runs of 3+
+    repeated characters squeezed ("sooooo" -> "soo") and whitespace collapsed.
+    Accents on Latin letters are folded; Devanagari vowel signs are kept (they change
+    the word), except for the spelling variants in _NEPALI_VARIANTS when locale is "ne".
+    """
+    text = unicodedata.normalize("NFKD", text).casefold()
+    if locale == "ne":
+        text = text.translate(_NEPALI_VARIANTS)
+    out = []
+    previous = ""
+    for ch in text:
+        category = unicodedata.category(ch)
+        if category[0] in "PS" or category == "Cf":
+            # The apostrophe is dropped rather than spaced, so "that's" == "thats"
+            out.append("" if ch in "'’" else " ")
+        elif category == "Nd":
+            out.append(str(unicodedata.digit(ch)))
+        elif category == "Mn" and previous.isascii():
+            continue
+        else:
+            out.append(ch)
+        if category != "Mn":
+            previous = ch
+    text = unicodedata.normalize("NFC", _REPEATED_CHARS.sub(r"\1\1", "".join(out)))
+    return " ".join(text.split())
+
+
+def shingles(text: str, size: int = SHINGLE_SIZE) -> frozenset:
+    """ Character n-grams of the padded text; short replies still get a few shingles. """
+    padded = f" {text} "
+    if len(padded) <= size:
+        return frozenset([padded])
+    return frozenset(padded[i:i + size] for i in range(len(padded) - size + 1))
+
+
+def minhash(shingle_set: frozenset) -> tuple:
+    rows = [_HASH_VALUES.unpack(hashlib.blake2b(s.encode("utf-8"), digest_size=2 * NUM_PERM).digest()) for s in shingle_set]
+    return tuple(map(min, zip(*rows)))
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+def negation_differs(a: str, b: str) -> bool:
+    """
+    True if two normalized replies differ by a negation: a word from _NEGATIONS in one
+    but not the other, or a word that is a shared word with a negating prefix.
+    """
+    a_words, b_words = set(a.split()), set(b.split())
+    different = a_words ^ b_words
+    if different & _NEGATIONS:
+        return True
+    for word in different:
+        other = b_words if word in a_words else a_words
+        for prefix in _NEGATING_PREFIXES:
+            if word.startswith(prefix) and word[len(prefix):] in other:
+                return True
+    return False
+
+
+class _Entry:
+    __slots__ = ("namespace", "text", "shingles", "bands", "value")
+
+    def __init__(self, namespace, text, shingle_set, bands, value):
+        self.namespace = namespace
+        self.text = text
+        self.shingles = shingle_set
+        self.bands = bands
+        self.value = value
+
+
+class NearDuplicateCache:
+    """
+    LRU-bounded MinHash/LSH index of scored replies, partitioned by namespace
+    (scenario, locale and prompt version). `get` returns the stored value for the same
+    normalized reply or one whose shingle Jaccard is at least `threshold` and that
+    doesn't differ from it by a negation.
+    """
+    def __init__(self, max_entries: int = 5000, threshold: float = 0.85):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self._entries = OrderedDict()   # (namespace, text) -> _Entry, in LRU order
+        self._bands = {}                # (namespace, band, band hash) -> set of (namespace, text)
+        self.stats = {"lookups": 0, "exact_hits": 0, "near_hits": 0, "negated": 0, "misses": 0, "stores": 0, "evictions": 0}
+
+    @staticmethod
+    def _band_keys(namespace, signature: tuple) -> list:
+        return [(namespace, band, hash(signature[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND])) for band in range(BANDS)]
+
+    @staticmethod
+    def signature(text: str) -> tuple:
+        """
+        (shingles, MinHash) of a normalized reply: the CPU-heavy part of `get` and `set`,
+        safe to compute off the event loop and pass to both.
+        """
+        shingle_set = shingles(text)
+        return shingle_set, minhash(shingle_set)
+
+    def get(self, namespace, text: str, signature: tuple = None):
+        """ `text` must already be normalized. Returns (value, similarity) or (None, 0.0). """
+        self.stats["lookups"] += 1
+        key = (namespace, text)
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._entries.move_to_end(key)
+            self.stats["exact_hits"] += 1
+            return entry.value, 1.0
+
+        shingle_set, hashes = signature or self.signature(text)
+        candidates = set()
+        for band_key in self._band_keys(namespace, hashes):
+            candidates.update(self._bands.get(band_key, ()))
+        best, best_similarity = None, 0.0
+        for candidate in candidates:
+            similarity = jaccard(shingle_set, self._entries[candidate].shingles)
+            if similarity > best_similarity and similarity >= self.threshold:
+                if negation_differs(text, candidate[1]):
+                    self.stats["negated"] += 1
+                    continue
+                best, best_similarity = candidate, similarity
+        if best is not None:
+            self._entries.move_to_end(best)
+            self.stats["near_hits"] += 1
+            return self._entries[best].value, best_similarity
+
+        self.stats["misses"] += 1
+        return None, 0.0
+
+    def set(self, namespace, text: str, value, signature: tuple = None):
+        key = (namespace, text)
+        if key in self._entries:
+            self._entries[key].value = value
+            self._entries.move_to_end(key)
+            return
+        shingle_set, hashes = signature or self.signature(text)
+        bands = self._band_keys(namespace, hashes)
+        self._entries[key] = _Entry(namespace, text, shingle_set, bands, value)
+        for band_key in bands:
+            self._bands.setdefault(band_key, set()).add(key)
+        self.stats["stores"] += 1
+        while len(self._entries) > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        key, entry = self._entries.popitem(last=False)
+        for band_key in entry.bands:
+            members = self._bands.get(band_key)
+            if members is not None:
+                members.discard(key)
+                if not members:
+                    del self._bands[band_key]
+        self.stats["evictions"] += 1
+
+    def __len__(self):
+        return len(self._entries)
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["lookups"]
+        hits = self.stats["exact_hits"] + self.stats["near_hits"]
+        return {
+            **self.stats,
+            "entries": len(self._entries),
+            "threshold": self.threshold,
+            "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+            "near_hit_rate": round(self.stats["near_hits"] / lookups, 4) if lookups else 0.0,
+        }
+
+
+def build_score_cache():
+    """
+    SCORE_CACHE=0 disables it; SCORE_CACHE_MAX_ENTRIES bounds the index and
+    SCORE_CACHE_THRESHOLD is the minimum shingle Jaccard for a near-duplicate hit.
+    """
+    if os.getenv("SCORE_CACHE", "1") != "1":
+        return None
+    return NearDuplicateCache(
+        max_entries=int(os.getenv("SCORE_CACHE_MAX_ENTRIES", "5000")),
+        threshold=float(os.getenv("SCORE_CACHE_THRESHOLD", "0.85")),
+    )
@@ -0,0 +1,69 @@
+# app/startup.py
+import asyncio
+import logging
+import os
+import random
+import time
+
+logger = logging.getLogger(__name__)
+
+# --- LAZY STARTUP ---
+# Render cold-starts the service often, and the app is woken up by /ping. To answer it
+# quickly, the Gemini SDK, Pillow and the database engine are only loaded on first use,
+# and the schema check (plus the loads that depend on it) runs in the background.
+# Liveness (/ping) answers as soon as the process serves requests; readiness (/ready)
+# only once the required startup steps have succeeded.
+
+
+class Readiness:
+    """
+    Tracks named startup steps. `ready` is True once every step in `required`
+    has succeeded; optional steps are reported but never block readiness.
+    """
+    def __init__(self, required: tuple = ()):
+        self.required = set(required)
+        self.started_at = time.monotonic()
+        self.steps = {}
+
+    @property
+    def ready(self) -> bool:
+        return all(self.steps.get(name, {}).get("ok") for name in self.required)
+
+    async def run(self, name: str, step, retry: bool = False, base_delay: float = 1.0, max_delay: float = 30.0):
+        """
+        Awaits `step()` and records the outcome. With `retry`, a failing step is retried
+        with jittered backoff until it succeeds (e.g. while a sleeping database wakes up);
+        without it the failure is logged and startup carries on.
+        """
+        attempt = 0
+        while True:
+            attempt += 1
+            start = time.perf_counter()
+            try:
+                await step()
+                self.steps[name] = {"ok": True, "attempts": attempt, "seconds": round(time.perf_counter() - start, 3),
+                                    "ready_after_seconds": round(time.monotonic() - self.started_at, 3)}
+                return True
+            except Exception as e:
+                self.steps[name] = {"ok": False, "attempts": attempt, "error": str(e)}
+                if not retry:
+                    logger.warning(f"Startup step '{name}' failed: {e}")
+                    return False
+                delay = random.uniform(0, min(max_delay, base_delay * (2 ** (attempt - 1))))
+                logger.warning(f"Startup step '{name}' failed (attempt {attempt}), retrying in {delay:.1f}s: {e}")
+                await asyncio.sleep(delay)
+
+    def snapshot(self) -> dict:
+        return {
+            "ready": self.ready,
+            "uptime_seconds": round(time.monotonic() - self.started_at, 3),
+            "steps": {name: self.steps.get(name, {"ok": False, "pending": True}) for name in sorted(self.required | set(self.steps))},
+        }
+
+
+def fast_boot_enabled() -> bool:
+    """
+    FAST_BOOT=0 restores the old behaviour: startup waits for the schema check
+    (and the loads after it) before the first request is served.
+    """
+    return os.getenv("FAST_BOOT", "1") == "1"
@@ -0,0 +1,168 @@
+# app/streaming.py
+import json
+
+# --- STREAMING RESPONSES ---
+# Gemini can stream its output, but our responses are JSON objects that are only
+# parseable once complete. StreamingJSONParser scans the text as it arrives and
+# reports every top-level field (and every element of a top-level array) the moment
+# it is complete, so e.g. lesson paragraphs and rubric scores can be sent one by one.
+
+NDJSON_MEDIA_TYPE = "application/x-ndjson"
+SSE_MEDIA_TYPE = "text/event-stream"
+
+
+class StreamingJSONParser:
+    """
+    Incremental scanner for a single JSON object, fed in arbitrary text chunks.
+    `feed` returns a list of (field, index, value) tuples: `index` is the position for
+    elements of a top-level array and None for any other top-level value.
+    Text before the first '{' (e.g. a ```json fence) is ignored.
+    """
+    def __init__(self):
+        self.text = ""
+        self.done = False
+        self._pos = 0
+        self._started = False
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._key = None
+        self._key_start = None
+        self._awaiting_value = False
+        self._value_start = None
+        self._in_array = False
+        self._element_start = None
+        self._element_index = 0
+
+    def _element(self, end: int):
+        raw = self.text[self._element_start:end].strip()
+        event = (self._key, self._element_index, json.loads(raw))
+        self._element_index += 1
+        self._element_start = None
+        return event
+
+    def _value(self, end: int):
+        event = (self._key, None, json.loads(self.text[self._value_start:end].strip()))
+        self._value_start = None
+        return event
+
+    def feed(self, chunk: str) -> list:
+        self.text += chunk
+        text = self.text
+        events = []
+        for i in range(self._pos, len(text)):
+            if self.done:
+                break
+            ch = text[i]
+
+            if not self._started:
+                if ch == "{":
+                    self._started = True
+                    self._depth = 1
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                    if self._key_start is not None:
+                        self._key = json.loads(text[self._key_start:i + 1])
+                        self._key_start = None
+                    elif self._in_array and self._depth == 2 and self._element_start is not None:
+                        events.append(self._element(i + 1))
+                continue
+
+            if ch.isspace():
+                continue
+
+            # Mark where a top-level value or an array element begins
+            if self._awaiting_value:
+                self._awaiting_value = False
+                self._value_start = i
+                if ch == "[":
+                    self._in_array = True
+                    self._element_index = 0
+            elif self._in_array and self._depth == 2 and self._element_start is None and ch not in ",]":
+                self._element_start = i
+
+            if ch == '"':
+                self._in_string = True
+                if self._depth == 1 and self._value_start is None:
+                    self._key_start = i
+            elif ch in "{[":
+                self._depth += 1
+            elif ch in "}]":
+                self._depth -= 1
+                if self._in_array and self._depth == 2 and self._element_start is not None:
+                    # A nested object/array element just closed
+                    events.append(self._element(i + 1))
+                elif self._in_array and self._depth == 1:
+                    # The top-level array itself closed; flush a trailing scalar element
+                    if self._element_start is not None:
+                        events.append(self._element(i))
+                    self._in_array = False
+                    self._value_start = None
+                elif self._depth == 0:
+                    if self._value_start is not None:
+                        events.append(self._value(i))
+                    self.done = True
+            elif ch == ",":
+                if self._in_array and self._depth == 2 and self._element_start is not None:
+                    events.append(self._element(i))
+                elif self._depth == 1 and self._value_start is not None:
+                    events.append(self._value(i))
+            elif ch == ":" and self._depth == 1 and self._value_start is None:
+                self._awaiting_value = True
+
+        self._pos = len(text)
+        return events
+
+    def result(self) -> dict:
+        """ Parses the complete text, repairing it if the model's JSON was malformed. """
+        from .parsing import loads_tolerant
+        value, _ = loads_tolerant(self.text)
+        return value
+
+
+def wants_sse(accept_header: str) -> bool:
+    return SSE_MEDIA_TYPE in (accept_header or "")
+
+
+def format_event(event: dict, sse: bool) -> str:
+    """ Serializes one event as an NDJSON line or a Server-Sent Events frame. """
+    payload = json.dumps(event, ensure_ascii=False)
+    if sse:
+        return f"event: {event['type']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+
+async def stream_model_events(chunks, response_model):
+    """
+    Turns an async iterator of model text chunks into stream events:
+      {"type": "field", "field": ..., "value": ...}        a complete top-level value
+      {"type": "item", "field": ..., "index": i, "value": ...}   one element of a top-level array
+      {"type": "done", "value": {...}}                     the full, validated response
+    Validation errors surface as an exception after the partial events were sent.
+    """
+    parser = StreamingJSONParser()
+    async for chunk in chunks:
+        for field, index, value in parser.feed(chunk):
+            if index is None:
+                yield {"type": "field", "field": field, "value": value}
+            else:
+                yield {"type": "item", "field": field, "index": index, "value": value}
+    yield {"type": "done", "value": response_model(**parser.result()).model_dump()}
+
+
+async def replay_events(value: dict):
+    """ Emits the same event sequence for an already complete response (e.g. a cache hit). """
+    for field, field_value in value.items():
+        if isinstance(field_value, list):
+            for index, item in enumerate(field_value):
+                yield {"type": "item", "field": field, "index": index, "value": item}
+        else:
+            yield {"type": "field", "field": field, "value": field_value}
+    yield {"type": "done", "value": value}
@@ -0,0 +1,326 @@
+# app/telemetry.py
+import asyncio
+import gzip
+import json
+import logging
+import os
+from collections import OrderedDict
+from datetime import datetime
+from starlette.concurrency import run_in_threadpool
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# --- TELEMETRY INGESTION ---
+# The endpoint only puts events on a bounded queue; a background writer drains it in
+# batches into the append-only `telemetry_events` table (or gzipped NDJSON files when no
+# database is configured). Per-scenario rollups are updated incrementally as each batch
+# is written, so dashboards never have to scan raw rows and never count events the sink
+# dropped. With a cross-process store (see shared_state.py) each batch's rollup deltas
+# are also added there, so every worker reports the same totals.
+# A batch the sink rejects is retried with exponential backoff a bounded number of times
+# before it is dropped, and shutdown lets the writer finish its batch before draining the
+# queue. Only the most active scenarios' rollups stay in memory; the others are read back
+# from the sink on request.
+
+ROLLUP_FIELDS = ("events", "total_score_gain", "total_duration_seconds", "skipped", "flagged_distressing")
+
+
+def empty_rollup() -> dict:
+    return {field: 0 for field in ROLLUP_FIELDS}
+
+
+def add_to_rollup(rollup: dict, event: dict):
+    rollup["events"] += 1
+    rollup["total_score_gain"] += event["rubric_score_gain"]
+    rollup["total_duration_seconds"] += event["session_duration_seconds"]
+    rollup["skipped"] += int(event["was_skipped"])
+    rollup["flagged_distressing"] += int(event["was_flagged_distressing"])
+
+
+def rollup_deltas(events: list) -> dict:
+    """ Per-scenario rollup counters for a batch of events. """
+    deltas = {}
+    for event in events:
+        add_to_rollup(deltas.setdefault(event["scenario_id"], empty_rollup()), event)
+    return deltas
+
+
+def summarize_rollup(rollup: dict) -> dict:
+    """ Turns raw counters into the rates dashboards care about. """
+    events = rollup["events"]
+    if not events:
+        return {"events": 0, "mean_score_gain": 0.0, "mean_duration_seconds": 0.0, "skip_rate": 0.0, "distress_flag_rate": 0.0}
+    return {
+        "events": events,
+        "mean_score_gain": round(rollup["total_score_gain"] / events, 3),
+        "mean_duration_seconds": round(rollup["total_duration_seconds"] / events, 1),
+        "skip_rate": round(rollup["skipped"] / events, 4),
+        "distress_flag_rate": round(rollup["flagged_distressing"] / events, 4),
+    }
+
+
+class SQLTelemetrySink:
+    """ Bulk-inserts events and upserts their rollup deltas in one transaction. """
+    def write(self, events: list):
+        from .database import engine, TelemetryEvent, TelemetryRollup, dialect_insert
+        rollup_rows = [{"scenario_id": scenario_id, **counters} for scenario_id, counters in rollup_deltas(events).items()]
+
+        rollups = TelemetryRollup.__table__
+        insert = dialect_insert()
+        with engine.begin() as conn:
+            conn.execute(TelemetryEvent.__table__.insert(), events)
+            if insert is None:
+                for row in rollup_rows:
+                    updated = conn.execute(
+                        rollups.update()
+                        .where(rollups.c.scenario_id == row["scenario_id"])
+                        .values({field: rollups.c[field] + row[field] for field in ROLLUP_FIELDS})
+                    )
+                    if updated.rowcount == 0:
+                        conn.execute(rollups.insert().values(**row))
+            else:
+                stmt = insert(rollups).values(rollup_rows)
+                stmt = stmt.on_conflict_do_update(
+                    index_elements=[rollups.c.scenario_id],
+                    set_={field: rollups.c[field] + stmt.excluded[field] for field in ROLLUP_FIELDS},
+                )
+                conn.execute(stmt)
+
+    def load_rollups(self) -> dict:
+        from .database import engine, TelemetryRollup
+        with engine.connect() as conn:
+            rows = conn.execute(TelemetryRollup.__table__.select()).mappings()
+            return {row["scenario_id"]: {field: row[field] for field in ROLLUP_FIELDS} for row in rows}
+
+    def load_rollup(self, scenario_id: str):
+        from .database import engine, TelemetryRollup
+        rollups = TelemetryRollup.__table__
+        with engine.connect() as conn:
+            row = conn.execute(rollups.select().where(rollups.c.scenario_id == scenario_id)).mappings().first()
+        return {field: row[field] for field in ROLLUP_FIELDS} if row is not None else None
+
+
+class FileTelemetrySink:
+    """
+    Appends each batch as one gzip member to a daily `telemetry-YYYY-MM-DD.ndjson.gz` file.
+    Concatenated gzip members decompress as a single stream. Every worker appends to the
+    same file, so each member is compressed first and written under an exclusive flock;
+    where fcntl is unavailable each process writes its own `...-<pid>.ndjson.gz` instead.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def path_for(self, day: datetime) -> str:
+        suffix = "" if fcntl is not None else f"-{os.getpid()}"
+        return os.path.join(self.directory, f"telemetry-{day:%Y-%m-%d}{suffix}.ndjson.gz")
+
+    def write(self, events: list):
+        os.makedirs(self.directory, exist_ok=True)
+        payload = "".join(json.dumps(event, default=str) + "\n" for event in events)
+        member = gzip.compress(payload.encode("utf-8"))
+        with open(self.path_for(datetime.utcnow()), "ab") as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)  # Released when the file is closed
+            f.write(member)
+
+    def load_rollups(self) -> dict:
+        return {}
+
+    def load_rollup(self, scenario_id: str):
+        return None
+
+
+class TelemetryPipeline:
+    """
+    Bounded queue + batching background writer + incremental rollups.
+    `offer` never blocks: it returns False when the queue is full so the
+    endpoint can push back with a 429 instead of growing memory. A failed batch
+    is written up to `max_attempts` times, `retry_delay` doubling in between.
+    """
+    def __init__(self, sink, max_queue: int = 10000, batch_size: int = 500,
+                 flush_interval: float = 1.0, max_tracked_scenarios: int = 10000, store=None,
+                 max_attempts: int = 5, retry_delay: float = 0.5, max_retry_delay: float = 30.0):
+        self.sink = sink
+        # Only a cross-process store is worth the extra writes; a local one would mirror self.rollups
+        self.store = store if store is not None and store.cross_process else None
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_tracked_scenarios = max_tracked_scenarios
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self._queue = asyncio.Queue(maxsize=max_queue)
+        self._stopping = asyncio.Event()
+        self._task = None
+        self.overall = empty_rollup()
+        self.rollups = OrderedDict()
+        self.stats = {"accepted": 0, "rejected": 0, "written": 0, "dropped": 0, "batches": 0, "retries": 0}
+
+    def offer(self, event: dict) -> bool:
+        event = {**event, "received_at": datetime.utcnow()}
+        try:
+            self._queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.stats["rejected"] += 1
+            return False
+        self.stats["accepted"] += 1
+        return True
+
+    def _record(self, event: dict):
+        add_to_rollup(self.overall, event)
+        scenario_id = event["scenario_id"]
+        rollup = self.rollups.get(scenario_id)
+        if rollup is None:
+            rollup = self.rollups[scenario_id] = empty_rollup()
+            if len(self.rollups) > self.max_tracked_scenarios:
+                self.rollups.popitem(last=False)
+        else:
+            self.rollups.move_to_end(scenario_id)
+        add_to_rollup(rollup, event)
+
+    async def _share(self, rollups: dict):
+        """ Adds per-scenario rollup counters to the shared totals. """
+        overall = empty_rollup()
+        try:
+            for scenario_id, counters in rollups.items():
+                await self.store.incr_fields(f"telemetry:scenario:{scenario_id}", counters)
+                for field in ROLLUP_FIELDS:
+                    overall[field] += counters[field]
+            await self.store.incr_fields("telemetry:overall", overall)
+        except Exception as e:
+            logger.warning(f"Telemetry rollups could not be shared: {e}")
+
+    async def _write(self, batch: list):
+        """
+        Writes one batch, retrying with backoff; only events the sink accepted are counted
+        in the rollups. Once stopping, a failed batch gets one more attempt without waiting.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                await run_in_threadpool(self.sink.write, batch)
+                break
+            except Exception as e:
+                logger.warning(f"Telemetry batch of {len(batch)} events could not be written (attempt {attempt}): {e}")
+            if attempt == self.max_attempts or (self._stopping.is_set() and attempt > 1):
+                self.stats["dropped"] += len(batch)
+                logger.warning(f"Dropping telemetry batch of {len(batch)} events")
+                return
+            self.stats["retries"] += 1
+            delay = min(self.retry_delay * 2 ** (attempt - 1), self.max_retry_delay)
+            try:
+                # Cut short by stop()
+                await asyncio.wait_for(self._stopping.wait(), timeout=delay)
+            except asyncio.TimeoutError:
+                pass
+        self.stats["written"] += len(batch)
+        self.stats["batches"] += 1
+        for event in batch:
+            self._record(event)
+        if self.store is not None:
+            await self._share(rollup_deltas(batch))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while not self._stopping.is_set():
+            try:
+                # Wakes up every flush_interval to notice stop()
+                batch = [await asyncio.wait_for(self._queue.get(), self.flush_interval)]
+            except asyncio.TimeoutError:
+                continue
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._write(batch)
+
+    async def load(self):
+        """
+        Seeds the in-memory rollups from what the sink has already stored. With a shared
+        store only the first worker to start seeds the shared totals.
+        """
+        stored = await run_in_threadpool(self.sink.load_rollups)
+        for scenario_id, counters in stored.items():
+            self.rollups[scenario_id] = counters
+            for field in ROLLUP_FIELDS:
+                self.overall[field] += counters[field]
+        if self.store is not None and await self.store.add("telemetry:seeded", True):
+            await self._share(stored)
+
+    async def rollup(self, scenario_id: str = None):
+        """ Raw counters for one scenario (None if unknown), or the overall rollup. """
+        if self.store is not None:
+            key = f"telemetry:scenario:{scenario_id}" if scenario_id is not None else "telemetry:overall"
+            try:
+                shared = await self.store.get(key)
+            except Exception as e:
+                logger.warning(f"Shared telemetry rollup could not be read: {e}")
+            else:
+                if shared is not None:
+                    return shared
+                if scenario_id is None:
+                    return empty_rollup()
+                return await self._stored_rollup(scenario_id)
+        if scenario_id is None:
+            return self.overall
+        rollup = self.rollups.get(scenario_id)
+        if rollup is None:
+            # Evicted from self.rollups, or written by another worker
+            rollup = await self._stored_rollup(scenario_id)
+        return rollup
+
+    async def _stored_rollup(self, scenario_id: str):
+        try:
+            return await run_in_threadpool(self.sink.load_rollup, scenario_id)
+        except Exception as e:
+            logger.warning(f"Stored telemetry rollup could not be read: {e}")
+            return None
+
+    def start(self):
+        if self._task is None:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        # Let the writer finish the batch it holds rather than cancelling it mid-write
+        self._stopping.set()
+        if self._task is not None:
+            await self._task
+            self._task = None
+        # Write out whatever is still queued
+        remaining = []
+        while not self._queue.empty():
+            remaining.append(self._queue.get_nowait())
+        for start in range(0, len(remaining), self.batch_size):
+            await self._write(remaining[start:start + self.batch_size])
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "queued": self._queue.qsize(), "overall": summarize_rollup(self.overall)}
+
+
+def build_telemetry_pipeline(store=None) -> TelemetryPipeline:
+    """
+    TELEMETRY_SINK=db|file picks the store; it defaults to the database when
+    DATABASE_URL is set and to gzipped NDJSON files in TELEMETRY_DIR otherwise.
+    `store` is the shared state store that rollups are aggregated in across workers.
+    """
+    sink_name = os.getenv("TELEMETRY_SINK") or ("db" if os.getenv("DATABASE_URL") else "file")
+    if sink_name == "db":
+        sink = SQLTelemetrySink()
+    else:
+        sink = FileTelemetrySink(os.getenv("TELEMETRY_DIR", "telemetry"))
+    return TelemetryPipeline(
+        sink,
+        max_queue=int(os.getenv("TELEMETRY_MAX_QUEUE", "10000")),
+        batch_size=int(os.getenv("TELEMETRY_BATCH_SIZE", "500")),
+        store=store,
+    )
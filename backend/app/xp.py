@@ -0,0 +1,274 @@
+# app/xp.py
+import asyncio
+import logging
+import os
+from starlette.concurrency import run_in_threadpool
+from .metrics import DB_QUERY_SECONDS
+
+logger = logging.getLogger(__name__)
+
+# --- XP INGESTION ---
+# Quiz answers and Dojo rounds each award a little XP. Rather than a SELECT + UPDATE +
+# COMMIT per event, increments are coalesced in memory per user for a short window and
+# then written as one multi-row INSERT ... ON CONFLICT DO UPDATE, which is also atomic,
+# so concurrent updates for the same user can no longer lose increments. The upsert
+# returns each user's new total, which listeners (the leaderboard) receive as `new_total`.
+# At most `max_pending_users` users are queued: increments for users already queued are
+# merged, new users are rejected (429) until a flush makes room. Batches that fail while
+# the database is down are merged back under the same cap and retried with backoff.
+
+UPSERT_CHUNK_ROWS = 500
+
+
+def upsert_statements(insert, rows: list) -> list:
+    """
+    Multi-row INSERT ... ON CONFLICT DO UPDATE statements adding each row's XP, in chunks.
+    Each returns the (user_id, total_xp) of the rows it wrote.
+    """
+    from sqlalchemy import func
+    from .database import Leaderboard
+    table = Leaderboard.__table__
+    statements = []
+    for start in range(0, len(rows), UPSERT_CHUNK_ROWS):
+        stmt = insert(table).values(rows[start:start + UPSERT_CHUNK_ROWS])
+        statements.append(stmt.on_conflict_do_update(
+            index_elements=[table.c.user_id],
+            set_={"total_xp": func.coalesce(table.c.total_xp, 0) + stmt.excluded.total_xp},
+        ).returning(table.c.user_id, table.c.total_xp))
+    return statements
+
+
+def upsert_xp(rows: list) -> dict:
+    """
+    Adds each row's `total_xp` to the user's stored total, creating missing users.
+    `rows` is a list of {"user_id", "username", "total_xp"} dicts with unique user_ids.
+    Returns {user_id: new total}.
+    """
+    from sqlalchemy import func
+    from .database import engine, Leaderboard, dialect_insert
+    table = Leaderboard.__table__
+    insert = dialect_insert()
+
+    with DB_QUERY_SECONDS.time(operation="upsert_xp"), engine.begin() as conn:
+        if insert is None:
+            # Generic fallback: still one transaction, but one statement per user
+            totals = {}
+            for row in rows:
+                updated = conn.execute(
+                    table.update()
+                    .where(table.c.user_id == row["user_id"])
+                    .values(total_xp=func.coalesce(table.c.total_xp, 0) + row["total_xp"])
+                )
+                if updated.rowcount == 0:
+                    conn.execute(table.insert().values(**row))
+                totals[row["user_id"]] = conn.execute(
+                    table.select().with_only_columns(table.c.total_xp).where(table.c.user_id == row["user_id"])
+                ).scalar_one()
+            return totals
+
+        totals = {}
+        for stmt in upsert_statements(insert, rows):
+            totals.update(tuple(row) for row in conn.execute(stmt))
+        return totals
+
+
+async def upsert_xp_async(rows: list) -> dict:
+    """ Same as `upsert_xp`, on the async engine (only PostgreSQL and SQLite have one). """
+    from .database import get_async_engine, dialect_insert
+    engine = get_async_engine()
+    insert = dialect_insert(engine.dialect.name)
+    totals = {}
+    with DB_QUERY_SECONDS.time(operation="upsert_xp"):
+        async with engine.begin() as conn:
+            for stmt in upsert_statements(insert, rows):
+                totals.update(tuple(row) for row in await conn.execute(stmt))
+    return totals
+
+
+async def write_xp(rows: list) -> dict:
+    """ Writes through the async engine when one is available, else the sync engine in the threadpool. """
+    from .database import async_db_enabled
+    if async_db_enabled():
+        return await upsert_xp_async(rows)
+    return await run_in_threadpool(upsert_xp, rows)
+
+
+class XPBacklogFull(Exception):
+    """ Raised when an update would queue more than `max_pending_users` users. """
+
+
+class XPBatcher:
+    """
+    Coalesces XP increments per user and flushes them in the background.
+    With a window of 0 every `add` is written straight through.
+    """
+    def __init__(self, window_seconds: float = 0.5, max_pending_users: int = 5000, writer=write_xp,
+                 max_retry_delay: float = 30.0):
+        self.window_seconds = window_seconds
+        self.writer = writer
+        self.max_pending_users = max_pending_users
+        self.max_retry_delay = max_retry_delay
+        self._pending = {}
+        self._wake = asyncio.Event()
+        self._stopping = asyncio.Event()
+        self._task = None
+        # Called with the rows of every successfully written batch (e.g. the leaderboard engine),
+        # each with the user's `new_total` when the writer returned it
+        self.listeners = []
+        self.stats = {"events": 0, "flushes": 0, "rows_written": 0, "errors": 0, "rejected": 0, "dropped": 0}
+
+    def add(self, user_id: str, username: str, xp_gained: int):
+        """ Queues an increment. Returns immediately; raises XPBacklogFull if the queue is full. """
+        entry = self._pending.get(user_id)
+        if entry is None:
+            if len(self._pending) >= self.max_pending_users:
+                self.stats["rejected"] += 1
+                self._wake.set()
+                raise XPBacklogFull(f"{len(self._pending)} users are already waiting to be written")
+            self._pending[user_id] = {"user_id": user_id, "username": username, "total_xp": xp_gained}
+        else:
+            entry["total_xp"] += xp_gained
+        self.stats["events"] += 1
+        if len(self._pending) >= self.max_pending_users:
+            self._wake.set()
+
+    def _requeue(self, rows: list):
+        """
+        Merges unwritten rows back into the queue. Rows for users that no longer fit
+        under the cap are dropped and counted, so a long outage can't grow memory.
+        """
+        dropped = 0
+        for row in rows:
+            entry = self._pending.get(row["user_id"])
+            if entry is not None:
+                entry["total_xp"] += row["total_xp"]
+            elif len(self._pending) < self.max_pending_users:
+                self._pending[row["user_id"]] = dict(row)
+            else:
+                dropped += 1
+        if dropped:
+            self.stats["dropped"] += dropped
+            logger.warning(f"XP queue is full; dropped {dropped} unwritten updates")
+
+    async def flush(self, requeue: bool = True):
+        """
+        Writes everything queued so far. If the database is unreachable the increments
+        are put back for the next flush (unless `requeue` is False) and the error re-raised.
+        """
+        if not self._pending:
+            return
+        from sqlalchemy.exc import IntegrityError
+        rows = list(self._pending.values())
+        self._pending = {}
+        written = rows
+        totals = {}
+        failed, failure = [], None
+        try:
+            totals.update(await self.writer(rows) or {})
+        except IntegrityError as e:
+            # Usually a username already taken by another user_id. Retry row by row
+            # so one bad row doesn't drop everybody else's XP.
+            logger.warning(f"XP batch upsert failed, retrying per user: {e}")
+            written = []
+            for row in rows:
+                try:
+                    totals.update(await self.writer([row]) or {})
+                    written.append(row)
+                except IntegrityError as row_error:
+                    self.stats["errors"] += 1
+                    logger.warning(f"Dropping XP update for user {row['user_id']}: {row_error}")
+                except Exception as row_error:
+                    # Not this row's fault (e.g. the connection dropped): keep it
+                    self.stats["errors"] += 1
+                    failed.append(row)
+                    failure = row_error
+        except Exception as e:
+            self.stats["errors"] += 1
+            logger.warning(f"XP batch upsert failed: {e}")
+            if requeue:
+                self._requeue(rows)
+            raise
+        self.stats["flushes"] += 1
+        self.stats["rows_written"] += len(written)
+        written = [{**row, "new_total": totals[row["user_id"]]} if row["user_id"] in totals else row for row in written]
+        for listener in self.listeners:
+            try:
+                listener(written)
+            except Exception as e:
+                logger.warning(f"XP flush listener failed: {e}")
+        if failed:
+            logger.warning(f"XP update failed for {len(failed)} users, {'requeued' if requeue else 'not retried'}: {failure}")
+            if requeue:
+                self._requeue(failed)
+            raise failure
+
+    @property
+    def write_through(self) -> bool:
+        """ True when there is no background worker to flush for us. """
+        return self.window_seconds <= 0 or self._task is None
+
+    async def submit(self, user_id: str, username: str, xp_gained: int):
+        await self.submit_many([(user_id, username, xp_gained)])
+
+    async def submit_many(self, updates: list):
+        """
+        Queues (user_id, username, xp_gained) tuples, writing through if needed.
+        All or nothing: raises XPBacklogFull without queueing any if they don't fit.
+        """
+        new_users = {user_id for user_id, _, _ in updates if user_id not in self._pending}
+        if new_users and len(self._pending) + len(new_users) > self.max_pending_users:
+            self.stats["rejected"] += len(updates)
+            self._wake.set()
+            raise XPBacklogFull(f"{len(self._pending)} users are already waiting to be written")
+        for user_id, username, xp_gained in updates:
+            self.add(user_id, username, xp_gained)
+        if self.write_through:
+            # Let the caller see any failure rather than silently retrying later
+            await self.flush(requeue=False)
+
+    async def run(self):
+        failures = 0
+        while not self._stopping.is_set():
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.window_seconds)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            try:
+                await self.flush()
+                failures = 0
+            except Exception:
+                # Back off while the database is down instead of retrying every window
+                failures += 1
+                try:
+                    await asyncio.wait_for(self._stopping.wait(),
+                                           timeout=min(self.window_seconds * 2 ** failures, self.max_retry_delay))
+                except asyncio.TimeoutError:
+                    pass
+
+    def start(self):
+        if self._task is None and self.window_seconds > 0:
+            self._stopping.clear()
+            self._task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        if self._task is not None:
+            # Cancelling could interrupt a flush awaiting the writer and lose the rows it
+            # took off the queue; let the loop finish that flush and exit on its own
+            self._stopping.set()
+            self._wake.set()
+            await self._task
+            self._task = None
+        # Don't lose whatever is still queued
+        await self.flush()
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "pending_users": len(self._pending)}
+
+
+def build_xp_batcher() -> XPBatcher:
+    """ XP_BATCH_WINDOW_MS sets the coalescing window (0 = write-through); XP_MAX_PENDING_USERS caps the queue. """
+    return XPBatcher(
+        window_seconds=int(os.getenv("XP_BATCH_WINDOW_MS", "500")) / 1000,
+        max_pending_users=int(os.getenv("XP_MAX_PENDING_USERS", "5000")),
+    )
@@ -0,0 +1,136 @@
+# bench/db_bench.py
+"""
+Sync vs. async database path benchmark.
+
+Runs the same queries both ways, with concurrent callers on one event loop:
+  sync   the sync engine through FastAPI's threadpool (run_in_threadpool)
+  async  the async engine (asyncpg / aiosqlite)
+
+Operations: the leaderboard top-50 query, a full leaderboard load and a batched XP upsert.
+Uses DATABASE_URL when set (e.g. a Neon branch), otherwise a throwaway SQLite file.
+
+    cd backend
+    python -m bench.db_bench --users 5000 --requests 300 --concurrency 40
+    DATABASE_URL=postgresql://... DB_POOL_SIZE=10 python -m bench.db_bench
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+from .load_test import LoopLagMonitor, percentile
+
+
+def seed(users: int):
+    from app.database import create_db_and_tables
+    from app.xp import upsert_xp
+    create_db_and_tables()
+    rows = [{"user_id": f"db-bench-{i}", "username": f"db-bench-{i}", "total_xp": random.randint(0, 5000)} for i in range(users)]
+    upsert_xp(rows)
+
+
+def build_operations(users: int) -> dict:
+    """ name -> (sync callable run in the threadpool, async callable). """
+    from sqlalchemy import select
+    from starlette.concurrency import run_in_threadpool
+    from app.database import SessionLocal, AsyncSessionLocal, Leaderboard
+    from app.leaderboard import load_leaderboard_rows, load_leaderboard_rows_async
+    from app.xp import upsert_xp, upsert_xp_async
+
+    top = select(Leaderboard).order_by(Leaderboard.total_xp.desc()).limit(50)
+
+    def top_sync():
+        with SessionLocal() as db:
+            return db.scalars(top).all()
+
+    async def top_async():
+        async with AsyncSessionLocal() as db:
+            return (await db.scalars(top)).all()
+
+    def batch():
+        # Distinct users per batch, as the XP batcher guarantees
+        return [{"user_id": f"db-bench-{i}", "username": f"db-bench-{i}", "total_xp": random.randint(1, 20)}
+                for i in random.sample(range(users), min(users, 50))]
+
+    return {
+        "leaderboard_top": (lambda: run_in_threadpool(top_sync), top_async),
+        "leaderboard_load": (lambda: run_in_threadpool(load_leaderboard_rows), load_leaderboard_rows_async),
+        "xp_upsert_50": (lambda: run_in_threadpool(upsert_xp, batch()), lambda: upsert_xp_async(batch())),
+    }
+
+
+async def drive(operation, total: int, concurrency: int) -> dict:
+    latencies = []
+    errors = 0
+    remaining = total
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                await operation()
+            except Exception:
+                errors += 1
+            latencies.append((time.perf_counter() - start) * 1000)
+
+    monitor = LoopLagMonitor()
+    monitor.start()
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    lag = await monitor.stop()
+    latencies.sort()
+    return {
+        "ops_per_s": round(total / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "loop_lag_p99_ms": round(percentile(lag, 99), 2),
+        "errors": errors,
+    }
+
+
+async def run(args) -> dict:
+    from app.database import dispose_async_engine
+    operations = build_operations(args.users)
+    results = {}
+    try:
+        for name, (sync_op, async_op) in operations.items():
+            for mode, operation in (("sync", sync_op), ("async", async_op)):
+                # A few calls first so both paths start with a warm pool
+                for _ in range(3):
+                    await operation()
+                result = await drive(operation, args.requests, args.concurrency)
+                results[f"{name}/{mode}"] = result
+                print(f"{name:<18}{mode:<7}{result['ops_per_s']:>10}{result['p50_ms']:>10}{result['p99_ms']:>10}"
+                      f"{result['loop_lag_p99_ms']:>10}  {result['errors'] or '-'}")
+    finally:
+        await dispose_async_engine()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Sync (threadpool) vs. async database path benchmark.")
+    parser.add_argument("--users", type=int, default=5000, help="Leaderboard rows to seed")
+    parser.add_argument("--requests", type=int, default=300, help="Calls per operation and mode")
+    parser.add_argument("--concurrency", type=int, default=40)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ.setdefault("DATABASE_URL", f"sqlite:///{os.path.join(tmp, 'db_bench.db')}")
+        seed(args.users)
+        print(f"{'operation':<18}{'mode':<7}{'ops/s':>10}{'p50':>10}{'p99':>10}{'lag p99':>10}  errors")
+        results = asyncio.run(run(args))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# bench/fake_gemini.py
+import asyncio
+import json
+import random
+import time
+import typing
+from google.api_core import exceptions as google_exceptions
+from pydantic import BaseModel
+
+# --- LOCAL GEMINI STAND-IN ---
+# A drop-in replacement for `genai.GenerativeModel` that never touches the network.
+# It answers with schema-shaped JSON (taken from the response_schema the app sends
+# in JSON mode), after a configurable latency, and can inject quota errors and
+# malformed replies so the retry and repair paths get exercised too.
+
+
+def sample_value(annotation, name: str = "value"):
+    """ Builds a plausible value for a type annotation used in app/models.py. """
+    origin = typing.get_origin(annotation)
+    if origin in (list, typing.List):
+        (item_type,) = typing.get_args(annotation) or (str,)
+        return [sample_value(item_type, name) for _ in range(3)]
+    if origin is typing.Union:
+        non_null = [arg for arg in typing.get_args(annotation) if arg is not type(None)]
+        return sample_value(non_null[0], name) if non_null else None
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return sample_object(annotation)
+    if annotation is bool:
+        return random.random() < 0.5
+    if annotation is int:
+        return random.randint(0, 3)
+    if annotation is float:
+        return round(random.random(), 2)
+    return f"Sample {name.replace('_', ' ')} text for benchmarking."
+
+
+def sample_object(model_cls) -> dict:
+    return {name: sample_value(field.annotation, name) for name, field in model_cls.model_fields.items()}
+
+
+def batch_ids(prompt: str) -> list:
+    """ Pulls the reply ids out of a batch scoring prompt, so results can be matched back. """
+    marker = "Replies to analyze:\n"
+    if marker not in prompt:
+        return []
+    try:
+        return [item["id"] for item in json.loads(prompt.split(marker, 1)[1])]
+    except (ValueError, KeyError, TypeError):
+        return []
+
+
+class FakeResponse:
+    def __init__(self, text: str):
+        self.text = text
+
+
+class FakeStream:
+    """ Mimics the async-iterable response returned with stream=True. """
+    def __init__(self, text: str, chunk_chars: int, chunk_delay: float):
+        self._text = text
+        self._chunk_chars = chunk_chars
+        self._chunk_delay = chunk_delay
+
+    async def _chunks(self):
+        for start in range(0, len(self._text), self._chunk_chars):
+            await asyncio.sleep(self._chunk_delay)
+            yield FakeResponse(self._text[start:start + self._chunk_chars])
+
+    def __aiter__(self):
+        return self._chunks()
+
+
+class FakeGenerativeModel:
+    """
+    Stand-in for `genai.GenerativeModel`.
+    latency_ms/jitter_ms: simulated upstream time per call (uniformly jittered)
+    error_rate: share of calls that raise ResourceExhausted (a Gemini 429)
+    malformed_rate: share of replies that come back as broken JSON
+    """
+    def __init__(self, latency_ms: float = 800, jitter_ms: float = 200, error_rate: float = 0.0,
+                 malformed_rate: float = 0.0, stream_chunk_chars: int = 40, seed: int = None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.malformed_rate = malformed_rate
+        self.stream_chunk_chars = stream_chunk_chars
+        self.random = random.Random(seed)
+        self.calls = 0
+
+    def _delay(self) -> float:
+        return max(0.0, self.latency_ms + self.random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+    def _reply(self, prompt, generation_config) -> str:
+        text_prompt = prompt if isinstance(prompt, str) else " ".join(p for p in prompt if isinstance(p, str))
+        schema = (generation_config or {}).get("response_schema")
+        if schema is None:
+            body = {"text": "Sample reply."}
+        else:
+            body = sample_object(schema)
+            ids = batch_ids(text_prompt)
+            if ids and "results" in body:
+                entry_cls = typing.get_args(schema.model_fields["results"].annotation)[0]
+                body["results"] = [{**sample_object(entry_cls), "id": item_id} for item_id in ids]
+        text = json.dumps(body)
+        if self.random.random() < self.malformed_rate:
+            # Typical defects: a fence plus a truncated tail
+            text = "```json\n" + text[:-2]
+        return text
+
+    def _maybe_fail(self):
+        if self.random.random() < self.error_rate:
+            raise google_exceptions.ResourceExhausted("Simulated quota exhaustion")
+
+    async def generate_content_async(self, prompt, stream: bool = False, generation_config=None, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self._delay())
+        self._maybe_fail()
+        text = self._reply(prompt, generation_config)
+        if stream:
+            chunk_count = max(1, len(text) // self.stream_chunk_chars)
+            return FakeStream(text, self.stream_chunk_chars, self._delay() / chunk_count)
+        return FakeResponse(text)
+
+    def generate_content(self, prompt, generation_config=None, **kwargs):
+        self.calls += 1
+        time.sleep(self._delay())
+        self._maybe_fail()
+        return FakeResponse(self._reply(prompt, generation_config))
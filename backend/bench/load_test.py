@@ -0,0 +1,223 @@
+# bench/load_test.py
+"""
+Offline load test for the Sathi Ally API.
+
+Runs the FastAPI app in-process with a local Gemini stand-in (bench/fake_gemini.py)
+and a throwaway SQLite database, drives every router endpoint with concurrent
+requests and reports p50/p95/p99 latency, throughput and event-loop lag per endpoint.
+
+    cd backend
+    pip install -r requirements.txt -r bench/requirements.txt
+    python -m bench.load_test --concurrency 20 --requests 200 --latency-ms 800
+    python -m bench.load_test --endpoints score,leaderboard --json results.json
+"""
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import tempfile
+import time
+import uuid
+
+TOPICS = ["misinformation", "confirmation bias", "deepfakes", "clickbait", "echo chambers",
+          "source checking", "satire vs. fake news", "filter bubbles", "propaganda", "data privacy"]
+TERMS = ["jpeg artifacts", "inconsistent lighting", "cloned texture", "warped background", "asymmetrical ears"]
+REPLIES = ["please be respectful", "that's not okay", "Can you share a source for that?",
+           "Everyone deserves to feel safe here.", "I disagree, and here's why..."]
+
+
+def configure_environment(db_path: str, warm_pools: bool):
+    """ Must run before `app` is imported: api.py and database.py read these at import time. """
+    os.environ["GOOGLE_API_KEY"] = os.environ.get("GOOGLE_API_KEY") or "offline-benchmark"
+    os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+    os.environ["WARM_POOLS"] = "1" if warm_pools else "0"
+    # INFO access logs would interleave with the report
+    os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+
+def sample_image() -> bytes:
+    from PIL import Image
+    img = Image.effect_noise((1600, 1200), 64).convert("RGB")
+    out = io.BytesIO()
+    img.save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+def user_id() -> str:
+    return f"bench-user-{random.randint(1, 100)}"
+
+
+def build_endpoints(image_bytes: bytes) -> dict:
+    """ name -> callable(client) returning the request coroutine. """
+    def score_item(i):
+        return {"id": str(i), "scenario_id": str(uuid.uuid4()), "user_reply": random.choice(REPLIES), "locale": "en"}
+
+    return {
+        "ping": lambda c: c.get("/api/v1/ping"),
+        "score": lambda c: c.post("/api/v1/score", json={"scenario_id": str(uuid.uuid4()), "user_reply": random.choice(REPLIES), "locale": "en"}),
+        "score_stream": lambda c: c.post("/api/v1/score/stream", json={"scenario_id": str(uuid.uuid4()), "user_reply": random.choice(REPLIES), "locale": "en"}),
+        "score_batch": lambda c: c.post("/api/v1/score_batch", json={"items": [score_item(i) for i in range(20)]}),
+        "generate_scenario": lambda c: c.post("/api/v1/generate_scenario", json={"gentle_mode": random.random() < 0.3}),
+        "generate_lesson": lambda c: c.post("/api/v1/generate_lesson", json={"topic": random.choice(TOPICS)}),
+        "generate_lesson_stream": lambda c: c.post("/api/v1/generate_lesson/stream", json={"topic": random.choice(TOPICS)}),
+        "generate_quiz": lambda c: c.post("/api/v1/generate_quiz", json={"topic": random.choice(TOPICS)}),
+        "generate_game_item": lambda c: c.get("/api/v1/generate_game_item"),
+        "get_mini_lesson": lambda c: c.post("/api/v1/get_mini_lesson", json={"term": random.choice(TERMS)}),
+        "analyze_image": lambda c: c.post("/api/v1/analyze_image", files={"file": ("bench.jpg", image_bytes, "image/jpeg")}),
+        "telemetry": lambda c: c.post("/api/v1/telemetry", json={
+            "scenario_id": f"scenario-{random.randint(1, 50)}", "rubric_score_gain": random.randint(-2, 6),
+            "session_duration_seconds": random.randint(20, 400), "was_skipped": random.random() < 0.1,
+            "was_flagged_distressing": random.random() < 0.05, "gentle_mode_active": random.random() < 0.3}),
+        "update_score": lambda c: c.post("/api/v1/update_score", json={"user_id": (u := user_id()), "username": u, "xp_gained": random.randint(1, 20)}),
+        "update_scores": lambda c: c.post("/api/v1/update_scores", json={"updates": [
+            {"user_id": (u := user_id()), "username": u, "xp_gained": random.randint(1, 20)} for _ in range(10)]}),
+        "leaderboard": lambda c: c.get("/api/v1/leaderboard"),
+        "leaderboard_rank": lambda c: c.get(f"/api/v1/leaderboard/rank/{user_id()}"),
+    }
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """ Nearest-rank percentile of an already sorted list. """
+    if not sorted_values:
+        return 0.0
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[rank]
+
+
+class LoopLagMonitor:
+    """
+    Sleeps for a fixed interval in a loop and records how late it wakes up.
+    Anything blocking the event loop shows up directly as lag.
+    """
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - start - self.interval) * 1000)
+
+    def start(self):
+        self.samples = []
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> list:
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        return sorted(self.samples)
+
+
+async def drive(client, request_factory, total: int, concurrency: int) -> dict:
+    latencies = []
+    errors = {}
+    remaining = total
+
+    async def worker():
+        nonlocal remaining
+        while remaining > 0:
+            remaining -= 1
+            start = time.perf_counter()
+            try:
+                response = await request_factory(client)
+                status = response.status_code
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - start) * 1000)
+            if not isinstance(status, int) or status >= 400:
+                errors[str(status)] = errors.get(str(status), 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": total,
+        "errors": errors,
+        "rps": round(total / elapsed, 1) if elapsed else 0.0,
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "max_ms": round(latencies[-1], 1) if latencies else 0.0,
+    }
+
+
+async def run(args) -> dict:
+    import httpx
+    from app.main import app
+    from app import api
+    from .fake_gemini import FakeGenerativeModel
+
+    fake = FakeGenerativeModel(latency_ms=args.latency_ms, jitter_ms=args.jitter_ms,
+                               error_rate=args.error_rate, malformed_rate=args.malformed_rate, seed=args.seed)
+    api.llm.model = fake
+
+    endpoints = build_endpoints(sample_image())
+    selected = args.endpoints.split(",") if args.endpoints else list(endpoints)
+    unknown = [name for name in selected if name not in endpoints]
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(unknown)}. Choose from: {', '.join(endpoints)}")
+
+    results = {}
+    monitor = LoopLagMonitor()
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+            for name in selected:
+                calls_before = fake.calls
+                monitor.start()
+                result = await drive(client, endpoints[name], args.requests, args.concurrency)
+                lag = await monitor.stop()
+                result["loop_lag_p99_ms"] = round(percentile(lag, 99), 2)
+                result["loop_lag_max_ms"] = round(lag[-1], 2) if lag else 0.0
+                result["model_calls"] = fake.calls - calls_before
+                results[name] = result
+                print_row(name, result)
+                # Let background writers (XP batches, telemetry) flush before the next endpoint
+                await asyncio.sleep(args.settle_ms / 1000)
+    return results
+
+
+HEADER = f"{'endpoint':<24}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}{'lag p99':>9}{'lag max':>9}{'llm':>6}  errors"
+
+
+def print_row(name: str, r: dict):
+    errors = ", ".join(f"{code}x{count}" for code, count in r["errors"].items()) or "-"
+    print(f"{name:<24}{r['rps']:>8}{r['p50_ms']:>9}{r['p95_ms']:>9}{r['p99_ms']:>9}"
+          f"{r['loop_lag_p99_ms']:>9}{r['loop_lag_max_ms']:>9}{r['model_calls']:>6}  {errors}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline load test with a local Gemini stand-in.")
+    parser.add_argument("--endpoints", help="Comma-separated endpoint names (default: all)")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent clients per endpoint")
+    parser.add_argument("--latency-ms", type=float, default=800, help="Simulated Gemini latency")
+    parser.add_argument("--jitter-ms", type=float, default=200, help="Uniform jitter around the latency")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of Gemini calls failing with a 429")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Share of Gemini replies with broken JSON")
+    parser.add_argument("--warm-pools", action="store_true", help="Keep the scenario/game-item warm pools running")
+    parser.add_argument("--settle-ms", type=float, default=1000, help="Pause between endpoints so background writers flush")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        configure_environment(os.path.join(tmp, "bench.db"), args.warm_pools)
+        print(HEADER)
+        results = asyncio.run(run(args))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"settings": vars(args), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
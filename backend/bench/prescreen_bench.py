@@ -0,0 +1,104 @@
+# bench/prescreen_bench.py
+"""
+Per-reply cost of the local pre-screen (app/prescreen.py).
+
+Screens a mix of en and ne replies (the labelled seed replies, empty and spam
+submissions, and long replies built from them) and reports microseconds per reply:
+  normalize   normalize_reply alone
+  keywords    the combined flag regex over the normalized text
+  classifier  n-gram hashing and the logistic model
+  screen      the whole screen, as /score runs it
+
+    cd backend
+    python -m bench.prescreen_bench --rounds 20
+    python -m bench.prescreen_bench --json
+"""
+import argparse
+import json
+import random
+import time
+
+from .load_test import percentile
+
+
+def build_corpus(seed_path: str) -> list:
+    """ [(reply, locale)]: seed replies, trivial submissions and 3-5 sentence replies. """
+    from app.prescreen import read_seed
+    seed = [(text, locale) for text, locale, _ in read_seed(seed_path)]
+    rng = random.Random(0)
+    trivial = [("", "en"), ("   ", "ne"), ("😂😂😂", "en"), ("aaaaaaaaaaaaaa!!!", "en"),
+               ("http://a.example http://b.example", "en"), ("ok ok ok ok ok", "ne")]
+    long = []
+    for locale in ("en", "ne"):
+        texts = [text for text, l in seed if l == locale]
+        for _ in range(len(texts) // 2):
+            long.append((" ".join(rng.sample(texts, rng.randint(3, 5))), locale))
+    return seed + trivial + long
+
+
+def time_each(fn, corpus: list, rounds: int) -> list:
+    """ Microseconds per call of fn(reply, locale), every reply `rounds` times. """
+    samples = []
+    clock = time.perf_counter_ns
+    for _ in range(rounds):
+        for reply, locale in corpus:
+            started = clock()
+            fn(reply, locale)
+            samples.append((clock() - started) / 1000)
+    return samples
+
+
+def summarize(samples: list) -> dict:
+    samples = sorted(samples)
+    return {
+        "mean_us": round(sum(samples) / len(samples), 2),
+        "p50_us": round(percentile(samples, 50), 2),
+        "p99_us": round(percentile(samples, 99), 2),
+        "max_us": round(max(samples), 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the per-reply cost of the local pre-screen.")
+    parser.add_argument("--seed", default="prescreen/seed.jsonl")
+    parser.add_argument("--model", default="prescreen/model.json")
+    parser.add_argument("--rounds", type=int, default=20, help="Times each reply is screened")
+    parser.add_argument("--json", action="store_true", help="Print the results as one JSON object")
+    args = parser.parse_args()
+
+    from app.prescreen import Prescreener, _FLAG_PATTERN, _language
+    from app.similarity import normalize_reply
+    screener = Prescreener(args.model)
+    if not screener.load():
+        raise SystemExit(f"No pre-screen model at {args.model}; run `python -m app.prescreen train` first")
+    corpus = build_corpus(args.seed)
+    normalized = {(reply, locale): normalize_reply(reply, _language(locale)) for reply, locale in corpus}
+
+    stages = {
+        "normalize": lambda reply, locale: normalize_reply(reply, _language(locale)),
+        "keywords": lambda reply, locale: [m.lastgroup for m in _FLAG_PATTERN.finditer(normalized[(reply, locale)])],
+        "classifier": lambda reply, locale: screener.model.probability(normalized[(reply, locale)]),
+        "screen": screener.screen,
+    }
+    # One untimed pass so first-call costs (regex caches, imports) aren't counted
+    time_each(screener.screen, corpus, 1)
+    results = {"replies": len(corpus), "rounds": args.rounds, "stages": {}}
+    for name, fn in stages.items():
+        results["stages"][name] = summarize(time_each(fn, corpus, args.rounds))
+    for locale in ("en", "ne"):
+        subset = [(reply, l) for reply, l in corpus if l == locale]
+        results["stages"][f"screen_{locale}"] = summarize(time_each(screener.screen, subset, args.rounds))
+    results["skipped_model_share"] = round(screener.stats["skipped_model"] / screener.stats["screened"], 4)
+
+    if args.json:
+        print(json.dumps(results))
+        return
+    print(f"{results['replies']} replies x {args.rounds} rounds")
+    print(f"{'stage':<12} {'mean':>9} {'p50':>9} {'p99':>9} {'max':>9}   (microseconds per reply)")
+    for name, row in results["stages"].items():
+        print(f"{name:<12} {row['mean_us']:>9.1f} {row['p50_us']:>9.1f} {row['p99_us']:>9.1f} {row['max_us']:>9.1f}")
+    print(f"scored without the model: {results['skipped_model_share']:.1%} of screened replies")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+# bench/startup.py
+"""
+Cold-start benchmark for the Sathi Ally API.
+
+Each run starts a fresh interpreter (so nothing is cached in sys.modules) and measures:
+  import      time to `import app.main`
+  startup     time for the lifespan startup hooks to return
+  first ping  latency of the first /api/v1/ping (the Render wake-up hook)
+  ready       time from startup until /api/v1/ready returns 200
+  first model latency of the first model-backed request (builds the Gemini client;
+              the call itself goes to the local stand-in from bench/fake_gemini.py)
+
+    cd backend
+    python -m bench.startup --runs 5
+    FAST_BOOT=0 python -m bench.startup --runs 5    # the blocking startup, for comparison
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from .load_test import percentile
+
+HEAVY_MODULES = ("google.generativeai", "PIL", "sqlalchemy")
+
+# Runs inside the child interpreter; prints one JSON line
+CHILD = r"""
+import asyncio, json, sys, time
+t0 = time.perf_counter()
+from app.main import app
+from app import api
+t_import = time.perf_counter() - t0
+loaded_at_import = [m for m in HEAVY_MODULES if m in sys.modules]
+
+async def main():
+    import httpx
+    from bench.fake_gemini import FakeGenerativeModel
+    # The real factory still runs (and imports the SDK); only the network call is faked
+    real_factory = api.llm.model_factory
+    api.llm.model_factory = lambda: (real_factory(), FakeGenerativeModel(latency_ms=0, jitter_ms=0))[1]
+    result = {"import_ms": t_import * 1000, "heavy_modules_at_import": loaded_at_import}
+    t1 = time.perf_counter()
+    async with app.router.lifespan_context(app):
+        result["startup_ms"] = (time.perf_counter() - t1) * 1000
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            t2 = time.perf_counter()
+            await client.get("/api/v1/ping")
+            result["first_ping_ms"] = (time.perf_counter() - t2) * 1000
+            while (await client.get("/api/v1/ready")).status_code != 200:
+                await asyncio.sleep(0.005)
+            result["ready_ms"] = (time.perf_counter() - t1) * 1000
+            t3 = time.perf_counter()
+            await client.post("/api/v1/get_mini_lesson", json={"term": "deepfake"})
+            result["first_model_ms"] = (time.perf_counter() - t3) * 1000
+    print(json.dumps(result))
+
+asyncio.run(main())
+"""
+
+
+def run_once(db_dir: str, run: int) -> dict:
+    env = dict(os.environ)
+    env.setdefault("GOOGLE_API_KEY", "offline-benchmark")
+    env["DATABASE_URL"] = f"sqlite:///{os.path.join(db_dir, f'startup-{run}.db')}"
+    env["WARM_POOLS"] = "0"
+    env.setdefault("LOG_LEVEL", "WARNING")
+    backend_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    code = f"HEAVY_MODULES = {HEAVY_MODULES!r}\n" + CHILD
+    output = subprocess.run([sys.executable, "-c", code], cwd=backend_dir, env=env,
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cold-start benchmark (fresh interpreter per run).")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--json", help="Also write the results to this file")
+    args = parser.parse_args()
+
+    runs = []
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(args.runs):
+            runs.append(run_once(tmp, i))
+
+    print(f"FAST_BOOT={os.getenv('FAST_BOOT', '1')}  runs={args.runs}")
+    print(f"{'metric':<16}{'p50 ms':>10}{'max ms':>10}")
+    summary = {}
+    for metric in ("import_ms", "startup_ms", "first_ping_ms", "ready_ms", "first_model_ms"):
+        values = sorted(r[metric] for r in runs)
+        summary[metric] = {"p50": round(percentile(values, 50), 1), "max": round(values[-1], 1)}
+        print(f"{metric:<16}{summary[metric]['p50']:>10}{summary[metric]['max']:>10}")
+    print(f"heavy modules loaded at import: {', '.join(runs[0]['heavy_modules_at_import']) or 'none'}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"runs": runs, "summary": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
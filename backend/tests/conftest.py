@@ -0,0 +1,39 @@
+# tests/conftest.py
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Run from backend/: `python -m pytest`. The app reads these at import time; the
+# model is always replaced by bench/fake_gemini.py, so the key is never used.
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+os.environ.setdefault("GOOGLE_API_KEY", "test-key")
+os.environ.setdefault("WARM_POOLS", "0")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(prefix="sathi-tests-"), "app.db"))
+os.environ.setdefault("PRESCREEN_MODEL_PATH", os.path.join(BACKEND, "prescreen", "model.json"))
+
+
+@pytest.fixture(scope="session")
+def fake_model():
+    """ Swaps the app's Gemini model for bench/fake_gemini.py, answering instantly. """
+    import app.api as api
+    from bench.fake_gemini import FakeGenerativeModel
+    model = FakeGenerativeModel(latency_ms=0, jitter_ms=0, seed=0)
+    previous, api.llm.model = api.llm.model, model
+    yield model
+    api.llm.model = previous
+
+
+@pytest.fixture(scope="session")
+def client(fake_model):
+    """
+    A TestClient on the full app (middleware, startup and shutdown included). One per
+    session, like one worker process: the app's background tasks are bound to its loop.
+    """
+    from fastapi.testclient import TestClient
+    from app.main import app
+    with TestClient(app) as test_client:
+        yield test_client
@@ -0,0 +1,113 @@
+# tests/test_admission.py
+import asyncio
+
+import pytest
+
+from app.admission import AdmissionController, AdmissionRejected, client_address, client_key_var
+
+
+async def call(controller, endpoint, client, order, hold=0.0):
+    """ One model call from `client`: waits for a slot, records it, holds it for `hold` seconds. """
+    client_key_var.set(client)
+    async with controller.slot(endpoint):
+        order.append((endpoint, client))
+        await asyncio.sleep(hold)
+
+
+def start(controller, endpoint, client, order, hold=0.0):
+    return asyncio.create_task(call(controller, endpoint, client, order, hold))
+
+
+def test_free_slots_go_to_the_most_urgent_class_first():
+    async def scenario():
+        controller = AdmissionController(capacity=1, shares=(1.0, 1.0, 1.0))
+        order = []
+        blocker = start(controller, "score", "ip:blocker", order, hold=0.05)
+        await asyncio.sleep(0)
+        waiters = [
+            start(controller, "generate_game_item", "ip:a", order),
+            start(controller, "generate_lesson", "ip:b", order),
+            start(controller, "score", "ip:c", order),
+        ]
+        await asyncio.gather(blocker, *waiters)
+        return order
+
+    assert asyncio.run(scenario()) == [
+        ("score", "ip:blocker"), ("score", "ip:c"), ("generate_lesson", "ip:b"), ("generate_game_item", "ip:a"),
+    ]
+
+
+def test_clients_are_served_round_robin_within_a_class():
+    async def scenario():
+        controller = AdmissionController(capacity=1, shares=(1.0, 1.0, 1.0))
+        order = []
+        blocker = start(controller, "score", "ip:blocker", order, hold=0.05)
+        await asyncio.sleep(0)
+        waiters = [start(controller, "score", client, order) for client in ("ip:a", "ip:a", "ip:a", "ip:b")]
+        await asyncio.gather(blocker, *waiters)
+        return [client for _, client in order[1:]]
+
+    assert asyncio.run(scenario()) == ["ip:a", "ip:b", "ip:a", "ip:a"]
+
+
+def test_lower_classes_keep_slots_free_for_interactive_calls():
+    async def scenario():
+        controller = AdmissionController(capacity=4, max_per_client=10)
+        order = []
+        background = [start(controller, "generate_game_item", f"ip:{i}", order, hold=0.05) for i in range(4)]
+        await asyncio.sleep(0.01)
+        in_use = controller.snapshot()["classes"]["background"]["in_use"]
+        await start(controller, "score", "ip:player", order)
+        await asyncio.gather(*background)
+        return in_use, order
+
+    in_use, order = asyncio.run(scenario())
+    assert in_use == 2
+    assert order.index(("score", "ip:player")) == 2
+
+
+@pytest.mark.parametrize("options, reason", [
+    ({"max_queue": (200, 100, 1)}, "queue_full"),
+    ({"deadlines": (8.0, 15.0, 3.0)}, "deadline"),   # 2s per call: the second waiter would wait 4s
+])
+def test_background_calls_are_shed_before_they_queue(options, reason):
+    async def scenario():
+        controller = AdmissionController(capacity=1, shares=(1.0, 1.0, 1.0), **options)
+        order = []
+        blocker = start(controller, "score", "ip:blocker", order, hold=0.05)
+        await asyncio.sleep(0)
+        first = start(controller, "generate_game_item", "ip:a", order)
+        await asyncio.sleep(0)
+        try:
+            await call(controller, "generate_game_item", "ip:b", order)
+        except AdmissionRejected as e:
+            await asyncio.gather(blocker, first)
+            return e
+
+    rejected = asyncio.run(scenario())
+    assert rejected.reason == reason
+    assert rejected.retry_after >= 1
+
+
+def test_calls_still_waiting_at_the_deadline_time_out():
+    async def scenario():
+        controller = AdmissionController(capacity=1, deadlines=(0.05, 15.0, 30.0))
+        controller._service_seconds = 0.01   # Calls look short, so the estimate lets it queue
+        order = []
+        blocker = start(controller, "score", "ip:blocker", order, hold=0.2)
+        await asyncio.sleep(0)
+        with pytest.raises(AdmissionRejected) as rejected:
+            await call(controller, "score", "ip:late", order)
+        await blocker
+        return rejected.value.reason, controller.snapshot()
+
+    reason, snapshot = asyncio.run(scenario())
+    assert reason == "timeout"
+    assert snapshot["classes"]["interactive"]["timed_out"] == 1
+    assert snapshot["in_use"] == 0 and snapshot["classes"]["interactive"]["waiting"] == 0
+
+
+def test_client_address_ignores_hops_the_client_wrote():
+    assert client_address("6.6.6.6, 203.0.113.7", "10.0.0.1", 1) == "203.0.113.7"
+    assert client_address("6.6.6.6, 203.0.113.7, 10.0.0.2", "10.0.0.1", 2) == "203.0.113.7"
+    assert client_address("6.6.6.6", "10.0.0.1", 0) == "10.0.0.1"
@@ -0,0 +1,44 @@
+# tests/test_imaging.py
+import io
+
+from PIL import Image
+
+import app.api as api
+
+
+def image_bytes(fmt: str, color=(10, 200, 30)) -> bytes:
+    out = io.BytesIO()
+    Image.new("RGB", (300, 200), color).save(out, fmt)
+    return out.getvalue()
+
+
+def test_repeat_uploads_skip_decoding_and_edited_copies_are_analyzed_afresh(client, fake_model, monkeypatch):
+    prepared = []
+    prepare = api.prepare_image_async
+
+    async def counting_prepare(data):
+        prepared.append(len(data))
+        return await prepare(data)
+
+    monkeypatch.setattr(api, "prepare_image_async", counting_prepare)
+    png = image_bytes("PNG", (1, 2, 3))
+    calls = fake_model.calls
+    near_duplicates = api.image_stats_counters["near_duplicates"]
+    for _ in range(2):
+        response = client.post("/api/v1/analyze_image", files={"file": ("a.png", png, "image/png")})
+        assert response.status_code == 200
+    assert len(prepared) == 1 and fake_model.calls == calls + 1
+    assert "prepare" not in response.headers["server-timing"]
+
+    # Same picture, different bytes: same perceptual hash, but never served from the cache
+    jpeg = image_bytes("JPEG", (1, 2, 3))
+    assert client.post("/api/v1/analyze_image", files={"file": ("a.jpg", jpeg, "image/jpeg")}).status_code == 200
+    assert len(prepared) == 2 and fake_model.calls == calls + 2
+    assert api.image_stats_counters["near_duplicates"] == near_duplicates + 1
+
+
+def test_decompression_bombs_are_rejected(client):
+    out = io.BytesIO()
+    Image.new("1", (20000, 20000)).save(out, "PNG")
+    response = client.post("/api/v1/analyze_image", files={"file": ("bomb.png", out.getvalue(), "image/png")})
+    assert response.status_code == 400
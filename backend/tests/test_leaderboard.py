@@ -0,0 +1,99 @@
+# tests/test_leaderboard.py
+import asyncio
+
+from app.leaderboard import LeaderboardEngine
+from app.shared_state import SQLiteStore
+
+
+class FakeTable:
+    """ The users table: `flush` adds XP the way the upsert does and returns the rows' new totals. """
+    def __init__(self):
+        self.totals = {"a": 10, "b": 5}
+
+    def flush(self, user_id: str, xp: int) -> list:
+        self.totals[user_id] = self.totals.get(user_id, 0) + xp
+        return [{"user_id": user_id, "username": user_id.upper(), "total_xp": xp, "new_total": self.totals[user_id]}]
+
+    def rows(self) -> list:
+        return [(user_id, user_id.upper(), xp) for user_id, xp in self.totals.items()]
+
+
+class TableEngine(LeaderboardEngine):
+    """ Reads a FakeTable instead of the database; `during_read` runs while the SELECT is in flight. """
+    def __init__(self, table, **kwargs):
+        super().__init__(**kwargs)
+        self.table = table
+        self.during_read = None
+
+    async def load_rows(self) -> list:
+        rows = self.table.rows()
+        if self.during_read is not None:
+            await self.during_read()
+        return rows
+
+
+def engines(tmp_path, table, log_entries=16):
+    path = str(tmp_path / "shared.db")
+    return [TableEngine(table, store=SQLiteStore(path), log_entries=log_entries) for _ in range(2)]
+
+
+def totals(engine) -> dict:
+    return {row["user_id"]: row["total_xp"] for row in engine.top()}
+
+
+def test_other_workers_apply_logged_totals_without_reloading(tmp_path):
+    async def scenario():
+        table = FakeTable()
+        first, second = engines(tmp_path, table)
+        await first.reload()
+        await second.reload()
+        first.apply_increments(table.flush("b", 10))
+        second.apply_increments(table.flush("c", 1))
+        for engine in (first, second, first):
+            assert await engine._sync()
+        return first, second
+
+    first, second = asyncio.run(scenario())
+    assert first.top() == second.top()
+    assert [row["user_id"] for row in second.top()] == ["b", "a", "c"]
+    assert first.etag() == second.etag()
+    assert first.stats["reloads"] == second.stats["reloads"] == 1
+
+
+def test_peer_flush_during_a_reload_is_counted_once(tmp_path):
+    async def scenario():
+        table = FakeTable()
+        peer, reloading = engines(tmp_path, table)
+        await peer.reload()
+        # Committed before the SELECT, published only after the reload read the log position
+        peer.apply_increments(table.flush("a", 7))
+
+        async def peer_writes_mid_read():
+            # Committed after the SELECT, published before the reload finishes
+            peer.apply_increments(table.flush("b", 3))
+            await peer._sync()
+            reloading.apply_increments(table.flush("c", 2))   # the reloading worker's own flush
+
+        reloading.during_read = peer_writes_mid_read
+        await reloading.reload()
+        for engine in (peer, reloading, peer):
+            assert await engine._sync()
+        return table, peer, reloading
+
+    table, peer, reloading = asyncio.run(scenario())
+    assert totals(reloading) == table.totals == {"a": 17, "b": 8, "c": 2}
+    assert totals(peer) == table.totals
+
+
+def test_trimmed_log_asks_for_a_reload(tmp_path):
+    async def scenario():
+        table = FakeTable()
+        first, second = engines(tmp_path, table, log_entries=2)
+        await first.reload()
+        await second.reload()
+        for _ in range(3):
+            first.apply_increments(table.flush("c", 1))
+            await first._sync()
+        return await second._sync()
+
+    assert asyncio.run(scenario()) is False
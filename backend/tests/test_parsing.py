@@ -0,0 +1,42 @@
+# tests/test_parsing.py
+import json
+
+import pytest
+
+from app.parsing import loads_tolerant, repair_json
+
+
+def test_clean_json_is_not_repaired():
+    value, repaired = loads_tolerant('```json\n{"a": 1}\n```')
+    assert value == {"a": 1}
+    assert repaired is False
+
+
+@pytest.mark.parametrize("text, expected", [
+    ('Here you go: {"a": [1, 2,], "b": True,} Hope it helps!', {"a": [1, 2], "b": True}),
+    ('{"a": None, "b": False}', {"a": None, "b": False}),
+    ('{“title”: “Spotting fakes”}', {"title": "Spotting fakes"}),
+    ('{"content": ["one", "two"', {"content": ["one", "two"]}),
+    ('{"text": "cut off mid-sent', {"text": "cut off mid-sent"}),
+])
+def test_repairs_structure(text, expected):
+    assert json.loads(repair_json(text)) == expected
+
+
+@pytest.mark.parametrize("content", [
+    "None of these options is True, and False claims spread fast.",
+    "She said “stop” and walked away.",
+    "Lists like [a, b,] and objects like {x,} are fine in prose.",
+    'A quote: \\"escaped\\", then a comma, }',
+])
+def test_string_contents_survive_repair(content):
+    # Broken only by the trailing comma, so repair has to run; the string must come back intact
+    text = '{"rationale": "' + content + '", "scores": [1, 2,],}'
+    value = json.loads(repair_json(text))
+    assert value["rationale"] == json.loads('"' + content + '"')
+    assert value["scores"] == [1, 2]
+
+
+def test_bare_quote_inside_curly_quoted_string_is_escaped():
+    value = json.loads(repair_json('{“rewrite”: “say "please" first”}'))
+    assert value == {"rewrite": 'say "please" first'}
@@ -0,0 +1,57 @@
+# tests/test_pools.py
+import asyncio
+
+from app.pools import WarmPool
+
+
+def test_unconfigured_topics_are_served_live():
+    pool = WarmPool("test", None)
+    pool.add_bucket(None, False)
+    assert pool.pop("some client topic") is None
+    assert list(pool.snapshot()["buckets"]) == ["*|normal"]
+
+
+def test_failing_bucket_backs_off_exponentially():
+    calls = []
+
+    async def generate(topic, gentle_mode):
+        calls.append(topic)
+        raise RuntimeError("model down")
+
+    async def scenario():
+        pool = WarmPool("test", generate, retry_delay=0.05, max_retry_delay=10)
+        pool.add_bucket()
+        pool.start()
+        await asyncio.sleep(0.4)
+        await pool.stop()
+        return pool
+
+    pool = asyncio.run(scenario())
+    # Attempts at 0, 0.05, 0.15 and 0.35s rather than one every 0.05s
+    assert 3 <= len(calls) <= 5
+    assert pool._failures[(None, False)] == len(calls)
+
+
+def test_idle_buckets_are_evicted_and_come_back_on_request():
+    async def generate(topic, gentle_mode):
+        return topic
+
+    async def scenario():
+        pool = WarmPool("test", generate, capacity=2, low_water=1, idle_seconds=0.1)
+        pool.add_bucket("news")
+        pool.start()
+        await asyncio.sleep(0.05)
+        filled = pool.snapshot()["buckets"]
+        await asyncio.sleep(0.2)
+        evicted = pool.snapshot()["buckets"]
+        missed = pool.pop("news")
+        await asyncio.sleep(0.02)
+        served = pool.pop("news")
+        await pool.stop()
+        return filled, evicted, missed, served, pool.stats["evicted"]
+
+    filled, evicted, missed, served, count = asyncio.run(scenario())
+    assert filled == {"news|normal": 2}
+    assert evicted == {}
+    assert missed is None and served == "news"
+    assert count == 1
@@ -0,0 +1,65 @@
+# tests/test_prescreen.py
+import os
+
+import pytest
+
+from app.prescreen import Prescreener
+
+
+@pytest.fixture(scope="module")
+def screener():
+    screener = Prescreener(os.environ["PRESCREEN_MODEL_PATH"])
+    assert screener.load()
+    return screener
+
+
+@pytest.mark.parametrize("reply, locale, reason, flags", [
+    ("", "en", "empty_reply", ["empty_reply"]),
+    ("   ", "ne", "empty_reply", ["empty_reply"]),
+    ("😂😂😂 !!", "en", "empty_reply", ["empty_reply"]),
+    ("http://a.example http://b.example", "en", "spam", ["spam"]),
+    ("aaaaaaaaaaaaaa!!!", "en", "spam", ["spam"]),
+    ("ok ok ok ok ok", "ne", "spam", ["spam"]),
+    ("No! no, NO no no.", "en", "spam", ["spam"]),
+    ("I will kill you", "en", "abusive", ["threat"]),
+    ("you idiot", "en", "abusive", ["insult"]),
+    ("sala bewakoof", "ne", "abusive", ["insult"]),
+    ("go back to your country, you are not welcome", "en", "abusive", ["hate_speech"]),
+])
+def test_replies_scored_without_the_model(screener, reply, locale, reason, flags):
+    result = screener.screen(reply, locale)
+    assert result.reason == reason
+    assert result.flags == flags
+    assert result.skip_model
+
+
+@pytest.mark.parametrize("reply, locale, flags", [
+    ("Please be kind, everyone deserves respect.", "en", []),
+    ("please please please stop", "en", []),
+    ("mero sala bholi aaunuhunchha", "ne", []),
+    # Short everyday replies: the score alone never flags
+    ("seriously", "en", []),
+    ("dude seriously", "en", []),
+    ("ok", "en", []),
+    ("hi", "en", []),
+    ("lol", "en", []),
+    ("हो", "ne", []),
+    ("ठीक छ", "ne", []),
+    # Counter-speech quoting the comment
+    ("Go back to your country is a horrible thing to say", "en", []),
+    ("कसैलाई पनि आफ्नो देश फर्क भन्नु गलत हो।", "ne", []),
+    ("email me at a@b.com", "en", ["personal_info"]),
+    ("call 9841234567", "ne", ["personal_info"]),
+    # Never short-circuited: the model's answer matters most here
+    ("I want to kill myself", "en", ["self_harm"]),
+])
+def test_replies_still_sent_to_the_model(screener, reply, locale, flags):
+    result = screener.screen(reply, locale)
+    assert result.reason is None
+    assert result.flags == flags
+
+
+def test_local_score_has_every_criterion_at_zero(screener):
+    score = screener.local_score(screener.screen("", "ne"), "ne")
+    assert score["safety_flags"] == ["empty_reply"]
+    assert score["scores"] and all(entry["score"] == 0 for entry in score["scores"])
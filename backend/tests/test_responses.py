@@ -0,0 +1,80 @@
+# tests/test_responses.py
+import gzip
+import json
+import time
+from types import SimpleNamespace
+
+import app.api as api
+from app.responses import ResponseOptimizationMiddleware, etag_matches
+
+POLICIES = {"/api/v1/leaderboard": "no-cache"}
+BODY = json.dumps([{"user_id": f"u{i}", "username": f"name-{i}", "total_xp": i} for i in range(50)]).encode()
+
+
+def optimize(path="/api/v1/leaderboard", method="GET", if_none_match="", accept_encoding="gzip", body=BODY):
+    middleware = ResponseOptimizationMiddleware(None, policies=POLICIES)
+    scope = {"method": method, "route": SimpleNamespace(path=path)}
+    start = {"type": "http.response.start", "status": 200, "headers": [(b"content-type", b"application/json")]}
+    start, body = middleware.optimize(scope, start, body, if_none_match, accept_encoding)
+    return start["status"], dict(start["headers"]), body
+
+
+def test_etag_matches_weak_and_content_coded_tags():
+    assert etag_matches('W/"abc"', '"abc"')
+    assert etag_matches('"zzz", "abc-gzip"', '"abc"')
+    assert etag_matches("*", '"abc"')
+    assert not etag_matches('"abd"', '"abc"')
+    assert not etag_matches("", '"abc"')
+
+
+def test_compressed_response_gets_its_own_etag_and_policy():
+    status, headers, body = optimize()
+    assert status == 200
+    assert headers[b"content-encoding"] == b"gzip"
+    assert headers[b"etag"].endswith(b'-gzip"')
+    assert headers[b"cache-control"] == b"no-cache"
+    assert gzip.decompress(body) == BODY
+
+
+def test_matching_if_none_match_gets_an_empty_304():
+    _, headers, _ = optimize()
+    status, not_modified, body = optimize(if_none_match=headers[b"etag"].decode())
+    assert status == 304 and body == b""
+    assert b"content-type" not in not_modified
+    assert not_modified[b"etag"] == headers[b"etag"]
+
+
+def test_policies_apply_only_to_get_and_head():
+    _, head, _ = optimize(method="HEAD")
+    assert head[b"cache-control"] == b"no-cache"
+    _, post, _ = optimize(method="POST")
+    assert b"cache-control" not in post and b"etag" not in post
+    assert post[b"content-encoding"] == b"gzip"
+
+
+def test_small_responses_on_routes_without_a_policy_pass_through():
+    status, headers, body = optimize(path="/api/v1/score", body=b'{"ok":true}')
+    assert status == 200 and body == b'{"ok":true}'
+    assert b"etag" not in headers and b"content-encoding" not in headers
+
+
+def test_leaderboard_polling_revalidates(client):
+    for _ in range(100):
+        if api.leaderboard_engine.loaded:
+            break
+        time.sleep(0.02)
+    first = client.get("/api/v1/leaderboard")
+    assert first.status_code == 200
+    assert first.headers["cache-control"] == "no-cache"
+    again = client.get("/api/v1/leaderboard", headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304 and again.content == b""
+
+
+def test_get_lesson_is_cacheable(client):
+    response = client.get("/api/v1/generate_lesson", params={"topic": "deepfakes"})
+    assert response.status_code == 200
+    assert response.headers["cache-control"] == "public, max-age=3600"
+    assert response.headers["etag"]
+    posted = client.post("/api/v1/generate_lesson", json={"topic": "deepfakes"})
+    assert posted.status_code == 200
+    assert "cache-control" not in posted.headers
@@ -0,0 +1,76 @@
+# tests/test_score_batch.py
+import asyncio
+import json
+
+import app.api as api
+from bench.fake_gemini import FakeGenerativeModel, batch_ids
+from app.llm import ModelBusyError
+from app.models import ScoreBatchItem, ScoreResponse
+
+
+def items(count: int) -> list:
+    return [ScoreBatchItem(id=f"r{i}", scenario_id="unknown", user_reply=f"Reply number {i}, please be kind.", locale="en")
+            for i in range(count)]
+
+
+class RecordingModel(FakeGenerativeModel):
+    """ The fake model, remembering how many replies each batch prompt carried (0 = not a batch). """
+    def __init__(self):
+        super().__init__(latency_ms=0, jitter_ms=0, seed=0)
+        self.batches = []
+
+    def _reply(self, prompt, generation_config) -> str:
+        self.batches.append(len(batch_ids(prompt)))
+        return super()._reply(prompt, generation_config)
+
+
+class DropsLastReply(RecordingModel):
+    def _reply(self, prompt, generation_config) -> str:
+        body = json.loads(super()._reply(prompt, generation_config))
+        if "results" in body:
+            body["results"] = body["results"][:-1]
+        return json.dumps(body)
+
+
+class ChokesOnLargeBatches(RecordingModel):
+    def _reply(self, prompt, generation_config) -> str:
+        text = super()._reply(prompt, generation_config)
+        return "Sorry, that is too many replies at once." if self.batches[-1] > 2 else text
+
+
+def run_chunk(monkeypatch, model, chunk) -> dict:
+    monkeypatch.setattr(api.llm, "model", model)
+    return asyncio.run(api.score_batch_chunk(chunk))
+
+
+def test_one_call_scores_the_whole_chunk(monkeypatch):
+    model = RecordingModel()
+    results = run_chunk(monkeypatch, model, items(5))
+    assert sorted(results) == [f"r{i}" for i in range(5)]
+    assert all(isinstance(result, ScoreResponse) for result in results.values())
+    assert model.batches == [5]
+
+
+def test_replies_the_model_skipped_are_retried(monkeypatch):
+    model = DropsLastReply()
+    results = run_chunk(monkeypatch, model, items(4))
+    assert all(isinstance(result, ScoreResponse) for result in results.values()) and len(results) == 4
+    # The lone missing reply falls back to the single-reply prompt
+    assert model.batches == [4, 0]
+
+
+def test_a_batch_that_fails_entirely_is_halved(monkeypatch):
+    model = ChokesOnLargeBatches()
+    results = run_chunk(monkeypatch, model, items(4))
+    assert all(isinstance(result, ScoreResponse) for result in results.values()) and len(results) == 4
+    # The 4-reply call, its JSON re-ask, then two 2-reply calls
+    assert model.batches[0] == 4 and sorted(model.batches[2:]) == [2, 2]
+
+
+def test_quota_errors_are_not_split(monkeypatch):
+    model = RecordingModel()
+    model.error_rate = 1.0
+    monkeypatch.setattr(api.llm, "max_retries", 0)
+    results = run_chunk(monkeypatch, model, items(4))
+    assert all(isinstance(result, ModelBusyError) for result in results.values())
+    assert model.calls == 1
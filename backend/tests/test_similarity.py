@@ -0,0 +1,69 @@
+# tests/test_similarity.py
+import pytest
+
+from app.similarity import NearDuplicateCache, jaccard, normalize_reply, shingles
+
+REPLY = normalize_reply("Please be respectful, everyone deserves to feel safe in this conversation.")
+
+
+@pytest.mark.parametrize("raw, locale, expected", [
+    ("Please, be RESPECTFUL!!", "en", "please be respectful"),
+    ("that's sooooo rude 😡", "en", "thats soo rude"),
+    ("Café​  ２０२४", "en", "cafe 2024"),
+    ("कृपया सम्मान गर्नुहोस्", "ne", "कृपया सम्मान गर्नुहोस्"),
+])
+def test_normalize_reply(raw, locale, expected):
+    assert normalize_reply(raw, locale) == expected
+
+
+def test_exact_and_near_duplicates_hit():
+    cache = NearDuplicateCache(threshold=0.85)
+    cache.set("s1", REPLY, {"score": 3})
+    assert cache.get("s1", REPLY) == ({"score": 3}, 1.0)
+    value, similarity = cache.get("s1", REPLY.replace("everyone", "everybody"))
+    assert value == {"score": 3}
+    assert 0.85 <= similarity < 1.0
+    assert cache.stats["exact_hits"] == 1 and cache.stats["near_hits"] == 1
+
+
+def test_different_replies_and_other_namespaces_miss():
+    cache = NearDuplicateCache(threshold=0.85)
+    cache.set("s1", REPLY, {"score": 3})
+    assert cache.get("s1", normalize_reply("You are all wrong and I will not listen.")) == (None, 0.0)
+    assert cache.get("s2", REPLY) == (None, 0.0)
+
+
+@pytest.mark.parametrize("stored, reply, locale", [
+    ("Everyone in this thread should be respectful to each other.",
+     "Everyone in this thread should not be respectful to each other.", "en"),
+    (REPLY, REPLY.replace("feel safe", "feel unsafe"), "en"),
+    ("I do agree with what you said about this.", "I don't agree with what you said about this.", "en"),
+    ("कृपया यस्तो कुरा सबैसँग गर्नुहोस्।", "कृपया यस्तो कुरा सबैसँग नगर्नुहोस्।", "ne"),
+])
+def test_negated_replies_never_reuse_a_score(stored, reply, locale):
+    stored, reply = normalize_reply(stored, locale), normalize_reply(reply, locale)
+    assert jaccard(shingles(stored), shingles(reply)) >= 0.85
+    cache = NearDuplicateCache(threshold=0.85)
+    cache.set("s1", stored, {"score": 3})
+    assert cache.get("s1", reply) == (None, 0.0)
+    assert cache.stats["negated"] == 1
+
+
+def test_eviction_removes_the_least_recently_used_entry_and_its_bands():
+    cache = NearDuplicateCache(max_entries=2)
+    for index, text in enumerate(["first reply about kindness", "second reply about respect", "third reply about safety"]):
+        if index == 2:
+            cache.get("s1", "first reply about kindness")   # keeps "first" fresh
+        cache.set("s1", text, index)
+    assert len(cache) == 2
+    assert cache.get("s1", "second reply about respect") == (None, 0.0)
+    assert cache.get("s1", "first reply about kindness")[0] == 0
+    assert all(key[1] != "second reply about respect" for members in cache._bands.values() for key in members)
+
+
+def test_precomputed_signature_matches_the_lookup_it_replaces():
+    cache = NearDuplicateCache(threshold=0.85)
+    signature = cache.signature(REPLY)
+    cache.set("s1", REPLY, {"score": 3}, signature)
+    near = REPLY.replace("everyone", "everybody")
+    assert cache.get("s1", near, cache.signature(near)) == cache.get("s1", near)
@@ -0,0 +1,56 @@
+# tests/test_streaming.py
+import json
+
+import pytest
+
+from app.streaming import StreamingJSONParser
+
+LESSON = {
+    "title": "Spotting {fakes} and \"deepfakes\"",
+    "content": ["First, check the source.", "Then look for [edits], commas, and \\ slashes.", {"tip": "zoom in"}],
+    "example": "A video of a \"politician\"",
+    "score": 3,
+}
+
+
+def feed_in(text: str, size: int) -> list:
+    parser = StreamingJSONParser()
+    events = []
+    for start in range(0, len(text), size):
+        events += parser.feed(text[start:start + size])
+    assert parser.done
+    return events
+
+
+@pytest.mark.parametrize("size", [1, 3, 40, 10000])
+def test_every_field_and_array_element_is_reported_once(size):
+    text = "```json\n" + json.dumps(LESSON, indent=1) + "\n```"
+    assert feed_in(text, size) == [
+        ("title", None, LESSON["title"]),
+        ("content", 0, LESSON["content"][0]),
+        ("content", 1, LESSON["content"][1]),
+        ("content", 2, LESSON["content"][2]),
+        ("example", None, LESSON["example"]),
+        ("score", None, 3),
+    ]
+
+
+def test_scalar_arrays_and_nested_objects():
+    text = '{"options": [1, 2.5, true, null], "meta": {"a": [1, 2]}, "empty": []}'
+    assert feed_in(text, 2) == [
+        ("options", 0, 1), ("options", 1, 2.5), ("options", 2, True), ("options", 3, None),
+        ("meta", None, {"a": [1, 2]}),
+    ]
+
+
+def test_events_wait_for_the_value_to_complete():
+    parser = StreamingJSONParser()
+    assert parser.feed('{"title": "Half a ti') == []
+    assert parser.feed('tle", "content": ["one"') == [("title", None, "Half a title"), ("content", 0, "one")]
+
+
+def test_result_repairs_a_truncated_reply():
+    parser = StreamingJSONParser()
+    parser.feed('{"title": "t", "content": ["a", "b"')
+    assert not parser.done
+    assert parser.result() == {"title": "t", "content": ["a", "b"]}
@@ -0,0 +1,164 @@
+# tests/test_telemetry.py
+import asyncio
+import gzip
+import json
+import threading
+import time
+from multiprocessing import Process
+
+from app.telemetry import FileTelemetrySink, TelemetryPipeline, empty_rollup, rollup_deltas
+
+
+def event(scenario_id="s1", **overrides):
+    return {"scenario_id": scenario_id, "rubric_score_gain": 2, "session_duration_seconds": 30,
+            "was_skipped": False, "was_flagged_distressing": False, **overrides}
+
+
+def append_batches(directory, worker):
+    sink = FileTelemetrySink(directory)
+    for batch in range(50):
+        sink.write([event(f"w{worker}-{batch}-{i}") for i in range(20)])
+
+
+def test_concurrent_workers_append_whole_gzip_members(tmp_path):
+    workers = [Process(target=append_batches, args=(str(tmp_path), worker)) for worker in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    lines = []
+    for path in tmp_path.iterdir():
+        with gzip.open(path, "rt", encoding="utf-8") as f:
+            lines += [json.loads(line) for line in f]
+    assert len(lines) == 4 * 50 * 20
+
+
+class FailingSink:
+    def write(self, events):
+        raise OSError("disk full")
+
+    def load_rollups(self):
+        return {}
+
+    def load_rollup(self, scenario_id):
+        return None
+
+
+def test_dropped_batches_are_not_counted_in_rollups():
+    async def scenario():
+        pipeline = TelemetryPipeline(FailingSink())
+        assert pipeline.offer(event())
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = asyncio.run(scenario())
+    assert pipeline.stats["dropped"] == 1
+    assert pipeline.overall["events"] == 0
+    assert pipeline.rollups == {}
+
+
+class FlakySink:
+    """ Fails the first `failures` writes; blocks each write until `release` is set, if given. """
+    def __init__(self, failures=0, release=None):
+        self.failures = failures
+        self.release = release
+        self.started = threading.Event()
+        self.batches = []
+        self.stored = {}
+
+    def write(self, events):
+        self.started.set()
+        if self.release is not None:
+            self.release.wait(5)
+        if self.failures:
+            self.failures -= 1
+            raise OSError("database is locked")
+        self.batches.append(events)
+        for scenario_id, counters in rollup_deltas(events).items():
+            stored = self.stored.setdefault(scenario_id, empty_rollup())
+            for field, value in counters.items():
+                stored[field] += value
+
+    def load_rollups(self):
+        return {}
+
+    def load_rollup(self, scenario_id):
+        return self.stored.get(scenario_id)
+
+
+def test_failed_batches_are_retried_with_backoff():
+    async def scenario():
+        pipeline = TelemetryPipeline(FlakySink(failures=2), flush_interval=0.01, retry_delay=0.01)
+        pipeline.start()
+        assert pipeline.offer(event())
+        while not pipeline.stats["batches"]:
+            await asyncio.sleep(0.01)
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = asyncio.run(scenario())
+    assert len(pipeline.sink.batches) == 1
+    assert pipeline.stats["retries"] == 2 and pipeline.stats["dropped"] == 0
+    assert pipeline.overall["events"] == 1
+
+
+def test_a_batch_is_dropped_after_max_attempts():
+    async def scenario():
+        pipeline = TelemetryPipeline(FlakySink(failures=10), flush_interval=0.01, max_attempts=3, retry_delay=0.01)
+        pipeline.start()
+        assert pipeline.offer(event())
+        while not pipeline.stats["dropped"]:
+            await asyncio.sleep(0.01)
+        await pipeline.stop()
+        return pipeline
+
+    pipeline = asyncio.run(scenario())
+    assert pipeline.sink.failures == 7
+    assert pipeline.stats["retries"] == 2 and pipeline.overall["events"] == 0
+
+
+def test_stop_finishes_the_batch_being_written():
+    async def scenario():
+        release = threading.Event()
+        pipeline = TelemetryPipeline(FlakySink(release=release), flush_interval=0.01)
+        pipeline.start()
+        assert pipeline.offer(event())
+        while not pipeline.sink.started.is_set():
+            await asyncio.sleep(0.01)
+        stopping = asyncio.create_task(pipeline.stop())
+        await asyncio.sleep(0.05)
+        release.set()
+        await stopping
+        return pipeline
+
+    pipeline = asyncio.run(scenario())
+    assert pipeline.stats["written"] == 1
+    assert pipeline.overall["events"] == 1 and pipeline.rollups["s1"]["events"] == 1
+
+
+def test_evicted_rollups_are_read_back_from_the_sink():
+    async def scenario():
+        pipeline = TelemetryPipeline(FlakySink(), max_tracked_scenarios=1)
+        for scenario_id in ("s1", "s2", "s1", "s3"):
+            pipeline.offer(event(scenario_id))
+        await pipeline.stop()
+        return pipeline, await pipeline.rollup("s1"), await pipeline.rollup("unknown")
+
+    pipeline, rollup, unknown = asyncio.run(scenario())
+    assert "s1" not in pipeline.rollups
+    assert rollup["events"] == 2
+    assert unknown is None
+
+
+def test_scenario_rollup_endpoint_reads_evicted_scenarios_from_the_database(client):
+    from app import api
+
+    payload = {**event("evicted-scenario"), "gentle_mode_active": False}
+    assert client.post("/api/v1/telemetry", json=payload).status_code == 202
+    deadline = time.monotonic() + 5
+    while "evicted-scenario" not in api.telemetry_pipeline.rollups and time.monotonic() < deadline:
+        time.sleep(0.02)
+    api.telemetry_pipeline.rollups.pop("evicted-scenario")
+    response = client.get("/api/v1/telemetry/rollups/evicted-scenario")
+    assert response.status_code == 200
+    assert response.json()["events"] == 1
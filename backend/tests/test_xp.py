@@ -0,0 +1,95 @@
+# tests/test_xp.py
+import asyncio
+
+import pytest
+from sqlalchemy.exc import IntegrityError, OperationalError
+
+from app.xp import XPBacklogFull, XPBatcher
+
+
+def test_cap_merges_known_users_and_rejects_new_ones():
+    batcher = XPBatcher(max_pending_users=2)
+    batcher.add("a", "A", 1)
+    batcher.add("b", "B", 1)
+    batcher.add("a", "A", 5)
+    with pytest.raises(XPBacklogFull):
+        batcher.add("c", "C", 1)
+    with pytest.raises(XPBacklogFull):
+        asyncio.run(batcher.submit_many([("a", "A", 1), ("d", "D", 1)]))
+    assert batcher._pending["a"]["total_xp"] == 6
+    assert set(batcher._pending) == {"a", "b"}
+    assert batcher.stats["rejected"] == 3
+
+
+def test_requeue_while_database_is_down_stays_under_the_cap():
+    async def down(rows):
+        raise OperationalError("upsert", {}, ConnectionError("db down"))
+
+    batcher = XPBatcher(max_pending_users=3, writer=down)
+
+    async def scenario():
+        for round_ in range(5):
+            for user in range(3):
+                try:
+                    batcher.add(f"u{round_}-{user}", "name", 1)
+                except XPBacklogFull:
+                    pass
+            with pytest.raises(OperationalError):
+                await batcher.flush()
+
+    asyncio.run(scenario())
+    assert len(batcher._pending) == 3
+
+
+def test_per_row_fallback_requeues_rows_that_failed_for_other_reasons():
+    written = []
+
+    async def writer(rows):
+        if len(rows) > 1:
+            raise IntegrityError("upsert", {}, ValueError("duplicate username"))
+        if rows[0]["user_id"] == "taken":
+            raise IntegrityError("upsert", {}, ValueError("duplicate username"))
+        if rows[0]["user_id"] == "flaky":
+            raise OperationalError("upsert", {}, ConnectionError("connection reset"))
+        written.extend(rows)
+
+    batcher = XPBatcher(writer=writer)
+    for user_id in ("ok", "taken", "flaky"):
+        batcher.add(user_id, user_id, 10)
+    with pytest.raises(OperationalError):
+        asyncio.run(batcher.flush())
+    assert [row["user_id"] for row in written] == ["ok"]
+    assert list(batcher._pending) == ["flaky"]
+
+
+def test_stop_waits_for_the_flush_in_flight():
+    written = []
+
+    async def slow_writer(rows):
+        await asyncio.sleep(0.1)
+        written.extend(rows)
+
+    async def scenario():
+        batcher = XPBatcher(window_seconds=0.01, writer=slow_writer)
+        batcher.start()
+        batcher.add("a", "A", 5)
+        while batcher._pending:
+            await asyncio.sleep(0.005)   # the flush has taken the row and is awaiting the writer
+        batcher.add("b", "B", 3)
+        await batcher.stop()
+        return batcher
+
+    batcher = asyncio.run(scenario())
+    assert sorted((row["user_id"], row["total_xp"]) for row in written) == [("a", 5), ("b", 3)]
+    assert not batcher._pending
+
+
+def test_upsert_returns_each_users_new_total():
+    from app.database import create_db_and_tables
+    from app.xp import upsert_xp
+    create_db_and_tables()
+    first = upsert_xp([{"user_id": "t-1", "username": "total-one", "total_xp": 5}])
+    second = upsert_xp([{"user_id": "t-1", "username": "total-one", "total_xp": 3},
+                        {"user_id": "t-2", "username": "total-two", "total_xp": 4}])
+    assert first == {"t-1": 5}
+    assert second == {"t-1": 8, "t-2": 4}